@@ -0,0 +1,216 @@
+# Timing comparisons between the current routines and the implementations they replaced.
+# Run with "python benchmark.py"; each benchmark also checks that the old and new outputs agree.
+import math
+import time
+
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+import gui  # Imported before data, as in main.py, since the two import each other
+import data
+import graph
+import peaky
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def report(name: str, old_time: float, new_time: float):
+    print("{0:<28} old {1:9.4f} s   new {2:9.4f} s   speedup {3:8.1f}x".format(name, old_time, new_time,
+                                                                               old_time / max(new_time, 1e-9)))
+
+
+# Synthetic spectrum: a few thousand Lorentzian lines on top of noise
+def make_spectrum(points: int, lines: int = 5000, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    freq = np.linspace(6000.0, 18000.0, points)
+    inten = np.abs(rng.normal(0.0, 0.0005, points))
+    centres = rng.uniform(6000.0, 18000.0, lines)
+    heights = rng.uniform(0.001, 0.2, lines)
+    width = 0.05
+    for centre, height in zip(centres, heights):
+        lo, hi = np.searchsorted(freq, (centre - 20 * width, centre + 20 * width))
+        inten[lo:hi] += height / (1 + ((freq[lo:hi] - centre) / width) ** 2)
+    return np.column_stack((freq, inten))
+
+
+# The per-point loop peaky.peakpicker used before it was vectorized
+def loop_peakpicker(spectrum, thresh_l, thresh_h):
+    peaks = []
+    for i in range(1, len(spectrum) - 1):
+        if spectrum[i, 1] > thresh_l and spectrum[i, 1] < thresh_h and spectrum[i, 1] > spectrum[(i - 1), 1] and \
+                spectrum[i, 1] > spectrum[(i + 1), 1]:
+            peaks.append(spectrum[i])
+
+    peakpicks = np.zeros((len(peaks), 2))
+    for i, row in enumerate(peaks):
+        peakpicks[i, 0] = row[0]
+        peakpicks[i, 1] = row[1]
+    freq_low = spectrum[0, 0]
+    freq_high = spectrum[-1, 0]
+    return peakpicks, freq_low, freq_high
+
+
+def bench_peakpicker(points: int = 2_000_000):
+    spectrum = make_spectrum(points)
+    (old, old_low, old_high), old_time = timed(loop_peakpicker, spectrum, 0.001, 0.3)
+    (new, new_low, new_high), new_time = timed(peaky.peakpicker, spectrum, 0.001, 0.3)
+    assert np.array_equal(old, new) and old_low == new_low and old_high == new_high
+    report("peaky.peakpicker", old_time, new_time)
+
+
+# The nested loop data.remove_from used before peaky.within_tolerance; returns the labels of the rows to remove
+def loop_remove_from(on_nump, from_nump, threshold):
+    to_drop = np.zeros(on_nump.size)
+    index = 0
+    on_index = 0
+    for value in on_nump:
+        for value1 in from_nump:
+            if value + threshold > value1 > value - threshold:
+                to_drop[index] = on_index
+                index += 1
+                break
+        on_index += 1
+    return to_drop[0:index]
+
+
+def bench_remove_from(peaks: int = 2000, lines: int = 20000, threshold: float = 0.05):
+    rng = np.random.default_rng(0)
+    on = pd.DataFrame({"Frequency (MHz)": np.sort(rng.uniform(6000.0, 18000.0, peaks)),
+                       "Intensity": rng.uniform(0.0, 1.0, peaks)})
+    catalogue = rng.uniform(6000.0, 18000.0, lines)
+    catalogue = catalogue[(catalogue < on["Frequency (MHz)"].max()) & (catalogue > on["Frequency (MHz)"].min())]
+    old, old_time = timed(loop_remove_from, on["Frequency (MHz)"].to_numpy(), catalogue, threshold)
+    new, new_time = timed(peaky.within_tolerance, on["Frequency (MHz)"].to_numpy(), catalogue, threshold)
+    assert np.array_equal(old, np.flatnonzero(new))
+    report("data.remove_from matching", old_time, new_time)
+
+
+# The per-element transforms data.Data.modify_data applied before it used NumPy ufuncs
+def apply_modify(frame, column, operator, value):
+    if operator == "*":
+        frame[column] = frame[column].apply(func=lambda x: x * value)
+    elif operator == "/":
+        frame[column] = frame[column].apply(func=lambda x: x / value)
+    elif operator == "^":
+        frame[column] = frame[column].apply(func=lambda x: math.pow(x, value))
+    elif operator == "log":
+        frame[column] = frame[column].apply(func=lambda x: math.log(x, value))
+
+
+def bench_modify_data(points: int = 2_000_000):
+    spectrum = make_spectrum(points)
+    for operator, value in (("*", 3.0), ("/", 3.0), ("^", 2.0), ("log", 10.0)):
+        old = pd.DataFrame({"Frequency (MHz)": spectrum[:, 0], "Intensity": spectrum[:, 1]})
+        new = data.Data(old.copy(), None, "benchmark", "Frequency (MHz)")
+        _, old_time = timed(apply_modify, old, "Intensity", operator, value)
+        _, new_time = timed(new.modify_data, "Intensity", operator, [value])
+        assert np.allclose(old["Intensity"], new.data_frame["Intensity"], rtol=1e-12, atol=0)
+        report("data.modify_data " + operator, old_time, new_time)
+
+
+# Draws the dataset into an off-screen figure the size of the app's, returning the pixels
+def render(dataset):
+    figure = Figure(figsize=(12, 8), layout="compressed")
+    FigureCanvasAgg(figure)
+    dataset.graph.plot(figure.add_subplot())
+    figure.canvas.draw()
+    return np.asarray(figure.canvas.buffer_rgba())
+
+
+def bench_plot_decimation(points: int = 2_000_000, stems: int = 300_000):
+    for gtype, count in ((graph.LINE, points), (graph.STEM, stems)):
+        spectrum = make_spectrum(count)
+        dataset = data.Data(pd.DataFrame({"Frequency (MHz)": spectrum[:, 0], "Intensity": spectrum[:, 1]}), None,
+                            "benchmark", "Frequency (MHz)")
+        dataset.graph.column_gtypes["Intensity"] = gtype
+        factor = graph.DECIMATE_FACTOR
+        graph.DECIMATE_FACTOR = np.inf
+        old, old_time = timed(render, dataset)
+        graph.DECIMATE_FACTOR = factor
+        new, new_time = timed(render, dataset)
+        # Only antialiasing at a few edges should differ, much as matplotlib's own path simplification does
+        changed = (np.abs(old.astype(np.int64) - new.astype(np.int64)).max(axis=2) > 128).mean()
+        assert changed < 0.002
+        report("graph.Graph.plot (" + graph.gtype_from_val[gtype] + ")", old_time, new_time)
+
+
+# The points Graph.plot hands to matplotlib for a window, found as before pyramids: a mask over the x-axis, then
+# decimation of the rows inside it
+def decimate_window(dataset, xmin, xmax, bins):
+    cut = dataset.data_frame[dataset.data_frame[dataset.freq_ax].between(xmin, xmax)]
+    return graph.decimate(cut[dataset.freq_ax].to_numpy(), cut["Intensity"].to_numpy(), graph.LINE,
+                          bins // graph.BINS_PER_PIXEL, True)
+
+
+# The same points as Graph.visible finds them: from the pyramid, or by decimating the rows in the window when it is too
+# short for the pyramid's blocks
+def pyramid_window(dataset, xmin, xmax, bins):
+    start, stop = dataset.rows(xmin, xmax)
+    pyramid = dataset.pyramid("Intensity")
+    index = pyramid.envelope(start, stop, bins)
+    if index is None:
+        return graph.decimate(dataset.column(dataset.freq_ax).to_numpy()[start:stop], pyramid.y[start:stop],
+                              graph.LINE, bins // graph.BINS_PER_PIXEL, True)
+    return dataset.column(dataset.freq_ax).to_numpy()[index], pyramid.y[index]
+
+
+def bench_pyramid(points: int = 20_000_000, pixels: int = 1200):
+    spectrum = make_spectrum(points)
+    dataset = data.Data(pd.DataFrame({"Frequency (MHz)": spectrum[:, 0], "Intensity": spectrum[:, 1]}), None,
+                        "benchmark", "Frequency (MHz)")
+    bins = graph.BINS_PER_PIXEL * pixels
+    _, build_time = timed(dataset.pyramid, "Intensity")
+    print("{0:<28} built in {1:.4f} s".format("graph.Pyramid", build_time))
+    for xmin, xmax in ((6000.0, 18000.0), (9000.0, 12000.0), (9000.0, 9100.0)):
+        (old_x, old_y), old_time = timed(decimate_window, dataset, xmin, xmax, bins)
+        (new_x, new_y), new_time = timed(pyramid_window, dataset, xmin, xmax, bins)
+        # Both keep the window's ends and extremes
+        assert old_y.max() == new_y.max() and old_y.min() == new_y.min()
+        assert old_x[0] == new_x[0] and old_x[-1] == new_x[-1]
+        report("window {0:.0f}-{1:.0f} MHz".format(xmin, xmax), old_time, new_time)
+
+
+# Median time of a redraw with 'draw' while panning a zoomed-in view, building the plot again for each frame if
+# 'rebuild'
+def pan_frames(canvas, graph_dat, draw, rebuild: bool = False, frames: int = 10):
+    times = []
+    for _ in range(frames):
+        step = (graph_dat.xmax - graph_dat.xmin) * 0.05
+        graph_dat.set_scale(xmin=graph_dat.xmin + step, xmax=graph_dat.xmax + step)
+        if rebuild:
+            canvas.drawn = None
+        _, frame_time = timed(draw)
+        times.append(frame_time)
+    return float(np.median(times))
+
+
+def bench_redraw(points: int = 2_000_000):
+    spectrum = make_spectrum(points)
+    dataset = data.Data(pd.DataFrame({"Frequency (MHz)": spectrum[:, 0], "Intensity": spectrum[:, 1]}), None,
+                        "benchmark", "Frequency (MHz)")
+    canvas = graph.GraphCanvas(None)
+    canvas.set_canvas(FigureCanvasAgg(canvas.figure))
+    canvas.set_graph(dataset.graph)
+    canvas.graph()
+    dataset.graph.set_scale(xmin=9000.0, xmax=10000.0)
+    old_time = pan_frames(canvas, dataset.graph, canvas.graph, rebuild=True)
+    new_time = pan_frames(canvas, dataset.graph, canvas.graph)
+    report("graph.GraphCanvas pan frame", old_time, new_time)
+    canvas.draft()  # The first draft saves the background
+    draft_time = pan_frames(canvas, dataset.graph, canvas.draft)
+    report("graph.GraphCanvas draft", old_time, draft_time)
+
+
+if __name__ == "__main__":
+    bench_peakpicker()
+    bench_remove_from()
+    bench_modify_data()
+    bench_plot_decimation()
+    bench_pyramid()
+    bench_redraw()
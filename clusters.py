@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import numpy as np
+import scipy.spatial
+
+# Grouping of lines by their intensity ratios across spectra.  A line of a species keeps the same intensity ratios
+# between spectra taken under different conditions, so every line is placed by its vector of log10 ratios to one
+# reference spectrum, and the lines of a species pile up around one point.  The vectors are binned onto a grid whose
+# cells are 'cell' wide in every direction, and every cell holding more lines than all the cells touching it (corners
+# included) is the centre of a cluster.  Each line then joins the nearest centre no more than one cell away in every
+# direction, so a cluster never grows past the lines around its centre, however many lines lie between clusters.
+# The lines left over are searched for centres again, which finds a species next to a denser one.  Only the occupied
+# cells are compared, through a KD-tree over their integer coordinates, so the work grows with the number of lines
+# and not with the number of possible pairs.
+
+UNCLUSTERED = -1
+
+
+# log10 ratios of every column of 'values' to column 'against', without the column itself.  Rows where an
+# intensity is missing or not positive have no vector and are NaN.
+def log_ratios(values: np.ndarray, against: int) -> np.ndarray:
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        logs = np.log10(np.where(values > 0, values, np.nan))
+    return np.delete(logs, against, axis=1) - logs[:, against, None]
+
+
+# Cluster label of every row of 'vectors', numbered from 0 by decreasing size.  Rows with a NaN coordinate, rows
+# further than 'cell' from every cluster centre and clusters of fewer than 'min_size' lines are UNCLUSTERED.
+def grid_clusters(vectors: np.ndarray, cell: float, min_size: int = 2) -> np.ndarray:
+    labels = np.full(len(vectors), UNCLUSTERED, dtype=np.int64)
+    valid = ~np.isnan(vectors).any(axis=1)
+    if not valid.any():
+        return labels
+    if vectors.shape[1] == 0:  # A single column has nothing to compare against, so every line shares one cluster
+        labels[valid] = 0 if valid.sum() >= min_size else UNCLUSTERED
+        return labels
+
+    # Lines too far from every centre are looked at again for centres of their own, until none of their cells is a
+    # centre holding 'min_size' lines
+    points = vectors[valid] / cell
+    nearest = np.full(len(points), -1, dtype=np.int64)
+    remaining = np.arange(len(points))
+    count = 0
+    while remaining.size > 0:
+        means = _centres(points[remaining], min_size)
+        if len(means) == 0:
+            break
+        distance, index = scipy.spatial.cKDTree(means).query(points[remaining], p=np.inf, distance_upper_bound=1.0)
+        joined = ~np.isinf(distance)
+        nearest[remaining[joined]] = count + index[joined]
+        count += len(means)
+        remaining = remaining[~joined]
+    nearest[nearest < 0] = count
+
+    # Renumber by size, dropping the small clusters
+    sizes = np.bincount(nearest, minlength=count + 1)[:-1]
+    order = np.argsort(-sizes, kind="stable")
+    rank = np.full(count + 1, UNCLUSTERED, dtype=np.int64)
+    rank[order] = np.arange(count)
+    rank[:-1][sizes < min_size] = UNCLUSTERED
+    labels[valid] = rank[nearest]
+    return labels
+
+
+# Centres of the clusters of 'points' (in units of cells): the mean of the points in every cell that holds at least
+# 'min_size' points and more than all the cells touching it, ties going to the first cell
+def _centres(points: np.ndarray, min_size: int) -> np.ndarray:
+    cells, members, counts = np.unique(np.floor(points).astype(np.int64), axis=0, return_inverse=True,
+                                       return_counts=True)
+    members = members.ravel()
+    density = np.empty(len(cells), dtype=np.int64)
+    density[np.lexsort((-np.arange(len(cells)), counts))] = np.arange(len(cells))
+    pairs = scipy.spatial.cKDTree(cells).query_pairs(r=1, p=np.inf, output_type="ndarray")
+    centre = np.ones(len(cells), dtype=bool)
+    centre[np.where(density[pairs[:, 0]] < density[pairs[:, 1]], pairs[:, 0], pairs[:, 1])] = False
+    centre &= counts >= min_size
+
+    index = np.full(len(cells), -1, dtype=np.int64)
+    index[centre] = np.arange(centre.sum())
+    point_centres = index[members]
+    inside = point_centres >= 0
+    means = np.column_stack([np.bincount(point_centres[inside], weights=points[inside, axis],
+                                         minlength=centre.sum()) for axis in range(points.shape[1])])
+    return means / counts[centre, None]
@@ -0,0 +1,23 @@
+import pytest
+
+import gui  # Imported before data, as in main.py, since the two import each other
+
+
+# Stands in for gui.DataStorage, recording what would have been added to the data list
+class Storage:
+    def __init__(self):
+        self.added = []
+
+    def add_data(self, data=None, **kwargs):
+        self.added.append(dict(kwargs, data=data))
+
+
+# Stands in for gui.App, the owner every Data refers back to
+class Owner:
+    def __init__(self):
+        self.data_storage = Storage()
+
+
+@pytest.fixture
+def owner() -> Owner:
+    return Owner()
@@ -4,29 +4,151 @@ import numpy as np
 import pandas as pd
 
 import peaky
+import clusters
+import filters
+import library
+import lineshape
 import gui
 import graph as gph
 import pickle
 
-import math
 import copy
-from typing import Callable, AnyStr, Union, Any
+import hashlib
+import heapq
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from typing import Callable, AnyStr, Union
+
+# Peak picking methods offered in PeakPickWindow
+SPLINE = "Spline"
+SEGMENTED = "Segmented Spline"
+REFINE_PARABOLIC = "Refine (Parabolic)"
+REFINE_GAUSSIAN = "Refine (Gaussian)"
+REFINE_SPLINE = "Refine (Local Spline)"
+NOISE = "Noise Adaptive"
+PEAK_METHODS = [SPLINE, SEGMENTED, REFINE_PARABOLIC, REFINE_GAUSSIAN, REFINE_SPLINE, NOISE]
+# Refinement methods work on the original grid, so they do not use the adjusted resolution
+REFINE_METHODS = {REFINE_PARABOLIC: peaky.PARABOLIC, REFINE_GAUSSIAN: peaky.GAUSSIAN,
+                  REFINE_SPLINE: peaky.SPLINE}
+# Suffix of the columns holding the signal-to-noise ratio of noise adaptive picks
+SNR_SUFFIX = " SNR"
+# How ratio_mask combines the tests of several columns
+AND = "and"
+OR = "or"
+# Rows whose ratios are computed at once by ratio_mask
+RATIO_BLOCK = 1_000_000
+# Rows taken from a dataset at a time by merge_datasets
+JOIN_BLOCK = 1_000_000
+# Where PeakCache keeps its entries when they are saved to disk
+PEAK_CACHE_DIR = "peak_cache"
+# Column written by ratio_clusters
+CLUSTER_COLUMN = "Ratio Cluster"
+
+
+# Scales every column so its largest magnitude is 'scale'
+def _normalise(values: np.ndarray, scale: float, out: np.ndarray) -> np.ndarray:
+    return np.multiply(values, scale / np.nanmax(np.abs(values)), out=out)
+
+
+# Transforms offered by DataModifier, written as f(values, argument, out=...) so each one runs over the column once
+# and writes its result back into the same array
+MODIFY_OPERATORS = {
+    "+": np.add,
+    "-": np.subtract,
+    "*": np.multiply,
+    "/": np.divide,
+    "^": np.power,
+    "log": lambda values, base, out: np.divide(np.log(values, out=out), np.log(base), out=out),
+    "dB": lambda values, reference, out: np.multiply(np.log10(np.divide(values, reference, out=out), out=out), 10,
+                                                     out=out),
+    "norm": _normalise,
+}
+# Arguments used when an operator is given without one: decibels relative to 1 and normalisation to a maximum of 1
+MODIFY_DEFAULTS = {"dB": 1.0, "norm": 1.0}
+
+
+class NotNumericError(ValueError):
+    """A column to modify does not hold numbers"""
+    pass
 
 
 class PickledData:
     def __init__(self, dataset: Data):
-        self.data_frame = dataset.data_frame
+        self.data_frame = dataset.full_frame()
         self.name = dataset.name
         self.gtypes = dataset.graph.column_gtypes
         self.freq_ax = dataset.freq_ax
         self.is_ratio = dataset.is_ratio
 
 
+# Several spectra linearly interpolated onto one evenly spaced frequency grid, covering all of them.  Points outside
+# a spectrum's range are NaN in its columns.  The grid is only evaluated over the frequency window asked for, so a
+# dataset can hold it and plot any zoomed range without building every row.
+class CommonGrid:
+    def __init__(self, datasets: list, step: float = None):
+        self.freq_ax = datasets[0].freq_ax
+        self.gtypes = {self.freq_ax: datasets[0].graph.column_gtypes.get(datasets[0].freq_ax, gph.LINE)}
+        self.sources = []
+        steps = []
+        for dataset in datasets:
+            frame = dataset.data_frame.dropna(subset=[dataset.freq_ax]).sort_values(by=dataset.freq_ax)
+            freqs = frame[dataset.freq_ax].to_numpy(dtype=np.float64)
+            columns = {}
+            for column in frame.columns:  # Only numeric columns can be interpolated
+                if column == dataset.freq_ax or frame[column].dtype.kind not in "fiu":
+                    continue
+                target = column if column not in self.gtypes else column + " (" + dataset.name + ")"
+                columns[target] = frame[column].to_numpy(dtype=np.float64)
+                self.gtypes[target] = dataset.graph.column_gtypes.get(column, gph.LINE)
+            if freqs.size > 0:
+                self.sources.append((freqs, columns))
+            if freqs.size > 1:
+                steps.append(np.median(np.diff(freqs)))
+
+        self.start = min(freqs[0] for freqs, columns in self.sources)
+        end = max(freqs[-1] for freqs, columns in self.sources)
+        self.step = step if step else min([value for value in steps if value > 0] or [1.0])
+        self.count = int(np.floor((end - self.start) / self.step + 1e-9)) + 1
+
+    def limits(self):
+        return self.start, self.start + (self.count - 1) * self.step
+
+    # Columns of the frames window() builds, in their order
+    def columns(self) -> list:
+        return [self.freq_ax] + [column for freqs, columns in self.sources for column in columns]
+
+    # Grid points between xmin and xmax, with every column interpolated onto them
+    def window(self, xmin: float = -np.inf, xmax: float = np.inf) -> pd.DataFrame:
+        low = int(np.clip(np.ceil((xmin - self.start) / self.step - 1e-9), 0, self.count))
+        high = int(np.clip(np.floor((xmax - self.start) / self.step + 1e-9) + 1, low, self.count))
+        grid = self.start + np.arange(low, high) * self.step
+        frame = {self.freq_ax: grid}
+        for freqs, columns in self.sources:
+            for column, values in columns.items():
+                frame[column] = np.interp(grid, freqs, values, left=np.nan, right=np.nan)
+        return pd.DataFrame(frame)
+
+
+# Where the values of a column are held, which changes whenever the column is replaced
+def _address(series: pd.Series) -> tuple:
+    values = series.to_numpy()
+    return values.__array_interface__["data"][0], values.shape
+
+
 # Container class for a pandas DataFrame, with additional information relative to this app's functions
 class Data:
     def __init__(self, data_frame: pd.DataFrame, owner: gui.App, name: str, freq_ax: str, x_ax: str = None,
-                 gtypes: dict = None, is_ratio: bool = False):
+                 gtypes: dict = None, is_ratio: bool = False, grid: CommonGrid = None):
+        self.derived = {}  # Columns computed from other columns when needed: name -> (input columns, function)
+        self.derived_cache = {}  # name -> (state of the inputs it was computed from, values)
+        self.version = 0  # Bumped whenever the stored columns change, so derived columns are computed again
+        self.pyramids = {}  # Plotted column -> (state of the column it was built from, graph.Pyramid)
+        self.sorted_state = None  # (state of the x-axis, whether it is in increasing order)
         self.data_frame = data_frame
+        self.grid = grid  # Spectra resampled onto a common grid, evaluated only where needed until first access
         self.owner = owner
         self.name = name
         self.freq_ax = freq_ax
@@ -38,79 +160,198 @@ class Data:
         self.graph = gph.Graph(self, gtypes)
         self.is_ratio = is_ratio
 
+    # A lazily resampled dataset builds its full frame the first time anything needs all of its rows
+    @property
+    def data_frame(self) -> pd.DataFrame:
+        if self.grid is not None:
+            self._data_frame = self.grid.window()
+            self.grid = None
+        return self._data_frame
+
+    @data_frame.setter
+    def data_frame(self, frame: pd.DataFrame):
+        self._data_frame = frame
+        self.grid = None
+        self.changed()
+
+    def changed(self):
+        self.version += 1
+        self.pyramids = {}
+
+    # Adds a column holding func(*inputs) of other (stored or derived) columns.  It is not stored in the frame, but
+    # computed the first time it is plotted, filtered on or exported, and kept until one of its inputs changes.
+    def add_derived(self, name: str, inputs: list, func: Callable, gtype: int = gph.NONE):
+        self.derived[name] = (list(inputs), func)
+        self.derived_cache.pop(name, None)
+        self.graph.column_gtypes[name] = gtype
+
+    # Names of the stored and derived columns
+    def columns(self) -> list:
+        stored = self.grid.columns() if self.grid is not None else self.data_frame.columns.values.tolist()
+        return stored + [name for name in self.derived if name not in stored]
+
+    # Values of a stored or derived column
+    def column(self, name: str) -> pd.Series:
+        if name not in self.derived or name in self.data_frame.columns:
+            return self.data_frame[name]
+        inputs, func = self.derived[name]
+        series = [self.column(column) for column in inputs]
+        # A derived column is up to date while the frame is the same object, has not been modified through this
+        # dataset and its inputs still point at the same memory
+        state = (self.version, id(self.data_frame)) + tuple(_address(column) for column in series)
+        cached = self.derived_cache.get(name)
+        if cached is None or cached[0] != state:
+            values = pd.Series(func(*series), index=self.data_frame.index, name=name)
+            self.derived_cache[name] = cached = (state, values)
+        return cached[1]
+
+    # Derived column evaluated on some rows of the frame, without caching
+    def _evaluate(self, name: str, frame: pd.DataFrame) -> pd.Series:
+        if name not in self.derived or name in frame.columns:
+            return frame[name]
+        inputs, func = self.derived[name]
+        return pd.Series(func(*(self._evaluate(column, frame) for column in inputs)), index=frame.index, name=name)
+
+    # Stores the derived columns computed, directly or through other derived columns, from any of 'columns' as
+    # ordinary columns holding their current values, so that they outlive those columns
+    def store_dependents(self, columns: list):
+        removed = set(columns)
+        dependents = []
+        for name in self.derived:
+            if name not in self.data_frame.columns and self._depends(name, removed):
+                dependents.append(name)
+        if not dependents:
+            return
+        values = {name: self.column(name) for name in dependents}
+        for name in dependents:
+            self.derived.pop(name)
+            self.derived_cache.pop(name, None)
+        self.data_frame = self.data_frame.assign(**values)
+
+    def _depends(self, name: str, columns: set) -> bool:
+        inputs = self.derived[name][0]
+        return any(column in columns or column in self.derived and column not in self.data_frame.columns and
+                   self._depends(column, columns) for column in inputs)
+
+    # The frame with every derived column added, for exporting and saving
+    def full_frame(self) -> pd.DataFrame:
+        names = [name for name in self.derived if name not in self.data_frame.columns]
+        if not names:
+            return self.data_frame
+        return self.data_frame.assign(**{name: self.column(name) for name in names})
+
+    # Rows with the x-axis between xmin and xmax, with the derived columns that are plotted
+    def view(self, xmin, xmax) -> pd.DataFrame:
+        plotted = [name for name in self.derived if self.graph.column_gtypes.get(name, gph.NONE) != gph.NONE]
+        if self.grid is not None and self.ax == self.freq_ax:
+            frame = self.grid.window(xmin, xmax)
+            return frame.assign(**{name: self._evaluate(name, frame) for name in plotted})
+        rows = self.rows(xmin, xmax)
+        if rows is not None:
+            frame = self.data_frame.iloc[rows[0]:rows[1]]
+        else:
+            frame = self.data_frame[self.column(self.ax).between(xmin, xmax)]
+        return frame.assign(**{name: self.column(name)[frame.index] for name in plotted})
+
+    # Whether the x-axis is in increasing order, checked once after each change
+    def x_sorted(self) -> bool:
+        x = self.column(self.ax)
+        state = (self.version, id(self.data_frame), _address(x))
+        if self.sorted_state is None or self.sorted_state[0] != state:
+            values = x.to_numpy()
+            self.sorted_state = (state, values.dtype.kind in "fiu" and bool(np.all(values[1:] >= values[:-1])))
+        return self.sorted_state[1]
+
+    # First and one past the last row with the x-axis between xmin and xmax, found by binary search, or None if the
+    # x-axis is not sorted
+    def rows(self, xmin, xmax):
+        if self.grid is not None or not self.x_sorted():
+            return None
+        x = self.column(self.ax).to_numpy()
+        return int(np.searchsorted(x, xmin, side="left")), int(np.searchsorted(x, xmax, side="right"))
+
+    # Minimum/maximum pyramid of a numeric column, built the first time it is needed and again after it changes
+    def pyramid(self, name: str):
+        y = self.column(name)
+        state = (self.version, id(self.data_frame), _address(y))
+        cached = self.pyramids.get(name)
+        if cached is None or cached[0] != state:
+            if y.dtype.kind not in "fiu":
+                return None
+            cached = self.pyramids[name] = (state, gph.Pyramid(y.to_numpy(dtype=np.float64)))
+        return cached[1]
+
+    # Smallest and largest values of the x-axis
+    def x_limits(self):
+        if self.grid is not None and self.ax == self.freq_ax:
+            return self.grid.limits()
+        return self.column(self.ax).min(), self.column(self.ax).max()
+
     def add_column(self, name, series) -> None:
         self.data_frame[name] = series
-        self.graph.column_gtypes[name] = "Line"
+        self.graph.column_gtypes[name] = gph.LINE
+        self.changed()
 
     def copy(self) -> Data:
-        return Data(name=self.name + "*", data_frame=self.data_frame.copy(True), freq_ax=self.freq_ax,
-                    gtypes=self.graph.column_gtypes.copy(),
-                    owner=self.owner, x_ax=self.ax)
-
-    def remove_data(self, value: list[Any], axis, whole_row: bool):
-        length = len(value)
-        if length == 2:
-            left = self.data_frame[axis]
-            if value[1][0] == "$":
-                right = self.data_frame[value[1].replace("$", "")]
-            else:
-                if self.data_frame[axis].dtype == "int64":
-                    right = int(value[1])
-                elif self.data_frame[axis].dtype == "float64":
-                    right = float(value[1])
-                else:
-                    raise ValueError
-        else:
-            if value[0][0] == "$":
-                left = self.data_frame[value[0].replace("$", "")]
-            else:
-                if self.data_frame[axis].dtypes == "int64":
-                    left = int(value[0])
-                elif self.data_frame[axis].dtypes == "float64":
-                    left = float(value[0])
-                else:
-                    raise ValueError
-            if value[2][0] == "$":
-                right = self.data_frame[value[0].replace("$", "")]
-            else:
-                if self.data_frame[axis].dtypes == "int64":
-                    right = int(value[2])
-                elif self.data_frame[axis].dtypes == "float64":
-                    right = float(value[2])
-                else:
-                    raise ValueError
-
-        index = 0 if length == 2 else 1
-        if not whole_row:
-            if value[index] == "<":
-                self.data_frame[axis] = self.data_frame[axis][left > right]
-            elif value[index] == ">":
-                self.data_frame[axis] = self.data_frame[axis][left < right]
+        copied = Data(name=self.name + "*", data_frame=self.data_frame.copy(True), freq_ax=self.freq_ax,
+                      gtypes=self.graph.column_gtypes.copy(),
+                      owner=self.owner, x_ax=self.ax)
+        copied.derived = dict(self.derived)
+        return copied
+
+    # Removes the rows where a filter expression holds (see filters.py), or without whole_row only the values of
+    # 'axis' in them.  Returns how many rows matched and how long the expression took to evaluate, in seconds.
+    def remove_data(self, expression: str, axis: str = None, whole_row: bool = True):
+        start = time.perf_counter()
+        row_filter = filters.compile_filter(expression, axis or None)
+        columns = {}
+        for name in row_filter.columns:
+            if name in self.columns():
+                columns[name] = self.column(name).to_numpy(dtype=np.float64)
+            elif name == filters.INDEX:
+                columns[name] = self.data_frame.index.to_numpy(dtype=np.float64)
             else:
-                raise ValueError
+                raise filters.FilterError("There is no column '" + name + "'")
+        mask = row_filter.mask(columns, len(self.data_frame.index))
+        elapsed = time.perf_counter() - start
+
+        if whole_row:
+            self.data_frame = self.data_frame[~mask]
+        elif axis in self.data_frame.columns:
+            self.data_frame[axis] = self.data_frame[axis].where(~mask)
+            self.changed()
         else:
-            if value[index] == "<":
-                self.data_frame = self.data_frame[left > right]
-            elif value[index] == ">":
-                self.data_frame = self.data_frame[left < right]
-            else:
-                raise ValueError
+            raise filters.FilterError("Values can only be removed from a stored column")
+        return int(mask.sum()), elapsed
 
+    # Applies one of MODIFY_OPERATORS to a column, or to each of a list of columns.  Every column is copied once as
+    # floats and transformed in that copy; the copies only replace the columns once all of them are done, so a column
+    # that is not numeric leaves every column unchanged.  Values the operator is not defined for become NaN.
     def modify_data(self, column, operator: AnyStr, values: list):
-        if len(values) == 1:
-            if operator == "*":
-                self.data_frame[column] = self.data_frame[column].apply(func=lambda x: x * values[0])
-            elif operator == "/":
-                self.data_frame[column] = self.data_frame[column].apply(func=lambda x: x / values[0])
-            elif operator == "^":
-                self.data_frame[column] = self.data_frame[column].apply(func=lambda x: math.pow(x, values[0]))
-            elif operator == "log":
-                self.data_frame[column] = self.data_frame[column].apply(func=lambda x: math.log(x, values[0]))
-        else:
+        if operator not in MODIFY_OPERATORS or len(values) > 1 or (not values and operator not in MODIFY_DEFAULTS):
             raise ValueError
+        value = values[0] if values else MODIFY_DEFAULTS[operator]
+        arrays = {}
+        for name in ([column] if isinstance(column, str) else column):
+            try:
+                array = self.data_frame[name].to_numpy(dtype=np.float64, copy=True)
+            except (TypeError, ValueError):
+                raise NotNumericError("'" + name + "' is not numeric, so no column was modified")
+            with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+                MODIFY_OPERATORS[operator](array, value, out=array)
+            arrays[name] = array
+        for name, array in arrays.items():
+            self.data_frame[name] = array
+        self.changed()
 
     def drop_column(self, column):
-        self.data_frame.drop(columns=column, inplace=True)
+        self.store_dependents([column])
+        if column in self.derived:
+            self.derived.pop(column)
+            self.derived_cache.pop(column, None)
+        else:
+            self.data_frame.drop(columns=column, inplace=True)
+            self.changed()
         self.graph.column_gtypes.pop(column)
 
     # === IMPORTANT ===
@@ -131,9 +372,26 @@ class Data:
         if len(data_list) > 0:
             gui.MergeWindow(self.merge_callback, self.owner, self)
 
-    def merge_callback(self, to_merge: str, combine: bool, threshold: int):
+    # Merges with the datasets named in to_merge.  Several datasets are joined in one pass by merge_datasets, within
+    # 'threshold' kHz if combine is set and on equal frequencies otherwise.  With resample, all of them are instead
+    # interpolated onto a common grid of 'step' MHz (the finest step among them if not given).
+    def merge_callback(self, to_merge: list, combine: bool, threshold: int, resample: bool = False,
+                       step: float = None):
+        if len(to_merge) > 1 or resample:
+            datasets = [self]
+            for name in to_merge:
+                datasets.extend(data.dataset for data in self.owner.sidebar.dataset_texts if data.dataset.name == name)
+            if resample:
+                grid = CommonGrid(datasets, step)
+                merged_data = Data(data_frame=None, owner=self.owner, name=" + ".join(data.name for data in datasets),
+                                   freq_ax=self.freq_ax, gtypes=grid.gtypes, grid=grid)
+            else:
+                merged_data = merge_datasets(datasets, threshold if combine else 0.0)
+            self.owner.data_storage.add_data(data=merged_data)
+            return
+
         for data in self.owner.sidebar.dataset_texts:
-            if data.dataset.name == to_merge:
+            if data.dataset.name == to_merge[0]:
                 to_merge_dat = data.dataset
                 break
 
@@ -168,38 +426,31 @@ class Data:
         if combine:
             # For this section, we assume that frequencies are close enough together that intensities between
             # them will be relatively the same.
-            to_drop = []
+            # Sorted rows are split into clusters wherever the gap to the previous row is not below the threshold, and
+            # each cluster becomes one row with the first non-null value of every column (the frequency of its
+            # lowest row).
             threshold = threshold / 1000.0  # KHz -> MHz
-            merged_data.data_frame.sort_values(by=merged_data.freq_ax, inplace=True)
-            merged_data.data_frame.reset_index(drop=True, inplace=True)
-            freq_array = merged_data.data_frame[merged_data.freq_ax].to_numpy()
-
-            # How this works:
-            # Each index (A) will check 1 in front of itself (B) if there is a value within (threshold) KHz. If it is true,
-            # (A) copies the non-Nan values of (B) into itself, and assigns (B) to be deleted. Since there may be
-            # more still within the threshold, it keeps (A) the same and searches one ahead again, so while (A) is the
-            # same (B) is now the value of one index ahead, and it checks if it's still within (threshold), and
-            # copies it if true. If true, then it checks the next up. If false, then starts with the value that was just
-            # checked, as that is the next value that is not to be deleted.
-            for index in range(0, freq_array.size - 2):
-                if abs(freq_array[index + 1] - freq_array[index]) < threshold:
-                    rel_index = index  # Saves the value where it checks
-                    index += 1  # Have index simulate the value above
-                    condition = True  # Why doesn't python have do-while loops??
-                    while condition:
-                        for column in merged_data.data_frame.columns:
-                            if column != merged_data.freq_ax:  # Only for intensities
-                                if not pd.isna(merged_data.data_frame[column][index]):  # Make sure that NaN values don't overwrite data
-                                    merged_data.data_frame[column][rel_index] = merged_data.data_frame[column][index]  # Rewrite current value to previous value
-                        to_drop.append(index)
-                        index += 1
-                        try:  # In case there is matches at the end of the data, we don't want it to check outside the index.
-                            condition = (abs(freq_array[index] - freq_array[rel_index]) < threshold)
-                        except IndexError:
-                            condition = False
-            merged_data.data_frame.drop(index=to_drop, inplace=True)
-
-    def merge_resolution(self, merge_data: Data):
+            frame = merged_data.data_frame.sort_values(by=merged_data.freq_ax)
+            freq_array = frame[merged_data.freq_ax].to_numpy(dtype=np.float64)
+            cluster = np.zeros(freq_array.size, dtype=np.int64)
+            cluster[1:] = np.cumsum(~(np.abs(np.diff(freq_array)) < threshold))
+            merged_data.data_frame = frame.groupby(cluster, sort=False).first().reset_index(drop=True)
+
+    # Merges another spectrum into this one by joining on the raw frequencies, which interleaves spectra of different
+    # resolutions and leaves every other value of each column empty.  With resample, both are instead interpolated
+    # onto one grid of 'step' MHz (the finer of their steps if not given); with lazy as well, only the range that is
+    # plotted is evaluated until the full frame is needed.
+    def merge_resolution(self, merge_data: Data, step: float = None, resample: bool = False, lazy: bool = False):
+        if resample:
+            grid = CommonGrid([self, merge_data], step)
+            if lazy:
+                self.grid = grid
+            else:
+                self.data_frame = grid.window()
+            self.graph.column_gtypes = grid.gtypes
+            self.owner.data_storage.remove_data(merge_data)
+            return
+
         merge_data.data_frame.rename(columns={merge_data.freq_ax: self.freq_ax}, inplace=True)
         self.data_frame = pd.merge(left=self.data_frame, right=merge_data.data_frame, on=self.freq_ax, how='outer')
         merge_data.graph.column_gtypes.pop(merge_data.freq_ax)
@@ -214,6 +465,7 @@ class Data:
 
     def split_callback(self, column_list: list):
         self.ax = self.freq_ax
+        self.store_dependents(column_list)
         new_dat = self.data_frame.copy(deep=True)
         self.data_frame.drop(columns=column_list, inplace=True)
         inverse_remove = []
@@ -251,43 +503,380 @@ class DataStorage:
         self.root.sidebar.update_data()
 
 
-def peak_pick(data: Data, name: AnyStr, res: float, inten_min: float, inten_max: float) -> Data:
+# Least recently used store of the full, unthresholded peak lists of spectrum columns.  Picking the same column
+# again with only new intensity thresholds then just filters the stored list.  Entries are dropped oldest first
+# once they take more than 'budget' bytes, and with a directory set they are also kept there as .npy files.
+class PeakCache:
+    def __init__(self, budget: int = 256 * 2 ** 20, directory: str = None):
+        self.budget = budget
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.size = 0
+
+    # Key of one column: a hash of its contents (and of the frequency axis), plus the method and the settings that
+    # change its full peak list (resolution, noise window)
+    @staticmethod
+    def key(freq_hash: bytes, column: np.ndarray, method: str, settings: tuple) -> str:
+        digest = hashlib.blake2b(np.ascontiguousarray(column).tobytes(), digest_size=16)
+        digest.update(freq_hash)
+        digest.update(repr((method,) + settings).encode())
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        if self.directory is not None:
+            path = os.path.join(self.directory, key + ".npy")
+            if os.path.isfile(path):
+                peaks = np.load(path)
+                self.store(key, peaks)
+                return peaks
+        return None
+
+    def put(self, key: str, peaks: np.ndarray):
+        self.store(key, peaks)
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            np.save(os.path.join(self.directory, key + ".npy"), peaks)
+
+    def store(self, key: str, peaks: np.ndarray):
+        if key in self.entries:
+            self.size -= self.entries.pop(key).nbytes
+        if peaks.nbytes > self.budget:
+            return
+        self.entries[key] = peaks
+        self.size += peaks.nbytes
+        while self.size > self.budget:
+            self.size -= self.entries.popitem(last=False)[1].nbytes
+
+    def persist(self, enabled: bool):
+        self.directory = os.path.abspath(PEAK_CACHE_DIR) if enabled else None
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+
+peak_cache = PeakCache()
+
+
+# Returns the peaky routine for a peak picking method and the arguments that follow the spectrum
+def _picker(method: str, res: float, inten_min: float, inten_max: float, processes: int = None, snr: float = 0.0,
+            noise_window: int = peaky.NOISE_WINDOW):
+    if method == NOISE:  # Maxima of the original spectrum, thresholded against the local noise
+        return peaky.noise_peakpicker, (inten_min, inten_max, snr, noise_window)
+    elif method in REFINE_METHODS:  # Only the maxima of the original spectrum are interpolated
+        return peaky.refined_peakpicker, (inten_min, inten_max, REFINE_METHODS[method])
+    elif method == SEGMENTED:  # Splines and picks the spectrum in windows, never holding the full resampled set
+        return peaky.segmented_peakpicker, (res, inten_min, inten_max, peaky.SEGMENT_WINDOW, peaky.SEGMENT_OVERLAP,
+                                            processes)
+    return peaky.spline_peakpicker, (res, inten_min, inten_max)
+
+
+# Settings other than the thresholds that a method's full peak list depends on
+def _pick_settings(method: str, res: float, noise_window: int) -> tuple:
+    if method == NOISE:
+        return noise_window,
+    elif method in REFINE_METHODS:
+        return ()
+    return res,
+
+
+# Peaks of a full peak list that are strictly between the thresholds (and above the SNR, for lists that carry
+# one), as the pickers themselves select them
+def _threshold(peaks: np.ndarray, inten_min: float, inten_max: float, snr: float = 0.0) -> np.ndarray:
+    keep = (peaks[:, 1] > inten_min) & (peaks[:, 1] < inten_max)
+    if peaks.shape[1] > 2:
+        keep &= peaks[:, 2] > snr
+    return peaks[keep]
+
+
+def peak_pick(data: Data, name: AnyStr, res: float, inten_min: float, inten_max: float,
+              method: str = SPLINE, processes: int = None, tolerance: float = 0.0, snr: float = 3.0,
+              noise_window: int = peaky.NOISE_WINDOW, cache: bool = True) -> Data:
     data_frame = data.data_frame
-    new_data = pd.DataFrame()  # Create new dataframe
-    is_new = True
-
-    # Current dataframe is divided into frequency/amplitude pairs in order to be run through peaky
-    for column in data_frame.columns:  # Copy each column into the new dataframe
-        if column == data.freq_ax:  # Don't create dataframe with double frequency axes
-            continue
-        if data.graph.column_gtypes[column] == gph.NONE:  # Allows control over peak pick on certain axes
-            continue
-        partial_frame = data_frame.copy(deep=True)  # Copy dataframe into new frame
-        to_drop = []
-        for temp_column in data_frame.columns:  # Find all columns that need to be dropped
-            if temp_column != data.freq_ax and temp_column != column:
-                to_drop.append(temp_column)
-        partial_frame.drop(columns=to_drop, inplace=True)  # Drop specified columns
-
-        # Convert partial frame into numpy array, run through peaky
-        nump = partial_frame.to_numpy(copy=True)
-        res_spect = peaky.cubic_spline(nump, res)
-        (peaks, freq_low, freq_high) = peaky.peakpicker(res_spect, inten_min, inten_max)
-
-        # Convert new peaked data back into a dataframe
-        temp_frame = pd.DataFrame(peaks, columns=[data.freq_ax, column])
-        if is_new:
-            new_data = pd.concat(objs=[new_data, temp_frame], axis=1)
-            new_data.columns = [data.freq_ax, column]
-            is_new = False
-        else:
-            new_data = new_data.merge(right=temp_frame, on=data.freq_ax, how="outer")
-    return Data(data_frame=new_data, owner=data.owner, name=name, freq_ax=data.freq_ax)
+
+    # Allows control over peak pick on certain axes, and don't create dataframe with double frequency axes
+    columns = [column for column in data_frame.columns
+               if column != data.freq_ax and data.graph.column_gtypes[column] != gph.NONE]
+    freqs = data_frame[data.freq_ax].to_numpy(dtype=np.float64)
+    results = {}
+
+    # Columns that were picked before with the same method and settings only need the new thresholds applied.
+    # Everything else is picked without thresholds, so the full peak lists can be stored for next time.
+    keys = {}
+    if cache:
+        freq_hash = hashlib.blake2b(freqs.tobytes(), digest_size=16).digest()
+        settings = _pick_settings(method, res, noise_window)
+        for column in columns:
+            keys[column] = PeakCache.key(freq_hash, data_frame[column].to_numpy(dtype=np.float64), method, settings)
+            results[column] = peak_cache.get(keys[column])
+        missing = [column for column in columns if results[column] is None]
+        pick_min, pick_max, pick_snr = -np.inf, np.inf, -np.inf
+    else:
+        missing = columns
+        pick_min, pick_max, pick_snr = inten_min, inten_max, snr
+
+    if len(missing) == 1 or processes == 1:
+        picker, args = _picker(method, res, pick_min, pick_max, processes, pick_snr, noise_window)
+        for column in missing:
+            spectrum = np.column_stack((freqs, data_frame[column].to_numpy(dtype=np.float64)))
+            results[column] = picker(spectrum, *args)[0]
+    elif len(missing) > 1:
+        # Each column is run through peaky in its own process.  The frequency axis and the intensity columns are
+        # copied once into shared memory, and every worker reads only the two rows it needs from it.
+        picker, args = _picker(method, res, pick_min, pick_max, 1, pick_snr, noise_window)
+        block = shared_memory.SharedMemory(create=True, size=freqs.nbytes * (len(missing) + 1))
+        try:
+            shared = np.ndarray((len(missing) + 1, freqs.size), dtype=np.float64, buffer=block.buf)
+            shared[0] = freqs
+            for row, column in enumerate(missing, start=1):
+                shared[row] = data_frame[column].to_numpy(dtype=np.float64)
+            workers = min(processes or os.cpu_count() or 1, len(missing))
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(peaky.shared_peakpick, block.name, shared.shape, row, picker, args): column
+                           for row, column in enumerate(missing, start=1)}
+                for future in as_completed(futures):  # Gathered as they finish
+                    results[futures[future]] = future.result()
+            del shared
+        finally:
+            block.close()
+            block.unlink()
+
+    if cache:
+        for column in missing:
+            peak_cache.put(keys[column], results[column])
+        results = {column: _threshold(results[column], inten_min, inten_max, snr) for column in columns}
+
+    # Noise adaptive picks also give every intensity column an SNR column, which is not plotted
+    new_data = peak_table([results[column] for column in columns], columns, data.freq_ax, tolerance,
+                          snr=method == NOISE)
+    gtypes = {column: gph.NONE if column.endswith(SNR_SUFFIX) else gph.LINE for column in new_data.columns}
+    return Data(data_frame=new_data, owner=data.owner, name=name, freq_ax=data.freq_ax, gtypes=gtypes)
+
+
+# Builds one table out of several peak lists (arrays of frequency/intensity rows), with one row per line and one
+# intensity column per list.  All peaks are sorted together once and swept in frequency order: a line holds at most
+# one peak of every list, all within 'tolerance' kHz of its first peak, and its frequency is that of its strongest
+# peak.  With snr=True the peak lists have a third column, the signal-to-noise ratio, which is added as one more
+# column per list.
+def peak_table(peak_lists: list, columns: list, freq_ax: str, tolerance: float = 0.0,
+               snr: bool = False) -> pd.DataFrame:
+    if len(peak_lists) == 0:
+        return pd.DataFrame(columns=[freq_ax])
+    peak_lists = [np.asarray(peaks, dtype=np.float64).reshape(-1, 3 if snr else 2) for peaks in peak_lists]
+    freqs = np.concatenate([peaks[:, 0] for peaks in peak_lists])
+    intens = np.concatenate([peaks[:, 1] for peaks in peak_lists])
+    sources = np.concatenate([np.full(len(peaks), index) for index, peaks in enumerate(peak_lists)]).astype(np.int64)
+
+    order = np.argsort(freqs, kind="stable")
+    freqs, intens, sources = freqs[order], intens[order], sources[order]
+    line = _sweep_lines(freqs, sources, len(peak_lists), tolerance / 1000.0)  # KHz -> MHz
+    lines = int(line[-1]) + 1 if freqs.size > 0 else 0
+
+    key = line * len(peak_lists) + sources  # Unique, as no line holds two peaks of a list
+    table = np.full((lines, len(peak_lists)), np.nan)
+    table.flat[key] = intens
+    new_data = pd.DataFrame(table, columns=columns)
+    if snr:
+        snrs = np.concatenate([peaks[:, 2] for peaks in peak_lists])[order]
+        table = np.full((lines, len(peak_lists)), np.nan)
+        table.flat[key] = snrs
+        for index, column in enumerate(columns):
+            new_data[column + SNR_SUFFIX] = table[:, index]
+
+    # The strongest peak of each line is the last of its line when sorted by (line, intensity)
+    order = np.lexsort((intens, line))
+    last = np.ones(order.size, dtype=bool)
+    last[:-1] = line[order][1:] != line[order][:-1]
+    new_data.insert(0, freq_ax, freqs[order][last])
+    return new_data
+
+
+# Line number of every peak of a frequency sorted peak list.  Peaks separated by gaps wider than 'tolerance' are
+# never on the same line, so the lines are first cut at those gaps in one pass; only the lines that turn out wider
+# than 'tolerance' or hold two peaks of one list are then swept again peak by peak, starting a new line at a peak too
+# far from the line's first peak or whose list already has a peak on the line.
+def _sweep_lines(freqs: np.ndarray, sources: np.ndarray, lists: int, tolerance: float) -> np.ndarray:
+    if freqs.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    starts = np.ones(freqs.size, dtype=bool)
+    starts[1:] = np.diff(freqs) > tolerance
+    line = np.cumsum(starts) - 1
+    first = np.flatnonzero(starts)
+    end = np.append(first[1:], freqs.size)
+    keys = np.sort(line * lists + sources)
+    crowded = np.unique(keys[1:][keys[1:] == keys[:-1]] // lists)
+    for index in np.union1d(np.flatnonzero(freqs[end - 1] - freqs[first] > tolerance), crowded):
+        start, present = freqs[first[index]], {sources[first[index]]}
+        for peak in range(first[index] + 1, end[index]):
+            if freqs[peak] - start > tolerance or sources[peak] in present:
+                starts[peak] = True
+                start, present = freqs[peak], set()
+            present.add(sources[peak])
+    return np.cumsum(starts) - 1
+
+
+# Joins any number of datasets by nearest frequency into one dataset.  Rows of all the datasets that follow each
+# other with gaps of no more than 'tolerance' kHz form one line, whose frequency is the mean of its rows; if a
+# dataset has several rows on a line, its first row goes on the line's first output row, its second on the second,
+# and so on.  Columns whose names are already taken get the name of their dataset appended.
+# The datasets are swept together in frequency order: a heap holds, for every dataset, the frequency at the end of
+# its next block of rows, and each step takes the rows of all datasets up to the lowest of those.
+def merge_datasets(datasets: list, tolerance: float = 0.0, name: str = None, block: int = JOIN_BLOCK) -> Data:
+    tolerance = tolerance / 1000.0  # KHz -> MHz
+    freq_ax = datasets[0].freq_ax
+    freqs, values, targets, gtypes = [], [], [], {freq_ax: gph.LINE}
+    for dataset in datasets:
+        frame = dataset.data_frame
+        order = np.argsort(frame[dataset.freq_ax].to_numpy(dtype=np.float64), kind="stable")
+        freqs.append(frame[dataset.freq_ax].to_numpy(dtype=np.float64)[order])
+        columns = {}
+        for column in frame.columns:
+            if column == dataset.freq_ax:
+                continue
+            target = column if column not in gtypes else column + " (" + dataset.name + ")"
+            columns[target] = frame[column].to_numpy()[order]
+            gtypes[target] = dataset.graph.column_gtypes.get(column, gph.LINE)
+        values.append(columns)
+        targets.extend(columns.keys())
+
+    positions = [0] * len(datasets)
+    heap = [(freq[min(block, freq.size) - 1], source) for source, freq in enumerate(freqs) if freq.size > 0]
+    heapq.heapify(heap)
+    carry = (np.zeros(0), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    pieces = []
+    while heap:
+        boundary, source = heapq.heappop(heap)
+        taken = [carry]
+        for index, freq in enumerate(freqs):
+            end = np.searchsorted(freq, boundary, side="right")
+            if end > positions[index]:
+                rows = np.arange(positions[index], end)
+                taken.append((freq[rows], np.full(rows.size, index), rows))
+                positions[index] = end
+        if positions[source] < freqs[source].size:
+            heapq.heappush(heap, (freqs[source][min(positions[source] + block, freqs[source].size) - 1], source))
+        rows_freq, rows_source, rows_index = (np.concatenate(part) for part in zip(*taken))
+
+        order = np.argsort(rows_freq, kind="stable")
+        rows_freq, rows_source, rows_index = rows_freq[order], rows_source[order], rows_index[order]
+        chain = np.zeros(rows_freq.size, dtype=np.int64)
+        chain[1:] = np.cumsum(np.diff(rows_freq) > tolerance)
+        # The last line may continue into rows that have not been taken yet
+        last = np.searchsorted(chain, chain[-1]) if heap and rows_freq.size > 0 else rows_freq.size
+        carry = (rows_freq[last:], rows_source[last:], rows_index[last:])
+        if last > 0:
+            pieces.append(_join_lines(rows_freq[:last], rows_source[:last], rows_index[:last], chain[:last],
+                                      len(datasets)))
+
+    table = {freq_ax: []}
+    for column in targets:
+        table[column] = []
+    for line_freq, line, line_source, line_index in pieces:
+        table[freq_ax].append(line_freq)
+        for source, columns in enumerate(values):
+            on_source = line_source == source
+            for column, column_values in columns.items():
+                out = np.full(line_freq.size, np.nan, dtype=np.float64 if column_values.dtype.kind in "fiub"
+                              else object)
+                out[line[on_source]] = column_values[line_index[on_source]]
+                table[column].append(out)
+    frame = pd.DataFrame({column: np.concatenate(parts) if parts else np.zeros(0) for column, parts in table.items()})
+    if name is None:
+        name = " + ".join(dataset.name for dataset in datasets)
+    return Data(data_frame=frame, owner=datasets[0].owner, name=name, freq_ax=freq_ax, gtypes=gtypes)
+
+
+# Rows of merge_datasets for a run of sorted rows split into chains: the k-th row of each dataset on a chain goes
+# on the chain's k-th line.  Returns the line frequencies, and the line, dataset and row of every input row.
+def _join_lines(freq: np.ndarray, source: np.ndarray, index: np.ndarray, chain: np.ndarray, sources: int):
+    key = chain * sources + source
+    order = np.argsort(key, kind="stable")
+    first = np.ones(order.size, dtype=bool)
+    first[1:] = key[order][1:] != key[order][:-1]
+    starts = np.flatnonzero(first)
+    rank = np.empty(order.size, dtype=np.int64)
+    rank[order] = np.arange(order.size) - np.repeat(starts, np.diff(np.append(starts, order.size)))
+
+    order = np.lexsort((rank, chain))
+    new = np.ones(order.size, dtype=bool)
+    new[1:] = (chain[order][1:] != chain[order][:-1]) | (rank[order][1:] != rank[order][:-1])
+    line = np.empty(order.size, dtype=np.int64)
+    line[order] = np.cumsum(new) - 1
+    lines = int(line.max()) + 1 if line.size > 0 else 0
+    line_freq = np.bincount(line, weights=freq, minlength=lines) / np.maximum(np.bincount(line, minlength=lines), 1)
+    return line_freq, line, source, index
+
+
+# Finds frequency differences that are repeated between many pairs of lines in a peak list.  Tolerance is in kHz,
+# the difference limits in MHz.
+def constant_differences(dataset: Data, name: str, tolerance: float, min_diff: float = 0.0, max_diff: float = None,
+                         min_pairs: int = 3, count: int = 50) -> Data:
+    peaklist = dataset.data_frame[[dataset.freq_ax]].dropna().to_numpy(dtype=np.float64)
+    results = peaky.deltanus(peaklist, tolerance / 1000.0, min_diff, max_diff, min_pairs, count)
+    frame = pd.DataFrame(results, columns=["Difference (MHz)", "Pairs", "Significance"])
+    return Data(data_frame=frame, owner=dataset.owner, name=name, freq_ax="Difference (MHz)",
+                gtypes={"Difference (MHz)": gph.LINE, "Pairs": gph.STEM, "Significance": gph.NONE})
+
+
+# All pairs of lines in a dataset separated by 'delta' MHz, within 'tolerance' kHz.  The lower line's row is kept,
+# with the frequency of its partner added.
+def difference_pairs(dataset: Data, name: str, delta: float, tolerance: float) -> Data:
+    frame = dataset.data_frame.dropna(subset=[dataset.freq_ax]).reset_index(drop=True)
+    low, high = peaky.difference_pairs(frame[[dataset.freq_ax]].to_numpy(dtype=np.float64), delta,
+                                       tolerance / 1000.0)
+    pairs = frame.iloc[low].reset_index(drop=True)
+    pairs.insert(1, "Partner (MHz)", frame[dataset.freq_ax].to_numpy()[high])
+    gtypes = {column: dataset.graph.column_gtypes.get(column, gph.LINE) for column in pairs.columns}
+    gtypes["Partner (MHz)"] = gph.NONE
+    return Data(data_frame=pairs, owner=dataset.owner, name=name, freq_ax=dataset.freq_ax, gtypes=gtypes)
+
+
+# Fits a line shape to every peak of a peak list, using the spectrum column 'column' of 'source'.  If the peak list
+# has that column too, only its peaks (rows where it is set) are fitted.  The centre, width, amplitude and their
+# errors are added to the peak list as columns starting with the column's name.
+def fit_lines(peaks: Data, source: Data, column: str, profile: str = lineshape.LORENTZIAN, points: int = 7,
+              processes: int = None):
+    frame = peaks.data_frame
+    rows = frame[column].notna().to_numpy() if column in frame.columns else np.ones(len(frame.index), dtype=bool)
+    spectrum = source.data_frame[[source.freq_ax, column]].dropna().sort_values(by=source.freq_ax)
+    results = np.full((len(frame.index), len(lineshape.RESULT_COLUMNS)), np.nan)
+    results[rows] = lineshape.fit_peaks(spectrum.to_numpy(dtype=np.float64),
+                                        frame[peaks.freq_ax].to_numpy(dtype=np.float64)[rows], profile, points,
+                                        processes)
+    for index, name in enumerate(lineshape.RESULT_COLUMNS):
+        peaks.add_column(name=column + " " + name, series=results[:, index])
+        peaks.graph.column_gtypes[column + " " + name] = gph.NONE
+
+
+# Mask of the rows whose ratios of every plotted column (AND) or of any of them (OR) to 'against' are within
+# 'margin' of 'ratio', or outside of it if include is False.  The ratios are tested a block of rows at a time, so no
+# ratio columns are stored.
+def ratio_mask(dataset: Data, against: str, ratio: float, margin: float, include: bool = True,
+               combine: str = AND) -> np.ndarray:
+    columns = [column for column in dataset.columns() if column not in (dataset.freq_ax, against)
+               and dataset.graph.column_gtypes.get(column) != gph.NONE]
+    values = np.column_stack([dataset.column(column).to_numpy(dtype=np.float64) for column in columns]
+                             + [np.zeros((len(dataset.data_frame.index), 0))])
+    denominator = dataset.column(against).to_numpy(dtype=np.float64)
+    mask = np.zeros(len(denominator), dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for start in range(0, len(mask), RATIO_BLOCK):
+            ratios = values[start:start + RATIO_BLOCK] / denominator[start:start + RATIO_BLOCK, None]
+            if include:
+                passed = (ratios > ratio - margin) & (ratios < ratio + margin)
+            else:
+                passed = (ratios > ratio + margin) | (ratios < ratio - margin)
+            mask[start:start + RATIO_BLOCK] = passed.all(axis=1) if combine == AND else passed.any(axis=1)
+    return mask
 
 
+# The ratio columns are derived, so they are only computed when plotted, filtered on or exported and follow any
+# change of their columns
 def calc_ratios(dataset: Data, against):  # against is the column that the other columns will be divided by
-    df = dataset.data_frame
-    columns = df.columns.values.tolist()
+    columns = dataset.data_frame.columns.values.tolist()
 
     columns.remove(against)  # Prevent creating a ratio of against with against
     columns.remove(dataset.freq_ax)  # Prevent creating ratios with the frequency axis
@@ -295,12 +884,25 @@ def calc_ratios(dataset: Data, against):  # against is the column that the other
     column_dict = {}
     for column in columns:
         name = column + "/" + against
-        dataset.add_column(name=name, series=df[column] / df[against])
-        dataset.graph.column_gtypes[name] = gph.NONE
+        dataset.add_derived(name, [column, against], np.divide)
         column_dict[column] = name
     return column_dict  # Returns a dictionary with each column and corresponding ratio column
 
 
+# Labels the lines of an aligned peak table whose intensity ratios to 'against' agree across all of the plotted
+# columns.  Every line of a cluster has all its ratios within 'tolerance' percent of those at the cluster's centre
+# (see clusters.grid_clusters).  Returns the number of clusters found.
+def ratio_clusters(dataset: Data, against: str, tolerance: float, min_size: int = 2) -> int:
+    columns = [column for column in dataset.columns() if column not in (dataset.freq_ax, against)
+               and dataset.graph.column_gtypes.get(column) != gph.NONE]
+    values = np.column_stack([dataset.column(against).to_numpy(dtype=np.float64)]
+                             + [dataset.column(column).to_numpy(dtype=np.float64) for column in columns])
+    labels = clusters.grid_clusters(clusters.log_ratios(values, 0), np.log10(1 + tolerance / 100), min_size)
+    dataset.add_column(name=CLUSTER_COLUMN, series=labels)
+    dataset.graph.column_gtypes[CLUSTER_COLUMN] = gph.NONE
+    return int(labels.max()) + 1
+
+
 def remove_from(on: Data, values_from: Data, threshold: Union[int, float], return_removed: bool, add_back: bool):
     on.data_frame.reset_index(drop=True, inplace=True)
     threshold = threshold / 1000.0
@@ -313,24 +915,16 @@ def remove_from(on: Data, values_from: Data, threshold: Union[int, float], retur
     # Eliminate all values that go past frequency range
     vf = values_from.data_frame[(values_from.data_frame[values_from.freq_ax] < on.data_frame[on.freq_ax].max())
                                 & (values_from.data_frame[values_from.freq_ax] > on.data_frame[on.freq_ax].min())]
-    on_nump = on.data_frame[on.freq_ax].to_numpy()
-    from_nump = vf[values_from.freq_ax].to_numpy()
-    to_drop = np.zeros(on.data_frame[on.freq_ax].size)
-    index = 0
-    on_index = 0
-    for value in on_nump:
-        for value1 in from_nump:
-            if value + threshold > value1 > value - threshold:
-                to_drop[index] = on_index
-                index += 1
-                break
-        on_index += 1
+    # Boolean masks of the rows with a catalogue line closer than the threshold, and of the rest
+    remove = peaky.within_tolerance(on.data_frame[on.freq_ax].to_numpy(dtype=np.float64),
+                                    vf[values_from.freq_ax].to_numpy(dtype=np.float64), threshold)
+    keep = ~remove
     removed = on.copy()
-    removed.data_frame = on.data_frame.loc[to_drop[0:index]]
+    removed.data_frame = on.data_frame[remove]
     removed.name = on.name + " (removed)"
 
     new_on = on.copy()
-    new_on.data_frame = on.data_frame.drop(axis=0, labels=to_drop[0:index])
+    new_on.data_frame = on.data_frame[keep]
     new_on.name = on.name + " - " + values_from.name
 
     on.owner.data_storage.add_data(new_on)
@@ -345,6 +939,28 @@ def remove_from(on: Data, values_from: Data, threshold: Union[int, float], retur
         on.data_frame = pd.merge(left=on.data_frame, right=to_back, left_on=on.freq_ax, right_on=removed.freq_ax,
                                  how="outer")
         for column in to_back.columns:
-            on.graph.column_gtypes[column] = "Line"
+            on.graph.column_gtypes[column] = gph.LINE
+    if return_removed:
+        on.owner.data_storage.add_data(removed)
+
+
+# Removes the lines of known catalogues (every catalogue in the library if 'catalogues' is None) from a peak list,
+# within 'threshold' kHz, as remove_from does for a single dataset.  Rows that are removed are tagged with the
+# catalogue of the line they matched.
+def remove_known(on: Data, known: library.KnownLines, threshold: Union[int, float], return_removed: bool,
+                 catalogues: list = None):
+    remove, source = known.match(on.data_frame[on.freq_ax].to_numpy(dtype=np.float64), threshold / 1000.0,
+                                 catalogues)
+
+    new_on = on.copy()
+    new_on.data_frame = on.data_frame[~remove]
+    new_on.name = on.name + " - known"
+    on.owner.data_storage.add_data(new_on)
+
     if return_removed:
+        removed = on.copy()
+        removed.data_frame = on.data_frame[remove].copy()
+        removed.data_frame["Catalogue"] = np.array(known.catalogues, dtype=object)[source[remove]]
+        removed.graph.column_gtypes["Catalogue"] = gph.NONE
+        removed.name = on.name + " (known)"
         on.owner.data_storage.add_data(removed)
@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import re
+from functools import lru_cache
+from typing import Callable
+
+import numpy as np
+
+import peaky
+
+# Row filter expressions for removing data, e.g.
+#     {Intensity} < 0.01 and not {Frequency (MHz)} between 8000 and 8100
+#     abs({A} - {B}) > 0.5 or {Frequency (MHz)} near [8012.5, 9120.25] within 0.2
+# Columns are referenced in braces ({Index} is the row index), and an expression that starts with a comparison uses
+# the column chosen in the dialog on its left, so the old "< 5" commands still parse.  Their comparisons are strict
+# now, though: "< 5" no longer removes the rows equal to 5 as the old commands did.  An expression is parsed once
+# into a tree of closures over column arrays, which is then evaluated over the frame a block of rows at a time:
+# every operator of the expression runs on the same cache-sized block before the next block is read.
+
+BLOCK = 65536  # Rows evaluated at once
+INDEX = "Index"
+
+_TOKEN = re.compile(r"\s*(?:(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)|\{(?P<column>[^}]*)}|"
+                    r"(?P<word>[A-Za-z_]+)|(?P<symbol><=|>=|==|!=|[<>+\-*/()\[\],]))")
+_COMPARISONS = {"<": np.less, ">": np.greater, "<=": np.less_equal, ">=": np.greater_equal, "==": np.equal,
+                "!=": np.not_equal}
+_ARITHMETIC = {"+": np.add, "-": np.subtract, "*": np.multiply, "/": np.divide}
+KEYWORDS = {"and", "or", "not", "between", "near", "within", "abs"}
+# Tokens that can only follow a value, so an expression starting with one of them is about the chosen column
+_IMPLICIT = set(_COMPARISONS) | {"between", "near"}
+
+NUMBER = "number"
+BOOLEAN = "boolean"
+
+
+class FilterError(ValueError):
+    """The filter expression could not be parsed"""
+    pass
+
+
+def _tokenize(text: str) -> list:
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None:
+            raise FilterError("Unexpected '" + text[position:].strip()[:10] + "'")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "word":
+            if value.lower() not in KEYWORDS:
+                raise FilterError("Unknown word '" + value + "', columns are written in braces")
+            value = value.lower()
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+# Recursive descent parser producing (type, function) pairs, where function maps a dict of column blocks to an
+# array (or a number, for constant parts)
+class _Parser:
+    def __init__(self, tokens: list):
+        self.tokens = tokens
+        self.position = 0
+        self.columns = set()
+
+    # The next operator or keyword, or None at the end or before a column or number
+    def peek(self):
+        if self.position >= len(self.tokens) or self.tokens[self.position][0] != "symbol" and \
+                self.tokens[self.position][0] != "word":
+            return None
+        return self.tokens[self.position][1]
+
+    def take(self, expected: str = None):
+        if self.position >= len(self.tokens):
+            raise FilterError("Expression ends early" + ("" if expected is None else ", expected '" + expected + "'"))
+        kind, value = self.tokens[self.position]
+        if expected is not None and (kind == "column" or value != expected):
+            raise FilterError("Expected '" + expected + "' but found '" + value + "'")
+        self.position += 1
+        return kind, value
+
+    def parse(self) -> Callable:
+        kind, func = self.expression()
+        if self.position < len(self.tokens):
+            raise FilterError("Unexpected '" + self.tokens[self.position][1] + "'")
+        if kind != BOOLEAN:
+            raise FilterError("The expression has to be a condition, such as a comparison")
+        return func
+
+    @staticmethod
+    def expect(kind: str, part, text: str):
+        if part[0] != kind:
+            raise FilterError(text)
+        return part[1]
+
+    def expression(self):
+        left = self.conjunction()
+        while self.peek() == "or":
+            self.take()
+            a = self.expect(BOOLEAN, left, "'or' joins conditions")
+            b = self.expect(BOOLEAN, self.conjunction(), "'or' joins conditions")
+            left = (BOOLEAN, lambda columns, a=a, b=b: np.logical_or(a(columns), b(columns)))
+        return left
+
+    def conjunction(self):
+        left = self.negation()
+        while self.peek() == "and":
+            self.take()
+            a = self.expect(BOOLEAN, left, "'and' joins conditions")
+            b = self.expect(BOOLEAN, self.negation(), "'and' joins conditions")
+            left = (BOOLEAN, lambda columns, a=a, b=b: np.logical_and(a(columns), b(columns)))
+        return left
+
+    def negation(self):
+        if self.peek() == "not":
+            self.take()
+            a = self.expect(BOOLEAN, self.negation(), "'not' applies to a condition")
+            return BOOLEAN, lambda columns: np.logical_not(a(columns))
+        return self.condition()
+
+    def condition(self):
+        left = self.sum()
+        following = self.peek()
+        if following in _COMPARISONS:
+            self.take()
+            compare = _COMPARISONS[following]
+            a = self.expect(NUMBER, left, "Only values can be compared")
+            b = self.expect(NUMBER, self.sum(), "Only values can be compared")
+            return BOOLEAN, lambda columns: compare(a(columns), b(columns))
+        if following == "between":
+            self.take()
+            x = self.expect(NUMBER, left, "Only values can be between bounds")
+            low = self.expect(NUMBER, self.sum(), "The bounds of 'between' must be values")
+            self.take("and")
+            high = self.expect(NUMBER, self.sum(), "The bounds of 'between' must be values")
+
+            def between(columns):
+                values = x(columns)
+                return (values >= low(columns)) & (values <= high(columns))
+            return BOOLEAN, between
+        if following == "near":
+            self.take()
+            x = self.expect(NUMBER, left, "Only values can be near a list")
+            lines = self.number_list()
+            self.take("within")
+            tolerance = self.expect(NUMBER, self.sum(), "The tolerance of 'near' must be a value")
+            return BOOLEAN, lambda columns: peaky.within_tolerance(
+                np.asarray(x(columns), dtype=np.float64), lines, tolerance(columns))
+        return left
+
+    def number_list(self) -> np.ndarray:
+        self.take("[")
+        values = []
+        while self.peek() != "]":
+            if self.position >= len(self.tokens):
+                raise FilterError("Expected ']'")
+            sign = 1.0
+            if self.peek() == "-":
+                self.take()
+                sign = -1.0
+            kind, value = self.take()
+            if kind != NUMBER:
+                raise FilterError("Lists hold numbers, found '" + value + "'")
+            values.append(sign * float(value))
+            if self.peek() == ",":
+                self.take()
+        self.take("]")
+        return np.array(values, dtype=np.float64)
+
+    def sum(self):
+        left = self.product()
+        while self.peek() in ("+", "-"):
+            operator = _ARITHMETIC[self.take()[1]]
+            a = self.expect(NUMBER, left, "Only values can be added or subtracted")
+            b = self.expect(NUMBER, self.product(), "Only values can be added or subtracted")
+            left = (NUMBER, lambda columns, a=a, b=b, operator=operator: operator(a(columns), b(columns)))
+        return left
+
+    def product(self):
+        left = self.unary()
+        while self.peek() in ("*", "/"):
+            operator = _ARITHMETIC[self.take()[1]]
+            a = self.expect(NUMBER, left, "Only values can be multiplied or divided")
+            b = self.expect(NUMBER, self.unary(), "Only values can be multiplied or divided")
+            left = (NUMBER, lambda columns, a=a, b=b, operator=operator: operator(a(columns), b(columns)))
+        return left
+
+    def unary(self):
+        if self.peek() == "-":
+            self.take()
+            a = self.expect(NUMBER, self.unary(), "Only values can be negated")
+            return NUMBER, lambda columns: np.negative(a(columns))
+        return self.atom()
+
+    def atom(self):
+        kind, value = self.take()
+        if kind == NUMBER:
+            number = float(value)
+            return NUMBER, lambda columns: number
+        if kind == "column":
+            self.columns.add(value)
+            return NUMBER, lambda columns: columns[value]
+        if value == "abs":
+            self.take("(")
+            a = self.expect(NUMBER, self.expression(), "'abs' applies to a value")
+            self.take(")")
+            return NUMBER, lambda columns: np.abs(a(columns))
+        if value == "(":
+            inner = self.expression()
+            self.take(")")
+            return inner
+        raise FilterError("Unexpected '" + value + "'")
+
+
+class Filter:
+    def __init__(self, text: str, column: str = None):
+        self.text = text
+        tokens = _tokenize(text)
+        if column is not None and tokens and tokens[0][0] != "column" and tokens[0][1] in _IMPLICIT:
+            tokens.insert(0, ("column", column))
+        if not tokens:
+            raise FilterError("The expression is empty")
+        parser = _Parser(tokens)
+        self.evaluate = parser.parse()
+        self.columns = sorted(parser.columns)  # Columns the expression reads
+
+    # Rows of 'columns' (name -> array, holding at least self.columns) where the expression holds
+    def mask(self, columns: dict, rows: int, block: int = BLOCK) -> np.ndarray:
+        mask = np.empty(rows, dtype=bool)
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            for start in range(0, rows, block):
+                blocks = {name: columns[name][start:start + block] for name in self.columns}
+                mask[start:start + block] = self.evaluate(blocks)
+        return mask
+
+
+# Filters are parsed once per expression and chosen column
+@lru_cache(maxsize=64)
+def compile_filter(text: str, column: str = None) -> Filter:
+    return Filter(text, column)
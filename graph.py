@@ -1,14 +1,16 @@
 from __future__ import annotations
 
+import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib import use as plt_use
+from matplotlib.container import Container
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 
 import data
 
 from typing import Union, AnyStr
 
-plt_use("TkAgg")
+plt_use("TkAgg", force=False)  # Without a display, as when testing, the Tk backend cannot be loaded
 
 Number = Union[float, int]
 
@@ -20,6 +22,127 @@ NONE = 3
 gtype_from_val = {LINE: "Line", SCATTER: "Scatter", STEM: "Stem", NONE: "None"}
 gtype_from_string = {"Line": LINE, "Stem": STEM, "Scatter": SCATTER, "None": NONE}
 
+# Decimation splits the figure's width into this many bins per pixel, since the axes only take up part of it and their
+# pixel columns do not line up with the bins
+BINS_PER_PIXEL = 4
+# Columns with more than this many points per bin are decimated before they are plotted
+DECIMATE_FACTOR = 4
+# Draft frames, shown while the view is still changing, only use one bin per pixel
+DRAFT_BINS_PER_PIXEL = 1
+
+
+# Indices of the points that draw the same line as all of x/y when it is 'pixels' wide: the first, last, lowest and
+# highest point of every pixel column (x must be sorted).  Stems are kept the same way, since the stems of a pixel
+# column only show as one bar from the lowest to the highest.
+def envelope(x: np.ndarray, y: np.ndarray, pixels: int) -> np.ndarray:
+    starts = np.unique(np.searchsorted(x, np.linspace(x[0], x[-1], pixels + 1)[:-1]))
+    starts = starts[starts < len(x)]
+    column = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(x))))
+    keep = np.zeros(len(x), dtype=bool)
+    keep[starts] = True
+    keep[np.append(starts[1:], len(x)) - 1] = True
+    for extreme in (np.fmin.reduceat(y, starts), np.fmax.reduceat(y, starts)):
+        at = np.flatnonzero(y == extreme[column])
+        keep[at[np.unique(column[at], return_index=True)[1]]] = True  # Only the first of equal extremes
+    return np.flatnonzero(keep)
+
+
+# Largest-Triangle-Three-Buckets: indices of about 'count' points that keep the shape of a scatter.  The points
+# are split into equal buckets, and each bucket keeps the point forming the largest triangle with the averages of the
+# buckets on either side (rather than with the point kept before it), so all buckets are chosen at once.
+def lttb(x: np.ndarray, y: np.ndarray, count: int) -> np.ndarray:
+    if len(x) <= count or count < 3:
+        return np.arange(len(x))
+    starts = np.unique(np.linspace(1, len(x) - 1, count - 1).astype(np.int64))[:-1]
+    sizes = np.diff(np.append(starts, len(x) - 1))
+    mean_x = np.concatenate(([x[0]], np.add.reduceat(x[1:-1], starts - 1) / sizes, [x[-1]]))
+    mean_y = np.concatenate(([y[0]], np.add.reduceat(y[1:-1], starts - 1) / sizes, [y[-1]]))
+    bucket = np.repeat(np.arange(len(starts)), sizes)
+    before_x, before_y, after_x, after_y = mean_x[bucket], mean_y[bucket], mean_x[bucket + 2], mean_y[bucket + 2]
+    area = np.abs((before_x - after_x) * (y[1:-1] - before_y) - (before_x - x[1:-1]) * (after_y - before_y))
+    largest = np.flatnonzero(area == np.maximum.reduceat(area, starts - 1)[bucket])
+    chosen = largest[np.unique(bucket[largest], return_index=True)[1]] + 1
+    return np.concatenate(([0], chosen, [len(x) - 1]))
+
+
+# Key of the points marking the limits among the artists of a plot
+LIMIT_POINTS = None
+
+# Points per block at the finest level of a Pyramid
+PYRAMID_BASE = 16
+# Blocks whose extremes are found at once while building the finest level
+PYRAMID_CHUNK = 65536
+
+
+# Indices of the first lowest and highest value of each row of 'blocks', ignoring NaN
+def _extremes(blocks: np.ndarray):
+    missing = np.isnan(blocks)
+    return np.where(missing, np.inf, blocks).argmin(axis=1), np.where(missing, -np.inf, blocks).argmax(axis=1)
+
+
+# Minimum/maximum envelope of a long column at every resolution.  The finest level holds, for each block of
+# PYRAMID_BASE points, the index of its lowest and highest point, and each further level merges pairs of blocks of
+# the level before.  Any window of the column is then drawn from the coarsest level whose blocks are no wider than a
+# bin, at a cost set by the number of bins instead of the number of points in the window.
+class Pyramid:
+    def __init__(self, y: np.ndarray):
+        self.y = y
+        self.levels = []  # (points per block, indices of the minima, indices of the maxima)
+        dtype = np.int32 if len(y) < 2 ** 31 else np.int64
+        blocks = len(y) // PYRAMID_BASE
+        lows, highs = np.empty(blocks, dtype=dtype), np.empty(blocks, dtype=dtype)
+        for first in range(0, blocks, PYRAMID_CHUNK):
+            last = min(first + PYRAMID_CHUNK, blocks)
+            low, high = _extremes(y[first * PYRAMID_BASE:last * PYRAMID_BASE].reshape(-1, PYRAMID_BASE))
+            offsets = np.arange(first, last, dtype=dtype) * PYRAMID_BASE
+            lows[first:last], highs[first:last] = offsets + low, offsets + high
+
+        size = PYRAMID_BASE
+        while len(lows) > 0:
+            self.levels.append((size, lows, highs))
+            if len(lows) == 1:
+                break
+            lows, highs = self._merge(lows, np.less), self._merge(highs, np.greater)
+            size *= 2
+
+    # Pairs of blocks of a level merged into the next, keeping the extreme of each pair (a trailing odd block is
+    # dropped, as it is only part of a block of the next level)
+    def _merge(self, index: np.ndarray, better) -> np.ndarray:
+        first, second = index[0:len(index) - 1:2], index[1::2]
+        a, b = self.y[first], self.y[second]
+        return np.where(better(b, a) | np.isnan(a), second, first)
+
+    # Indices of the points drawing the envelope of rows start to stop (exclusive) in 'bins' bins, or None if the
+    # window is too short for even the finest level, when the points can be decimated directly
+    def envelope(self, start: int, stop: int, bins: int):
+        for size, lows, highs in reversed(self.levels):
+            if (stop - start) / size >= bins:
+                break
+        else:
+            return None
+        first, last = -(-start // size), stop // size  # Blocks lying wholly inside the window
+        edges = [start, stop - 1]
+        for low, high in ((start, first * size), (last * size, stop)):  # The partial blocks at either end
+            if high > low and not np.isnan(self.y[low:high]).all():
+                edges += [low + np.nanargmin(self.y[low:high]), low + np.nanargmax(self.y[low:high])]
+        return np.unique(np.concatenate((edges, lows[first:last], highs[first:last])))
+
+
+# The points of a column worth handing to matplotlib at 'pixels' wide.  Both ways of thinning assume numeric x
+# values in increasing order, so anything else is drawn in full.
+def decimate(x: np.ndarray, y: np.ndarray, gtype: int, pixels: int, ordered: bool,
+             bins_per_pixel: int = BINS_PER_PIXEL):
+    bins = bins_per_pixel * pixels
+    if len(x) <= DECIMATE_FACTOR * bins or not ordered or x.dtype.kind not in "fiu" or y.dtype.kind not in "fiu":
+        return x, y
+    if gtype == SCATTER:
+        shown = np.isfinite(x) & np.isfinite(y)  # Markers are not drawn for missing values anyway
+        x, y = x[shown], y[shown]
+        index = lttb(x, y, DECIMATE_FACTOR * bins)
+    else:
+        index = envelope(x, y, bins)
+    return x[index], y[index]
+
 
 class GraphCanvas:
     def __init__(self, owner):
@@ -30,23 +153,76 @@ class GraphCanvas:
         # Members
         self.figure = plt.Figure(figsize=(12, 8), layout='compressed')
         self.curr_graph = None
+        self.artists = {}  # Column -> the artist drawing it, kept between redraws
+        self.drawn = None  # What the artists were built for: graph, figure size and Graph.layout()
+        self.background = None  # Pixels of the axes without the artists, which draft frames are drawn over
 
         # Customization
         self.figure.get_layout_engine().set(w_pad=0.25, h_pad=0.25)
+        self.layout_engine = self.figure.get_layout_engine()
 
 
     def set_canvas(self, canvas):
         self.canvas = canvas
 
+    # Only a new graph, figure size, x-axis, column or graph type builds the plot again.  Otherwise, as when panning
+    # and zooming, the existing artists are given their new points.  The layout is worked out on the first draw after
+    # a build and then kept, as it does not change with the data.
     def graph(self):
         if self.curr_graph is not None:
+            drawn = self.current()
+            if drawn == self.drawn and self.figure.axes:
+                self.curr_graph.refresh(self.figure.axes[0], self.artists)
+                self.canvas.draw()
+                return
             self.figure.clear()
-            self.curr_graph.plot(plot=self.figure.add_subplot())
+            self.figure.set_layout_engine(self.layout_engine)
+            self.artists = {}
+            self.background = None
+            self.curr_graph.plot(plot=self.figure.add_subplot(), artists=self.artists)
+            self.canvas.draw()
+            self.figure.set_layout_engine("none")
+            self.drawn = drawn
+
+    def current(self) -> tuple:
+        return self.curr_graph, tuple(self.figure.get_size_inches()), self.curr_graph.layout()
+
+    # Matplotlib artists making up the plot of the columns (a stem plot is a container of several)
+    def column_artists(self) -> list:
+        parts = []
+        for artist in self.artists.values():
+            parts += list(artist) if isinstance(artist, Container) else [artist]
+        return parts
+
+    # Quick frame while the view is still changing: only the artists are drawn, at a lower resolution, over the
+    # saved background of the axes and copied to the screen.  The ticks are left as they were until the next full
+    # graph().  Falls back to graph() when the plot has to be built again.
+    def draft(self):
+        if self.curr_graph is None:
+            return
+        if self.current() != self.drawn or not self.figure.axes:
+            self.graph()
+            return
+        plot = self.figure.axes[0]
+        self.curr_graph.refresh(plot, self.artists, draft=True)
+        if self.background is None:  # The axes have no grid, so their background does not depend on the view
+            for artist in self.column_artists():
+                artist.set_visible(False)
             self.canvas.draw()
+            self.background = self.canvas.copy_from_bbox(plot.bbox)
+            for artist in self.column_artists():
+                artist.set_visible(True)
+        self.canvas.restore_region(self.background)
+        for artist in self.column_artists():
+            plot.draw_artist(artist)
+        self.canvas.blit(plot.bbox)
 
     def threed_graph(self, x, y, z, gtype: AnyStr):
         if self.curr_graph is not None:
             self.figure.clear()
+            self.figure.set_layout_engine(self.layout_engine)
+            self.drawn = None
+            self.background = None
             self.curr_graph.plot_3d(plot=self.figure.add_subplot(projection="3d"), x=x, y=y, z=z, graph_type=gtype)
             self.canvas.draw()
 
@@ -66,33 +242,61 @@ class Graph:
             self.column_gtypes = gtypes
 
         # Initialize a maximum and minimum for the x components
-        self.xmin = self.dataset.data_frame[self.dataset.ax].min()
-        self.xmax = self.dataset.data_frame[self.dataset.ax].max()
+        self.xmin, self.xmax = self.dataset.x_limits()
         self.ymin, self.ymax = None, None
 
-    def plot(self, plot: plt.Subplot):
-        color_index = 0  # Allows each plot to be a different color
+    # The x-axis and the graph type of every column, which decide what artists a plot has
+    def layout(self) -> tuple:
+        return self.dataset.ax, tuple((column, self.column_gtypes.get(column)) for column in self.dataset.columns())
+
+    # For each column to plot, its colour index and the points worth drawing between xmin and xmax at 'pixels' wide
+    def visible(self, pixels: int, bins_per_pixel: int = BINS_PER_PIXEL) -> dict:
+        # Include only the portions of the spectrum needed to be seen
+        cut_set = self.dataset.view(self.xmin, self.xmax)
+
+        # Columns are reduced to what can be told apart across the figure's width in pixels, so redrawing costs the
+        # same however many points are in view.  Long line and stem columns are read from their Pyramid.
+        bins = bins_per_pixel * pixels
+        rows = self.dataset.rows(self.xmin, self.xmax)
+        x = cut_set[self.dataset.ax].to_numpy()
+        ordered = rows is not None or x.dtype.kind in "fiu" and bool(np.all(x[1:] >= x[:-1]))
+
+        shown = {}
+        for color_index, column in enumerate(cut_set.columns):  # Allows each plot to be a different color
+            if column != self.dataset.freq_ax and column != self.dataset.ax and self.column_gtypes[column] != NONE:  # Do not plot frequency axis or x-axis
+                index = None
+                if rows is not None and self.column_gtypes[column] != SCATTER and \
+                        rows[1] - rows[0] > DECIMATE_FACTOR * bins:
+                    pyramid = self.dataset.pyramid(column)
+                    index = pyramid.envelope(rows[0], rows[1], bins) if pyramid is not None else None
+                if index is not None:
+                    x_shown, y_shown = self.dataset.column(self.dataset.ax).to_numpy()[index], pyramid.y[index]
+                else:
+                    x_shown, y_shown = decimate(x, cut_set[column].to_numpy(), self.column_gtypes[column], pixels,
+                                                ordered, bins_per_pixel)
+                shown[column] = (color_index, x_shown, y_shown)
+        return shown
+
+    # Builds the plot, adding the artist of every column to 'artists' if given so refresh can update them later
+    def plot(self, plot: plt.Subplot, artists: dict = None):
+        if artists is None:
+            artists = {}
 
         if self.is_auto:
             self.reset_x()
             self.ymax, self.ymin = None, None
 
-        # Include only the portions of the spectrum needed to be seen
-        cut_set = self.dataset.data_frame[self.dataset.data_frame[self.dataset.ax].between(self.xmin, self.xmax)]
-
         # Plot each column present in the dataset
-        for column in self.dataset.data_frame.columns:
-            if column != self.dataset.freq_ax and column != self.dataset.ax and self.column_gtypes[column] != NONE:  # Do not plot frequency axis or x-axis
-                if self.column_gtypes[column] == LINE:
-                    plot.plot(cut_set[self.dataset.ax], cut_set[column],
-                              label=column, color="C" + str(color_index))
-                elif self.column_gtypes[column] == SCATTER:
-                    plot.scatter(cut_set[self.dataset.ax], cut_set[column],
-                                 label=column, c="C" + str(color_index))
-                elif self.column_gtypes[column] == STEM:
-                    plot.stem(cut_set[self.dataset.ax], cut_set[column],
-                              label=column, linefmt="C" + str(color_index), markerfmt="None")
-            color_index += 1
+        for column, (color_index, x_shown, y_shown) in self.visible(max(int(plot.figure.bbox.width), 1)).items():
+            if self.column_gtypes[column] == LINE:
+                artists[column] = plot.plot(x_shown, y_shown,
+                                            label=column, color="C" + str(color_index))[0]
+            elif self.column_gtypes[column] == SCATTER:
+                artists[column] = plot.scatter(x_shown, y_shown,
+                                               label=column, c="C" + str(color_index))
+            elif self.column_gtypes[column] == STEM:
+                artists[column] = plot.stem(x_shown, y_shown,
+                                            label=column, linefmt="C" + str(color_index), markerfmt="None")
         plot.set_xlabel(self.dataset.ax)
 
         # If None is passed for ymin/max above, the graph will autoscale, and we can obtain the values that matplolib gives
@@ -100,7 +304,7 @@ class Graph:
         self.ymin, self.ymax = plot.get_ylim()
 
         # Cutting the spectrum creates inconsistent zooming, so points are placed at the limits
-        plot.scatter((self.xmax, self.xmin), (self.ymax, self.ymin))
+        artists[LIMIT_POINTS] = plot.scatter((self.xmax, self.xmin), (self.ymax, self.ymin))
 
         # Hide the additional points
         thresh = (self.xmax - self.xmin) * 0.01
@@ -108,11 +312,54 @@ class Graph:
 
         return plot
 
+    @staticmethod
+    def _extend_limits(plot: plt.Subplot, x: np.ndarray, y: np.ndarray):
+        points = np.column_stack((x, y)).astype(np.float64)
+        plot.update_datalim(points[np.isfinite(points).all(axis=1)])
+
+    # Redraws a plot built by plot, after the view or the values changed but not its layout(), by moving the points
+    # of its artists instead of creating new ones.  A draft uses fewer points.
+    def refresh(self, plot: plt.Subplot, artists: dict, draft: bool = False):
+        if self.is_auto:
+            self.reset_x()
+            self.ymax, self.ymin = None, None
+
+        plot.ignore_existing_data_limits = True
+        visible = self.visible(max(int(plot.figure.bbox.width), 1), DRAFT_BINS_PER_PIXEL if draft else BINS_PER_PIXEL)
+        for column, (color_index, x_shown, y_shown) in visible.items():
+            artist = artists.get(column)
+            if artist is None:  # A graph type plot does not draw
+                continue
+            if self.column_gtypes[column] == LINE:
+                artist.set_data(x_shown, y_shown)
+            elif self.column_gtypes[column] == SCATTER:
+                artist.set_offsets(np.column_stack((x_shown, y_shown)))
+            elif self.column_gtypes[column] == STEM:
+                base = np.zeros(len(x_shown))
+                artist.markerline.set_data(x_shown, y_shown)
+                artist.stemlines.set_segments(np.stack((np.column_stack((x_shown, base)),
+                                                        np.column_stack((x_shown, y_shown))), axis=1))
+                if len(x_shown) > 0:
+                    artist.baseline.set_data([np.min(x_shown), np.max(x_shown)], [0, 0])
+                self._extend_limits(plot, x_shown, base)
+            self._extend_limits(plot, x_shown, y_shown)
+
+        # Limits not given are found the way plot lets matplotlib autoscale them
+        if self.ymin is None or self.ymax is None:
+            plot.set_autoscaley_on(True)
+            plot.autoscale_view(scalex=False)
+        plot.set_ylim(self.ymin, self.ymax)
+        self.ymin, self.ymax = plot.get_ylim()
+
+        artists[LIMIT_POINTS].set_offsets([(self.xmax, self.ymax), (self.xmin, self.ymin)])
+        thresh = (self.xmax - self.xmin) * 0.01
+        plot.set_xlim(self.xmin + thresh, self.xmax - thresh)
+
     def plot_3d(self, plot: plt.Subplot, x, y, z, graph_type: AnyStr):
         if graph_type == LINE:
-            plot.plot(self.dataset.data_frame[x], self.dataset.data_frame[y], self.dataset.data_frame[z])
+            plot.plot(self.dataset.column(x), self.dataset.column(y), self.dataset.column(z))
         if graph_type == SCATTER:
-            plot.scatter(self.dataset.data_frame[x], self.dataset.data_frame[y], self.dataset.data_frame[z])
+            plot.scatter(self.dataset.column(x), self.dataset.column(y), self.dataset.column(z))
         plot.set_xlabel(x)
         plot.set_ylabel(y)
         plot.set_zlabel(z)
@@ -127,13 +374,12 @@ class Graph:
         index = 0
         if len(new_types) != len(self.column_gtypes.values()):
             raise ValueError
-        for column in self.dataset.data_frame.columns:
+        for column in self.dataset.columns():
             self.column_gtypes[column] = new_types[index]
             index += 1
 
     def reset_x(self):
-        self.xmin = self.dataset.data_frame[self.dataset.ax].min()
-        self.xmax = self.dataset.data_frame[self.dataset.ax].max()
+        self.xmin, self.xmax = self.dataset.x_limits()
 
     def set_scale(self, xmin: Number = None, xmax: Number = None, ymin: Number = None, ymax: Number = None,
                   auto: bool = False):
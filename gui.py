@@ -1,5 +1,5 @@
-import re
 import sys
+import threading
 
 if "win32" in sys.platform:
     from win32api import GetMonitorInfo, MonitorFromPoint
@@ -8,14 +8,20 @@ import tkinter.ttk as ttk
 from typing import Union, AnyStr, Callable
 from tkinter import filedialog, messagebox
 
+import numpy as np
 import pandas as pd
 from matplotlib.backends.backend_tkagg import (
     FigureCanvasTkAgg, NavigationToolbar2Tk
 )
 
 import data
+import filters
 import graph
 import graph as gph
+import library
+import lineshape
+import peaky
+import triples
 import utils
 
 
@@ -137,7 +143,7 @@ class App(RootExpansion):
             elif '3' in event.keysym:
                 diff = (gr.ymax - gr.ymin) * scale * 0.1
                 gr.set_scale(ymin=gr.ymin + diff, ymax=gr.ymax + diff)
-            self.main_pic.update_graph()
+            self.main_pic.schedule_update()
 
 
 # The menubar at the top of the screen
@@ -327,6 +333,11 @@ class Header(tk.Frame):
         self.peak_pick_button = ttk.Button(master=self, command=self.peak_pick, text="Peak Pick")
         self.ratio_sep_button = ttk.Button(master=self, command=self.ratio_sep, text="Ratio Separate")
         self.filter_known_button = ttk.Button(master=self, command=self.filter_known, text="Filter Known")
+        self.differences_button = ttk.Button(master=self, command=self.differences, text="Constant Diff")
+        self.triples_button = ttk.Button(master=self, command=self.triples, text="Triples Search")
+        self.fit_button = ttk.Button(master=self, command=self.fit_lines, text="Fit Lines")
+        self.known_lines_button = ttk.Button(master=self, command=self.known_lines, text="Known Lines")
+        self.clusters_button = ttk.Button(master=self, command=self.ratio_clusters, text="Ratio Clusters")
 
         # Positioning
         self.graphing_message.grid(row=0, column=0, sticky='w')
@@ -338,6 +349,11 @@ class Header(tk.Frame):
         self.peak_pick_button.grid(row=1, column=2, padx=10, pady=5, sticky='w', ipady=5)
         self.ratio_sep_button.grid(row=1, column=3, padx=10, pady=10, sticky='w', ipady=5)
         self.filter_known_button.grid(row=2, column=2, padx=10, pady=10, sticky='w', ipady=5)
+        self.differences_button.grid(row=2, column=3, padx=10, pady=10, sticky='w', ipady=5)
+        self.triples_button.grid(row=1, column=4, padx=10, pady=5, sticky='w', ipady=5)
+        self.fit_button.grid(row=2, column=4, padx=10, pady=10, sticky='w', ipady=5)
+        self.known_lines_button.grid(row=1, column=5, padx=10, pady=5, sticky='w', ipady=5)
+        self.clusters_button.grid(row=2, column=5, padx=10, pady=10, sticky='w', ipady=5)
 
         self.grid_propagate(True)
 
@@ -376,9 +392,11 @@ class Header(tk.Frame):
             PeakPickWindow(self.root.sidebar.get_pressed(), self.peak_pick_callback)
 
     # Information provided by PeakPickWindow
-    def peak_pick_callback(self, created_window, new_name, res, min_inten, max_inten):
+    def peak_pick_callback(self, created_window, new_name, res, min_inten, max_inten, method, tolerance, snr,
+                           noise_window):
         created_window.destroy()
-        new_data = data.peak_pick(self.root.sidebar.get_pressed(), new_name, res, min_inten, max_inten)
+        new_data = data.peak_pick(self.root.sidebar.get_pressed(), new_name, res, min_inten, max_inten, method,
+                                  tolerance=tolerance, snr=snr, noise_window=noise_window)
         self.root.data_storage.add_data(new_data)
 
     def ratio_sep(self):
@@ -389,9 +407,31 @@ class Header(tk.Frame):
         if self.root.sidebar.get_pressed() is not None and len(self.root.sidebar.dataset_texts) > 1:
             SimilarRemoveWindow(self.root, self.root.sidebar.get_pressed())
 
+    def differences(self):
+        if self.root.sidebar.get_pressed() is not None:
+            DifferenceWindow(self.root, self.root.sidebar.get_pressed())
+
+    def triples(self):
+        if self.root.sidebar.get_pressed() is not None:
+            TriplesWindow(self.root, self.root.sidebar.get_pressed())
+
+    def fit_lines(self):
+        if self.root.sidebar.get_pressed() is not None:
+            FitLinesWindow(self.root, self.root.sidebar.get_pressed())
+
+    def known_lines(self):
+        if self.root.sidebar.get_pressed() is not None:
+            KnownLinesWindow(self.root, self.root.sidebar.get_pressed())
+
+    def ratio_clusters(self):
+        if self.root.sidebar.get_pressed() is not None:
+            RatioClusterWindow(self.root, self.root.sidebar.get_pressed())
+
 
 # Frame for displaying the matplotlib graph
 class MainPic(tk.Frame):
+    settle_ms = 150  # Time without view changes after which a draft is replaced by the full graph
+
     def __init__(self, root):
         super().__init__(master=root)
 
@@ -404,6 +444,8 @@ class MainPic(tk.Frame):
         self.graph_canvas.set_canvas(self.canvas)
         self.toolbar = NavigationToolbar2Tk(canvas=self.canvas, window=self, pack_toolbar=False)
         self.is_graphed = False
+        self.draft_job = None
+        self.settle_job = None
 
         # Positioning
         self.toolbar.pack(side=tk.BOTTOM, fill=tk.X)
@@ -423,6 +465,23 @@ class MainPic(tk.Frame):
 
     def update_graph(self):
         self.graph_canvas.graph()
+
+    # For keyboard navigation: every view change made before Tk is idle again is shown by one draft frame, and the
+    # full graph is drawn once the changes stop for settle_ms
+    def schedule_update(self):
+        if self.draft_job is None:
+            self.draft_job = self.after_idle(self.draft_graph)
+
+    def draft_graph(self):
+        self.draft_job = None
+        self.graph_canvas.draft()
+        if self.settle_job is not None:
+            self.after_cancel(self.settle_job)
+        self.settle_job = self.after(self.settle_ms, self.settled)
+
+    def settled(self):
+        self.settle_job = None
+        self.update_graph()
         
 
 # Changes how the data is viewed in the MatplotLib window
@@ -438,7 +497,7 @@ class GraphTypeWin(RootExpansion):
         self.entry_list = []
         self.gtypes = ("None", "Line", "Scatter", "Stem")
         index = 0
-        for column in dataset.data_frame.columns.values.tolist():
+        for column in dataset.columns():
             message = tk.Message(master=self, text=column + ":", width=150)
             types = ttk.Combobox(master=self, state="readonly")
             types['values'] = self.gtypes
@@ -726,6 +785,21 @@ class PeakPickWindow(RootExpansion):
         self.res_adjust_text = tk.Message(master=self, text="Adjusted Resolution (MHz):", width=150)
         self.res_adjust_var = tk.StringVar(self, value="0.002")
         self.res_adjust_entry = ttk.Entry(master=self, textvariable=self.res_adjust_var, width=10)
+        self.method_text = tk.Message(master=self, text="Method:", width=150)
+        self.method_var = tk.StringVar(self, value=data.SPLINE)
+        self.method_box = ttk.Combobox(master=self, textvariable=self.method_var, state="readonly")
+        self.snr_text = tk.Message(master=self, text="Min SNR:", width=150)
+        self.snr_var = tk.StringVar(self, value="3")
+        self.snr_entry = ttk.Entry(master=self, textvariable=self.snr_var, width=10, state="disabled")
+        self.noise_window_text = tk.Message(master=self, text="Noise Window (points):", width=150)
+        self.noise_window_var = tk.StringVar(self, value=str(peaky.NOISE_WINDOW))
+        self.noise_window_entry = ttk.Entry(master=self, textvariable=self.noise_window_var, width=10,
+                                            state="disabled")
+        self.tolerance_text = tk.Message(master=self, text="Align Columns Within (kHz):", width=150)
+        self.tolerance_var = tk.StringVar(self, value="10")
+        self.tolerance_entry = ttk.Entry(master=self, textvariable=self.tolerance_var, width=10)
+        self.persist_var = tk.BooleanVar(self, value=data.peak_cache.directory is not None)
+        self.persist_check = ttk.Checkbutton(master=self, text="Keep Peak Lists On Disk", variable=self.persist_var)
         self.enter_button = ttk.Button(master=self, command=self.enter, text="Enter")
 
         # Positioning
@@ -737,9 +811,20 @@ class PeakPickWindow(RootExpansion):
         self.inten_max_entry.grid(row=3, column=1, padx=10, pady=5)
         self.res_adjust_text.grid(row=4, column=0, columnspan=2, padx=10, pady=5)
         self.res_adjust_entry.grid(row=5, column=0, columnspan=2, padx=10, pady=5)
-        self.enter_button.grid(row=6, column=0, columnspan=2, padx=10, pady=10)
+        self.method_text.grid(row=6, column=0, columnspan=2, padx=10, pady=5)
+        self.method_box.grid(row=7, column=0, columnspan=2, padx=10, pady=5)
+        self.snr_text.grid(row=8, column=0, padx=10, pady=5)
+        self.snr_entry.grid(row=9, column=0, padx=10, pady=5)
+        self.noise_window_text.grid(row=8, column=1, padx=10, pady=5)
+        self.noise_window_entry.grid(row=9, column=1, padx=10, pady=5)
+        self.tolerance_text.grid(row=10, column=0, columnspan=2, padx=10, pady=5)
+        self.tolerance_entry.grid(row=11, column=0, columnspan=2, padx=10, pady=5)
+        self.persist_check.grid(row=12, column=0, columnspan=2, padx=10, pady=5)
+        self.enter_button.grid(row=13, column=0, columnspan=2, padx=10, pady=10)
 
         # Customization
+        self.method_box['values'] = data.PEAK_METHODS
+        self.method_box.bind("<<ComboboxSelected>>", self.method_selected)
         self.title("Peak Pick")
         self.update()
         self.center_root(self.winfo_width(), self.winfo_height())
@@ -754,9 +839,25 @@ class PeakPickWindow(RootExpansion):
             inten_min = float(self.inten_min_entry.get())
             inten_max = float(self.inten_max_entry.get())
             res = float(self.res_adjust_entry.get())
+            tolerance = float(self.tolerance_entry.get())
+            snr = float(self.snr_entry.get())
+            noise_window = int(self.noise_window_entry.get())
         except ValueError:
             return
-        self.callback(self, name, res, inten_min, inten_max)
+        data.peak_cache.persist(self.persist_var.get())
+        self.callback(self, name, res, inten_min, inten_max, self.method_var.get(), tolerance, snr, noise_window)
+
+    # Refinement and noise adaptive methods do not resample, so the resolution box is only enabled for the spline
+    # methods.  The SNR settings are only used by the noise adaptive method.
+    def method_selected(self, event=None):
+        method = self.method_var.get()
+        if method in data.REFINE_METHODS or method == data.NOISE:
+            self.res_adjust_entry["state"] = "disabled"
+        else:
+            self.res_adjust_entry["state"] = "normal"
+        noise_state = "normal" if method == data.NOISE else "disabled"
+        self.snr_entry["state"] = noise_state
+        self.noise_window_entry["state"] = noise_state
 
 
 # Window for modifying the data in a dataframe
@@ -811,7 +912,7 @@ class ColumnFrame(tk.Frame):
         self.info_text.grid(row=2, column=1, columnspan=2)
 
         # Customization
-        self.remove_box['values'] = self.dataset.data_frame.columns.values.tolist()
+        self.remove_box['values'] = self.dataset.columns()
         self.pack_propagate(False)
 
     def remove(self):
@@ -826,6 +927,8 @@ class ColumnFrame(tk.Frame):
 
 
 class RowFrame(tk.Frame):
+    all_columns = "All Columns"
+
     def __init__(self, tabs, root, dataset: data.Data, caller):
         super().__init__(master=tabs)
 
@@ -835,7 +938,7 @@ class RowFrame(tk.Frame):
         self.caller = caller
 
         # Members
-        self.dropdown = ["Index"] + self.data.data_frame.columns.values.tolist()
+        self.dropdown = [filters.INDEX] + self.data.columns()
 
         self.remove_rowval_text = tk.Message(master=self, text="Remove Row By Value:", width=150)
         self.remove_rowval_var = tk.StringVar(self)
@@ -850,6 +953,10 @@ class RowFrame(tk.Frame):
         self.remove_val_entry_var = tk.StringVar(self)
         self.remove_val_entry = ttk.Entry(master=self, textvariable=self.remove_val_entry_var)
         self.remove_val_button = ttk.Button(master=self, text="Remove", command=self.remove_val_command)
+        self.remove_help = tk.Message(master=self, width=300,
+                                      text="Removes where an expression holds, e.g. \"< 5\" for the chosen column "
+                                           "or \"{A} < 5 and {B} > 1\". Rows with empty (NaN) tested values are kept. "
+                                           "Comparisons are strict: unlike before, \"< 5\" keeps rows equal to 5.")
 
         self.modify_val_message = tk.Message(master=self, text="Modify With Expression:", width=150)
         self.modify_val_combo_val = tk.StringVar(self)
@@ -869,61 +976,51 @@ class RowFrame(tk.Frame):
         self.remove_val_drop.grid(row=4, column=0, padx=10)
         self.remove_val_entry.grid(row=5, column=0, pady=5)
         self.remove_val_button.grid(row=5, column=1, padx=10)
-        self.modify_val_message.grid(row=6, column=0)
-        self.modify_val_col.grid(row=7, column=0, padx=10)
-        self.modify_val_entry.grid(row=8, column=0, pady=5)
-        self.modify_val_button.grid(row=8, column=1, padx=10)
-        self.info.grid(row=9, column=0, columnspan=2)
+        self.remove_help.grid(row=6, column=0, columnspan=2, padx=10)
+        self.modify_val_message.grid(row=7, column=0)
+        self.modify_val_col.grid(row=8, column=0, padx=10)
+        self.modify_val_entry.grid(row=9, column=0, pady=5)
+        self.modify_val_button.grid(row=9, column=1, padx=10)
+        self.info.grid(row=10, column=0, columnspan=2)
 
         # Customization
         self.remove_rowval_drop['values'] = self.dropdown
         self.remove_val_drop['values'] = self.dropdown
-        self.modify_val_col['values'] = self.data.data_frame.columns.values.tolist()
+        self.modify_val_col['values'] = [self.all_columns] + self.data.data_frame.columns.values.tolist()
         self.pack_propagate(False)
 
     def remove_rowval_command(self):
-        if self.remove_rowval_var.get() != "":
-            self.remove_val_command(whole_row=True)
+        self.remove_val_command(whole_row=True)
 
+    # Entries are filter expressions (see filters.py); one starting with a comparison applies to the chosen column
     def remove_val_command(self, whole_row=False):
-        if not whole_row and self.remove_val_entry_var.get() == "":
-            return
-
         command = self.remove_rowval_entry_var.get() if whole_row else self.remove_val_entry_var.get()
         axis = self.remove_rowval_var.get() if whole_row else self.remove_val_var.get()
-        command_list = None
-
-        # RegEx to find all values in between brackets
-        keywords = re.findall("(?<={)(.*?)(?=})", command)
-        if len(keywords) != 0:
-            # Replace anything that is in brackets with a temporary asterisk
-            for value in keywords:
-                command = command.replace("{" + value + "}", " * ")
-            # Split string based on spaces
-            command_list = command.split()
-            # Replace asterisks with the labels for a complete command list
-            index_keywords = 0
-            index_command = 0
-            for value in command_list:
-                if value == "*":
-                    # Include dollar sign to indicate to data that this is a label
-                    command_list[index_command] = "$" + keywords[index_keywords]
-                    index_keywords += 1
-                index_command += 1
-        else:
-            command_list = command.split()
-        if len(command_list) == 2 or len(command_list) == 3:
-            self.data.remove_data(command_list, axis, whole_row=whole_row)
-            self.root.caller.main_pic.update_graph()
+        if command.strip() == "":
+            return
+        try:
+            matched, elapsed = self.data.remove_data(command, axis, whole_row=whole_row)
+        except ValueError as error:
+            self.info_var.set(str(error) or "Please check your syntax")
+            return
+        self.info_var.set("Removed {0} rows, evaluated in {1:.1f} ms".format(matched, elapsed * 1000))
+        self.root.caller.main_pic.update_graph()
 
     def modify_val_command(self):
         mod = self.modify_val_entry.get()
         if mod != "":
             split = mod.split()
             try:
-                if len(split) == 2:
-                    self.data.modify_data(column=self.modify_val_col.get(), operator=split[0], values=[float(split[1])])
+                column = self.modify_val_col.get()
+                if column == self.all_columns:  # Every column but the axes is transformed in one batch
+                    column = [name for name in self.data.data_frame.columns
+                              if name not in (self.data.freq_ax, self.data.ax)]
+                if len(split) in (1, 2):
+                    values = [float(value) for value in split[1:]]
+                    self.data.modify_data(column=column, operator=split[0], values=values)
                 self.info_var.set("Modification successful")
+            except data.NotNumericError as error:
+                self.info_var.set(str(error))
             except ValueError:
                 self.info_var.set("Please check your syntax")
 
@@ -975,7 +1072,7 @@ class ExportDataWin(RootExpansion):
         location = self.location_var.get()
         file_type = self.type_var.get()
         if "" not in [name, location, file_type]:
-            utils.export_file(name, location, self.data.data_frame, file_type)
+            utils.export_file(name, location, self.data.full_frame(), file_type)
             self.destroy()
 
 
@@ -988,14 +1085,18 @@ class MergeWindow(RootExpansion):
         self.owner = owner
 
         # Members
-        self.to_merge_message = tk.Message(master=self, text="Merge With:", width=300)
-        self.to_merge_var = tk.StringVar(self)
-        self.to_merge_box = ttk.Combobox(master=self, state="readonly")
+        self.to_merge_message = tk.Message(master=self, text="Merge With (select one or more):", width=300)
+        self.to_merge_box = tk.Listbox(master=self, selectmode=tk.MULTIPLE, exportselection=False, height=8)
         self.combine_var = tk.IntVar(master=self, value=0)
         self.combine_val_box = ttk.Checkbutton(master=self, variable=self.combine_var, text="Combine")
         self.threshold_message = tk.Message(master=self, text="Threshold (kHz):", width=150)
         self.threshold_var = tk.StringVar(master=self, value="10")
         self.threshold_box = ttk.Entry(master=self, textvariable=self.threshold_var)
+        self.resample_var = tk.IntVar(master=self, value=0)
+        self.resample_box = ttk.Checkbutton(master=self, variable=self.resample_var, text="Resample To Common Grid")
+        self.step_message = tk.Message(master=self, text="Grid Step (MHz, blank for finest):", width=150)
+        self.step_var = tk.StringVar(master=self)
+        self.step_box = ttk.Entry(master=self, textvariable=self.step_var)
         self.enter_button = tk.Button(master=self, command=self.enter, text="Enter")
 
         # Positioning
@@ -1004,29 +1105,27 @@ class MergeWindow(RootExpansion):
         self.combine_val_box.grid(row=2, column=0, rowspan=2, padx=10)
         self.threshold_message.grid(row=2, column=1, padx=10, pady=5)
         self.threshold_box.grid(row=3, column=1, padx=10, pady=5)
-        self.enter_button.grid(row=4, column=0, columnspan=2, padx=20, pady=5)
+        self.resample_box.grid(row=4, column=0, rowspan=2, padx=10)
+        self.step_message.grid(row=4, column=1, padx=10, pady=5)
+        self.step_box.grid(row=5, column=1, padx=10, pady=5)
+        self.enter_button.grid(row=6, column=0, columnspan=2, padx=20, pady=5)
 
         # Customization
-        data_names = []
         for dataset in owner.data_storage.data_list:
             if dataset.name != who.name:
-                data_names.append(dataset.name)
-
-        self.to_merge_box['values'] = data_names
+                self.to_merge_box.insert(tk.END, dataset.name)
 
         self.update()
         self.center_root(self.winfo_width(), self.winfo_height())
         self.resizable(False, False)
 
     def enter(self):
-        if self.to_merge_box.get() != "":
+        to_merge = [self.to_merge_box.get(index) for index in self.to_merge_box.curselection()]
+        if len(to_merge) > 0:
             try:
-                to_merge = None
                 thresh = int(self.threshold_var.get())
-                for dat in self.owner.data_storage.data_list:
-                    if self.to_merge_box.get() == dat.name:
-                        to_merge = dat.name
-                self.callback(to_merge, bool(self.combine_var.get()), thresh)
+                step = float(self.step_var.get()) if self.step_var.get() != "" else None
+                self.callback(to_merge, bool(self.combine_var.get()), thresh, bool(self.resample_var.get()), step)
                 self.destroy()
             except ValueError:
                 return
@@ -1266,7 +1365,7 @@ class ThreeDWindow(RootExpansion):
         self.enter_button.grid(row=5, column=0, columnspan=2)
 
         # Customization
-        vals = dataset.data_frame.columns.values.tolist()
+        vals = dataset.columns()
         self.x_entry['values'] = self.y_entry['values'] = self.z_entry['values'] = vals
         self.graph_type_entry['values'] = ['Line', 'Scatter']
 
@@ -1317,6 +1416,11 @@ class RatioWin(RootExpansion):
                                               value="i")
         self.exclude_button = ttk.Radiobutton(master=self.step_2_box, text="Exclude", variable=self.include_var,
                                               value="e")
+        self.combine_var = tk.StringVar(self.step_2_box, value=data.AND)
+        self.all_button = ttk.Radiobutton(master=self.step_2_box, text="All Columns", variable=self.combine_var,
+                                          value=data.AND)
+        self.any_button = ttk.Radiobutton(master=self.step_2_box, text="Any Column", variable=self.combine_var,
+                                          value=data.OR)
 
         self.info_var = tk.StringVar(self)
         self.info = tk.Message(master=self, textvariable=self.info_var, width=150)
@@ -1336,14 +1440,15 @@ class RatioWin(RootExpansion):
         self.ratio_exe.grid(row=1, column=2)
         self.include_button.grid(row=2, column=0, pady=5)
         self.exclude_button.grid(row=2, column=1, pady=5)
+        self.all_button.grid(row=3, column=0, pady=5)
+        self.any_button.grid(row=3, column=1, pady=5)
 
         # Customization
         axis_list = dataset.data_frame.columns.values.tolist()
         axis_list.remove(dataset.freq_ax)
         self.axis_box['values'] = axis_list
 
-        if self.dataset.is_ratio:
-            self.axis_box["state"] = "disabled"
+        if self.dataset.is_ratio:  # The ratio columns exist already, but step 2 still needs the axis
             self.enter_axis_button["state"] = "disabled"
 
         self.update()
@@ -1367,19 +1472,11 @@ class RatioWin(RootExpansion):
                 self.info_var.set("Please input a number")
                 return
 
-            # Generate ratios
-            ratio_columns = data.calc_ratios(self.dataset, axis)
-            self.dataset.is_ratio = True
-
-            if self.include_var == "e":  # 'e' stands for exclude, the else is if its 'i' for include
-                for column in ratio_columns:  # Only use for columns that have a ratio calculated
-                    self.dataset.data_frame = df[(df[ratio_columns[column]] > ratio + margin)
-                                                 | (df[ratio_columns[column]] < ratio - margin)]
-            else:
-                for column in ratio_columns:
-                    self.dataset.data_frame = df[(df[ratio_columns[column]] > ratio - margin)
-                                                 & (df[ratio_columns[column]] < ratio + margin)]
-                return ratio_columns
+            # All ratios are tested in one pass and their results combined, 'e' standing for exclude and 'i' for
+            # include
+            mask = data.ratio_mask(self.dataset, axis, ratio, margin, include=self.include_var.get() != "e",
+                                   combine=self.combine_var.get())
+            self.dataset.data_frame = df[mask]
 
     def ratio_margin_command(self):
         self.ratio_margin()
@@ -1448,6 +1545,520 @@ class SimilarRemoveWindow(RootExpansion):
             self.replace_check["state"] = "disabled"
 
 
+# Window for managing the library of known lines and removing any of its catalogues from a peak list at once
+class KnownLinesWindow(RootExpansion):
+    def __init__(self, owner: App, dataset: data.Data):
+        super().__init__()
+
+        # Back Ref
+        self.owner = owner
+        self.dataset = dataset
+
+        # Members
+        self.known = library.KnownLines()
+        self.catalogue_message = tk.Message(master=self, text="Catalogues (none selected uses all):", width=250)
+        self.catalogue_box = tk.Listbox(master=self, selectmode=tk.MULTIPLE, exportselection=False, height=10,
+                                        width=40)
+        self.add_button = ttk.Button(master=self, text="Add .cat File", command=self.add_file)
+        self.add_dataset_button = ttk.Button(master=self, text="Add Dataset", command=self.add_dataset)
+        self.dataset_var = tk.StringVar(self)
+        self.dataset_box = ttk.Combobox(master=self, textvariable=self.dataset_var, state="readonly")
+        self.delete_button = ttk.Button(master=self, text="Delete Selected", command=self.delete)
+        self.threshold_message = tk.Message(master=self, text="Threshold (kHz):", width=150)
+        self.threshold_var = tk.StringVar(self, value="50")
+        self.threshold_entry = ttk.Entry(master=self, textvariable=self.threshold_var, width=10)
+        self.include_var = tk.IntVar(self)
+        self.include_check = ttk.Checkbutton(master=self, text="Include List of Removed", variable=self.include_var)
+        self.enter_button = ttk.Button(master=self, command=self.enter, text="Remove Known Lines")
+        self.info_var = tk.StringVar(self)
+        self.info = tk.Message(master=self, textvariable=self.info_var, width=300)
+
+        # Positioning
+        self.catalogue_message.grid(row=0, column=0, columnspan=2, sticky="w", padx=10, pady=5)
+        self.catalogue_box.grid(row=1, column=0, columnspan=2, padx=10, pady=5)
+        self.add_button.grid(row=2, column=0, padx=10, pady=5)
+        self.delete_button.grid(row=2, column=1, padx=10, pady=5)
+        self.dataset_box.grid(row=3, column=0, padx=10, pady=5)
+        self.add_dataset_button.grid(row=3, column=1, padx=10, pady=5)
+        self.threshold_message.grid(row=4, column=0, sticky="w", padx=10, pady=5)
+        self.threshold_entry.grid(row=4, column=1, sticky="w", padx=10, pady=5)
+        self.include_check.grid(row=5, column=0, columnspan=2, sticky="w", padx=10)
+        self.enter_button.grid(row=6, column=0, columnspan=2, padx=10, pady=15)
+        self.info.grid(row=7, column=0, columnspan=2, padx=10)
+
+        # Customization
+        self.data_map = {value.name: value for value in self.owner.data_storage.data_list}
+        self.dataset_box['values'] = list(self.data_map.keys())
+        self.refresh()
+        self.title("Known Lines")
+        self.update()
+        self.center_root(self.winfo_width(), self.winfo_height())
+
+    def refresh(self):
+        self.catalogue_box.delete(0, tk.END)
+        for name, count in self.known.counts().items():
+            self.catalogue_box.insert(tk.END, "{0} ({1} lines)".format(name, count))
+
+    def selected(self) -> list:
+        return [self.known.catalogues[index] for index in self.catalogue_box.curselection()]
+
+    def add(self, name: str, freqs):
+        try:
+            self.known.add(name, freqs)
+        except library.CatalogueExistsError:
+            self.info_var.set("The library already has a catalogue named " + name)
+            return
+        self.refresh()
+
+    def add_file(self):
+        path = tk.filedialog.askopenfilename(filetypes=[("SPCAT Catalogue", "*.cat")])
+        if path == "":
+            return
+        try:
+            self.add(utils.File(path).name.split("/")[-1], utils.read_cat(path)["Frequency (MHz)"].to_numpy())
+        except ValueError:
+            self.info_var.set("Could not read " + path)
+
+    def add_dataset(self):
+        if self.dataset_var.get() != "":
+            dataset = self.data_map[self.dataset_var.get()]
+            self.add(dataset.name, dataset.data_frame[dataset.freq_ax].to_numpy())
+
+    def delete(self):
+        for name in self.selected():
+            self.known.remove(name)
+        self.refresh()
+
+    def enter(self):
+        try:
+            threshold = float(self.threshold_var.get())
+        except ValueError:
+            self.info_var.set("Please input a number")
+            return
+        if len(self.known.catalogues) == 0:
+            self.info_var.set("The library is empty")
+            return
+        data.remove_known(self.dataset, self.known, threshold, bool(self.include_var.get()), self.selected() or None)
+        self.destroy()
+
+
+# Window for finding frequency differences shared by many pairs of lines
+class DifferenceWindow(RootExpansion):
+    def __init__(self, owner: App, dataset: data.Data):
+        super().__init__()
+
+        # Back Ref
+        self.owner = owner
+        self.dataset = dataset
+
+        # Members
+        self.search_box = ttk.LabelFrame(master=self, text="Search:")
+        self.tolerance_message = tk.Message(master=self.search_box, text="Tolerance (kHz):", width=150)
+        self.tolerance_var = tk.StringVar(self.search_box, value="10")
+        self.tolerance_entry = ttk.Entry(master=self.search_box, textvariable=self.tolerance_var, width=10)
+        self.min_pairs_message = tk.Message(master=self.search_box, text="Minimum Pairs:", width=150)
+        self.min_pairs_var = tk.StringVar(self.search_box, value="3")
+        self.min_pairs_entry = ttk.Entry(master=self.search_box, textvariable=self.min_pairs_var, width=10)
+        self.min_diff_message = tk.Message(master=self.search_box, text="Min Difference (MHz):", width=150)
+        self.min_diff_var = tk.StringVar(self.search_box, value="0")
+        self.min_diff_entry = ttk.Entry(master=self.search_box, textvariable=self.min_diff_var, width=10)
+        self.max_diff_message = tk.Message(master=self.search_box, text="Max Difference (MHz):", width=150)
+        self.max_diff_var = tk.StringVar(self.search_box)
+        self.max_diff_entry = ttk.Entry(master=self.search_box, textvariable=self.max_diff_var, width=10)
+        self.count_message = tk.Message(master=self.search_box, text="Results:", width=150)
+        self.count_var = tk.StringVar(self.search_box, value="50")
+        self.count_entry = ttk.Entry(master=self.search_box, textvariable=self.count_var, width=10)
+        self.search_button = ttk.Button(master=self.search_box, text="Find", command=self.search)
+
+        self.pairs_box = ttk.LabelFrame(master=self, text="Pairs:")
+        self.delta_message = tk.Message(master=self.pairs_box, text="Difference (MHz):", width=150)
+        self.delta_var = tk.StringVar(self.pairs_box)
+        self.delta_entry = ttk.Entry(master=self.pairs_box, textvariable=self.delta_var, width=10)
+        self.pairs_button = ttk.Button(master=self.pairs_box, text="List Pairs", command=self.pairs)
+
+        self.info_var = tk.StringVar(self)
+        self.info = tk.Message(master=self, textvariable=self.info_var, width=300)
+
+        # Positioning
+        self.search_box.pack(fill="x", anchor="n", side="top", expand=True, padx=10, pady=10)
+        self.pairs_box.pack(fill="x", anchor="n", side="top", expand=True, padx=10, pady=10)
+        self.info.pack(side="top", padx=10, pady=5)
+
+        self.tolerance_message.grid(row=0, column=0, padx=10)
+        self.tolerance_entry.grid(row=1, column=0, padx=10, pady=5)
+        self.min_pairs_message.grid(row=0, column=1, padx=10)
+        self.min_pairs_entry.grid(row=1, column=1, padx=10, pady=5)
+        self.min_diff_message.grid(row=2, column=0, padx=10)
+        self.min_diff_entry.grid(row=3, column=0, padx=10, pady=5)
+        self.max_diff_message.grid(row=2, column=1, padx=10)
+        self.max_diff_entry.grid(row=3, column=1, padx=10, pady=5)
+        self.count_message.grid(row=4, column=0, padx=10)
+        self.count_entry.grid(row=5, column=0, padx=10, pady=5)
+        self.search_button.grid(row=5, column=1, padx=10, pady=5)
+
+        self.delta_message.grid(row=0, column=0, padx=10)
+        self.delta_entry.grid(row=1, column=0, padx=10, pady=5)
+        self.pairs_button.grid(row=1, column=1, padx=10, pady=5)
+
+        # Customization
+        self.wm_title("Constant Differences")
+        self.update()
+        self.center_root(self.winfo_width(), self.winfo_height())
+
+    def search(self):
+        try:
+            tolerance = float(self.tolerance_var.get())
+            min_pairs = int(self.min_pairs_var.get())
+            min_diff = float(self.min_diff_var.get()) if self.min_diff_var.get() != "" else 0.0
+            max_diff = float(self.max_diff_var.get()) if self.max_diff_var.get() != "" else None
+            count = int(self.count_var.get())
+        except ValueError:
+            self.info_var.set("Please input a number")
+            return
+        try:
+            differences = data.constant_differences(self.dataset, self.dataset.name + " (differences)", tolerance,
+                                                    min_diff, max_diff, min_pairs, count)
+        except ValueError as error:
+            self.info_var.set(str(error))
+            return
+        self.owner.data_storage.add_data(differences)
+        self.destroy()
+
+    def pairs(self):
+        try:
+            tolerance = float(self.tolerance_var.get())
+            delta = float(self.delta_var.get())
+        except ValueError:
+            self.info_var.set("Please input a number")
+            return
+        self.owner.data_storage.add_data(data.difference_pairs(
+            self.dataset, self.dataset.name + " (pairs " + self.delta_var.get() + ")", delta, tolerance))
+        self.destroy()
+
+
+# Window for fitting line shapes to the peaks of a peak list, using the spectrum they were picked from
+class FitLinesWindow(RootExpansion):
+    def __init__(self, owner: App, dataset: data.Data):
+        super().__init__()
+
+        # Back Ref
+        self.owner = owner
+        self.dataset = dataset
+
+        # Members
+        self.source_message = tk.Message(master=self, text="Spectrum:", width=150)
+        self.source_var = tk.StringVar(self)
+        self.source_box = ttk.Combobox(master=self, textvariable=self.source_var, state="readonly")
+        self.column_message = tk.Message(master=self, text="Intensity Column:", width=150)
+        self.column_var = tk.StringVar(self)
+        self.column_box = ttk.Combobox(master=self, textvariable=self.column_var, state="readonly")
+        self.profile_message = tk.Message(master=self, text="Line Shape:", width=150)
+        self.profile_var = tk.StringVar(self, value=lineshape.LORENTZIAN)
+        self.profile_box = ttk.Combobox(master=self, textvariable=self.profile_var, state="readonly")
+        self.points_message = tk.Message(master=self, text="Points Each Side:", width=150)
+        self.points_var = tk.StringVar(self, value="7")
+        self.points_entry = ttk.Entry(master=self, textvariable=self.points_var, width=10)
+        self.enter_button = ttk.Button(master=self, command=self.enter, text="Enter")
+        self.info_var = tk.StringVar(self)
+        self.info = tk.Message(master=self, textvariable=self.info_var, width=250)
+
+        # Positioning
+        self.source_message.grid(row=0, column=0, sticky="w", padx=10, pady=5)
+        self.source_box.grid(row=1, column=0, sticky="w", padx=10, pady=5)
+        self.column_message.grid(row=0, column=1, sticky="w", padx=10, pady=5)
+        self.column_box.grid(row=1, column=1, sticky="w", padx=10, pady=5)
+        self.profile_message.grid(row=2, column=0, sticky="w", padx=10, pady=5)
+        self.profile_box.grid(row=3, column=0, sticky="w", padx=10, pady=5)
+        self.points_message.grid(row=2, column=1, sticky="w", padx=10, pady=5)
+        self.points_entry.grid(row=3, column=1, sticky="w", padx=10, pady=5)
+        self.enter_button.grid(row=4, column=0, columnspan=2, padx=10, pady=15)
+        self.info.grid(row=5, column=0, columnspan=2, padx=10)
+
+        # Customization
+        self.data_map = {}
+        for value in self.owner.data_storage.data_list:
+            if value != self.dataset:
+                self.data_map[value.name] = value
+        self.source_box['values'] = list(self.data_map.keys())
+        self.source_box.bind("<<ComboboxSelected>>", self.source_selected)
+        self.profile_box['values'] = lineshape.PROFILES
+        self.title("Fit Lines")
+        self.update()
+        self.center_root(self.winfo_width(), self.winfo_height())
+
+    def source_selected(self, event=None):
+        source = self.data_map[self.source_var.get()]
+        self.column_box['values'] = [column for column in source.data_frame.columns if column != source.freq_ax]
+        self.column_var.set("")
+
+    def enter(self):
+        if self.source_var.get() == "" or self.column_var.get() == "":
+            self.info_var.set("Please choose a spectrum and one of its columns")
+            return
+        try:
+            points = int(self.points_var.get())
+        except ValueError:
+            self.info_var.set("Please input a whole number of points")
+            return
+        data.fit_lines(self.dataset, self.data_map[self.source_var.get()], self.column_var.get(),
+                       self.profile_var.get(), max(points, 2))
+        self.owner.sidebar.update_data()
+        self.destroy()
+
+
+# Window for grouping the lines of a peak table whose intensity ratios agree across its columns
+class RatioClusterWindow(RootExpansion):
+    def __init__(self, owner: App, dataset: data.Data):
+        super().__init__()
+
+        # Back Ref
+        self.owner = owner
+        self.dataset = dataset
+
+        # Members
+        self.axis_message = tk.Message(master=self, text="Ratios Against:", width=150)
+        self.axis_var = tk.StringVar(self)
+        self.axis_box = ttk.Combobox(master=self, textvariable=self.axis_var, state="readonly")
+        self.tolerance_message = tk.Message(master=self, text="Ratio Tolerance (%):", width=150)
+        self.tolerance_var = tk.StringVar(self, value="10")
+        self.tolerance_entry = ttk.Entry(master=self, textvariable=self.tolerance_var, width=10)
+        self.min_size_message = tk.Message(master=self, text="Minimum Lines:", width=150)
+        self.min_size_var = tk.StringVar(self, value="3")
+        self.min_size_entry = ttk.Entry(master=self, textvariable=self.min_size_var, width=10)
+        self.enter_button = ttk.Button(master=self, command=self.enter, text="Cluster")
+        self.info_var = tk.StringVar(self)
+        self.info = tk.Message(master=self, textvariable=self.info_var, width=250)
+
+        # Positioning
+        self.axis_message.grid(row=0, column=0, sticky="w", padx=10, pady=5)
+        self.axis_box.grid(row=1, column=0, sticky="w", padx=10, pady=5)
+        self.tolerance_message.grid(row=0, column=1, sticky="w", padx=10, pady=5)
+        self.tolerance_entry.grid(row=1, column=1, sticky="w", padx=10, pady=5)
+        self.min_size_message.grid(row=2, column=0, sticky="w", padx=10, pady=5)
+        self.min_size_entry.grid(row=3, column=0, sticky="w", padx=10, pady=5)
+        self.enter_button.grid(row=3, column=1, padx=10, pady=5)
+        self.info.grid(row=4, column=0, columnspan=2, padx=10)
+
+        # Customization
+        self.axis_box['values'] = [column for column in dataset.columns() if column != dataset.freq_ax
+                                   and dataset.graph.column_gtypes.get(column) != gph.NONE]
+        self.title("Ratio Clusters")
+        self.update()
+        self.center_root(self.winfo_width(), self.winfo_height())
+
+    def enter(self):
+        if self.axis_var.get() == "":
+            self.info_var.set("Please choose the column to take ratios against")
+            return
+        try:
+            tolerance = float(self.tolerance_var.get())
+            min_size = int(self.min_size_var.get())
+        except ValueError:
+            self.info_var.set("Please input a number")
+            return
+        if tolerance <= 0:
+            self.info_var.set("Tolerance must be positive")
+            return
+        count = data.ratio_clusters(self.dataset, self.axis_var.get(), tolerance, max(min_size, 1))
+        self.owner.sidebar.update_data()
+        self.info_var.set("Found " + str(count) + " clusters, written to the '" + data.CLUSTER_COLUMN + "' column")
+
+
+# Window for running a triples search of a .cat prediction against the selected peak list
+class TriplesWindow(RootExpansion):
+    def __init__(self, owner: App, dataset: data.Data):
+        super().__init__()
+
+        # Back Ref
+        self.owner = owner
+        self.dataset = dataset
+
+        # Members
+        self.prediction = None
+        self.transition_map = {}
+        self.worker = None
+        self.poll_job = None  # Pending call of poll, cancelled when the window is closed
+        self.cancel_event = threading.Event()
+        self.progress = (0, 0)
+        self.result = None
+        self.error_message = None
+
+        self.prediction_box = ttk.LabelFrame(master=self, text="Prediction:")
+        self.file_var = tk.StringVar(self.prediction_box)
+        self.file_entry = ttk.Entry(master=self.prediction_box, textvariable=self.file_var, width=40,
+                                    state="readonly")
+        self.file_button = ttk.Button(master=self.prediction_box, text="Browse", command=self.browse)
+        self.constant_messages = []
+        self.constant_vars = []
+        self.constant_entries = []
+        for constant in ("A (MHz):", "B (MHz):", "C (MHz):"):
+            var = tk.StringVar(self.prediction_box)
+            self.constant_messages.append(tk.Message(master=self.prediction_box, text=constant, width=100))
+            self.constant_vars.append(var)
+            self.constant_entries.append(ttk.Entry(master=self.prediction_box, textvariable=var, width=12))
+        self.transition_message = tk.Message(master=self.prediction_box, text="Transitions:", width=150)
+        self.transition_vars = [tk.StringVar(self.prediction_box) for _ in range(3)]
+        self.transition_boxes = [ttk.Combobox(master=self.prediction_box, textvariable=var, state="readonly",
+                                              width=40) for var in self.transition_vars]
+
+        self.search_box = ttk.LabelFrame(master=self, text="Search:")
+        self.settings = {}
+        for row, (label, default) in enumerate((("Window (MHz):", "100"), ("Tolerance (MHz):", "0.1"),
+                                                ("Candidates Per Line:", "30"), ("Min Intensity:", "0"),
+                                                ("Scoring Lines:", "60"), ("Filter Level:", "0"))):
+            message = tk.Message(master=self.search_box, text=label, width=150)
+            var = tk.StringVar(self.search_box, value=default)
+            entry = ttk.Entry(master=self.search_box, textvariable=var, width=10)
+            message.grid(row=row // 2 * 2, column=row % 2, padx=10)
+            entry.grid(row=row // 2 * 2 + 1, column=row % 2, padx=10, pady=5)
+            self.settings[label] = var
+
+        self.start_button = ttk.Button(master=self, text="Start", command=self.start)
+        self.cancel_button = ttk.Button(master=self, text="Cancel", command=self.cancel, state="disabled")
+        self.info_var = tk.StringVar(self)
+        self.info = tk.Message(master=self, textvariable=self.info_var, width=400)
+
+        # Positioning
+        self.prediction_box.grid(row=0, column=0, columnspan=2, padx=10, pady=10, sticky="ew")
+        self.search_box.grid(row=1, column=0, columnspan=2, padx=10, pady=10, sticky="ew")
+        self.start_button.grid(row=2, column=0, padx=10, pady=10)
+        self.cancel_button.grid(row=2, column=1, padx=10, pady=10)
+        self.info.grid(row=3, column=0, columnspan=2, padx=10, pady=5)
+
+        self.file_entry.grid(row=0, column=0, columnspan=2, padx=10, pady=5)
+        self.file_button.grid(row=0, column=2, padx=10, pady=5)
+        for index in range(3):
+            self.constant_messages[index].grid(row=1, column=index, padx=10)
+            self.constant_entries[index].grid(row=2, column=index, padx=10, pady=5)
+        self.transition_message.grid(row=3, column=0, padx=10, sticky="w")
+        for index, box in enumerate(self.transition_boxes):
+            box.grid(row=4 + index, column=0, columnspan=3, padx=10, pady=2)
+
+        # Customization
+        self.wm_title("Triples Search")
+        self.protocol("WM_DELETE_WINDOW", self.close)
+        self.update()
+        self.center_root(self.winfo_width(), self.winfo_height())
+
+    def browse(self):
+        path = tk.filedialog.askopenfilename(filetypes=[("SPCAT Prediction", "*.cat")])
+        if path == "":
+            return
+        try:
+            self.owner.file_manager.add_file(path)
+            prediction = self.owner.file_manager.load_prediction(self.owner.file_manager.file_names[-1])
+        except (utils.InvalidTypeException, ValueError):
+            self.info_var.set("Please select a .cat file")
+            return
+        self.prediction = prediction.dropna(subset=triples.UPPER + triples.LOWER)
+        self.file_var.set(path)
+
+        # Offer the strongest predicted lines for the triple
+        self.transition_map.clear()
+        strongest = self.prediction.sort_values(by="Log Intensity", ascending=False).head(200)
+        for index, row in strongest.iterrows():
+            label = "{0:d}({1:d},{2:d}) - {3:d}({4:d},{5:d})  {6:.4f} MHz".format(
+                *(int(row[column]) for column in triples.UPPER + triples.LOWER), row[triples.FREQ])
+            self.transition_map[label] = index
+        for box in self.transition_boxes:
+            box['values'] = list(self.transition_map.keys())
+
+    # Peak list of the dataset: frequency and the strongest intensity of each row
+    def peaks(self):
+        frame = self.dataset.data_frame
+        columns = [column for column in frame.columns if column != self.dataset.freq_ax
+                   and self.dataset.graph.column_gtypes.get(column) != gph.NONE]
+        intensities = frame[columns].max(axis=1).to_numpy(dtype=float) if columns else \
+            np.ones(len(frame))
+        peaks = np.column_stack((frame[self.dataset.freq_ax].to_numpy(dtype=float), intensities))
+        return peaks[~np.isnan(peaks).any(axis=1)]
+
+    def start(self):
+        if self.prediction is None or "" in [var.get() for var in self.transition_vars]:
+            self.info_var.set("Please choose a prediction and three transitions")
+            return
+        try:
+            constants = [float(var.get()) for var in self.constant_vars]
+            window = float(self.settings["Window (MHz):"].get())
+            tolerance = float(self.settings["Tolerance (MHz):"].get())
+            max_candidates = int(self.settings["Candidates Per Line:"].get())
+            inten_min = float(self.settings["Min Intensity:"].get())
+            score_lines = int(self.settings["Scoring Lines:"].get())
+            filter_level = float(self.settings["Filter Level:"].get())
+        except ValueError:
+            self.info_var.set("Please input a number")
+            return
+        transitions = [self.transition_map[var.get()] for var in self.transition_vars]
+        if len(set(transitions)) < 3:
+            self.info_var.set("Please choose three different transitions")
+            return
+
+        # The search runs on a background thread (which hands the blocks to worker processes), and is polled from
+        # the Tk loop so the window stays responsive and can cancel it
+        self.cancel_event.clear()
+        self.result = None
+        self.error_message = None
+        self.progress = (0, 0)
+        kwargs = dict(prediction=self.prediction, transitions=transitions, constants=constants, peaks=self.peaks(),
+                      window=window, tolerance=tolerance, max_candidates=max_candidates, inten_min=inten_min,
+                      score_lines=score_lines, filter_level=filter_level, progress=self.set_progress,
+                      cancel=self.cancel_event)
+        self.worker = threading.Thread(target=self.run, kwargs=kwargs, daemon=True)
+        self.worker.start()
+        self.start_button["state"] = "disabled"
+        self.cancel_button["state"] = "normal"
+        self.poll_job = self.after(100, self.poll)
+
+    # Runs on the background thread
+    def run(self, **kwargs):
+        try:
+            self.result = triples.triples_search(**kwargs)
+        except peaky.InsufficientTransitionsError as exception:
+            self.error_message = str(exception)
+        except Exception as exception:  # Shown in the window once poll sees the thread has ended
+            self.error_message = "The search failed: " + (str(exception) or type(exception).__name__)
+
+    def set_progress(self, done, total):
+        self.progress = (done, total)
+
+    def poll(self):
+        self.poll_job = None
+        if self.worker.is_alive():
+            self.info_var.set("Searching... {0} of {1} blocks".format(*self.progress))
+            self.poll_job = self.after(100, self.poll)
+            return
+        self.start_button["state"] = "normal"
+        self.cancel_button["state"] = "disabled"
+        if self.error_message is not None:
+            self.info_var.set(self.error_message)
+            return
+
+        frame, done, total = self.result
+        if len(frame.index) == 0:
+            self.info_var.set("No triple could be fitted")
+            return
+        gtypes = {column: gph.NONE for column in frame.columns}
+        gtypes["A (MHz)"] = gph.LINE
+        gtypes["Matches"] = gph.SCATTER
+        self.owner.data_storage.add_data(data.Data(data_frame=frame, owner=self.owner,
+                                                   name=self.dataset.name + " (triples)", freq_ax="A (MHz)",
+                                                   gtypes=gtypes))
+        if done < total:
+            self.info_var.set("Cancelled after {0} of {1} blocks; best fits so far were added".format(done, total))
+        else:
+            self.info_var.set("Finished: best fit matches {0:d} lines".format(int(frame["Matches"].iloc[0])))
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def close(self):
+        self.cancel_event.set()
+        if self.poll_job is not None:
+            self.after_cancel(self.poll_job)
+            self.poll_job = None
+        self.destroy()
+
+
 class DataSettingsUpdater(RootExpansion):
     def __init__(self, dataset: data.Data):
         super().__init__()
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import json
+import os
+
+import numpy as np
+
+# Library of known lines (parent species, isotopologues, contaminants) kept on disk so that any number of
+# catalogues can be removed from a peak list at once.  All lines are stored in one frequency-sorted index, with the
+# catalogue each line came from, as .npy files that are memory-mapped when the library is opened.
+
+LIBRARY_DIR = "known_lines"
+FREQS_FILE = "freqs.npy"
+SOURCES_FILE = "sources.npy"
+CATALOGUES_FILE = "catalogues.json"
+
+
+class CatalogueExistsError(Exception):
+    """A catalogue with this name is already in the library"""
+    pass
+
+
+class KnownLines:
+    def __init__(self, directory: str = LIBRARY_DIR):
+        self.directory = directory
+        self.catalogues = []  # Names, in the order of their ids
+        self.freqs = np.zeros(0)
+        self.sources = np.zeros(0, dtype=np.int32)
+        self.load()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def load(self):
+        if not os.path.isfile(self.path(CATALOGUES_FILE)):
+            return
+        with open(self.path(CATALOGUES_FILE), "r") as file:
+            self.catalogues = json.load(file)
+        self.freqs = np.load(self.path(FREQS_FILE), mmap_mode="r")
+        self.sources = np.load(self.path(SOURCES_FILE), mmap_mode="r")
+
+    # Writes new index arrays.  The memory maps of the old files are released first, since they cannot be replaced
+    # while mapped on Windows.
+    def save(self, freqs: np.ndarray, sources: np.ndarray, catalogues: list):
+        self.freqs, self.sources = np.zeros(0), np.zeros(0, dtype=np.int32)
+        os.makedirs(self.directory, exist_ok=True)
+        for name, array in ((FREQS_FILE, freqs), (SOURCES_FILE, sources)):
+            np.save(self.path(name + ".tmp.npy"), array)
+            os.replace(self.path(name + ".tmp.npy"), self.path(name))
+        with open(self.path(CATALOGUES_FILE + ".tmp"), "w") as file:
+            json.dump(catalogues, file)
+        os.replace(self.path(CATALOGUES_FILE + ".tmp"), self.path(CATALOGUES_FILE))
+        self.load()
+
+    def counts(self) -> dict:
+        return dict(zip(self.catalogues, np.bincount(self.sources, minlength=len(self.catalogues)).tolist()))
+
+    # Adds the lines of a catalogue, merging them into the sorted index
+    def add(self, name: str, freqs: np.ndarray):
+        if name in self.catalogues:
+            raise CatalogueExistsError
+        freqs = np.asarray(freqs, dtype=np.float64)
+        freqs = np.sort(freqs[~np.isnan(freqs)])
+        at = np.searchsorted(self.freqs, freqs, side="right")
+        self.save(np.insert(np.asarray(self.freqs), at, freqs),
+                  np.insert(np.asarray(self.sources), at, np.full(freqs.size, len(self.catalogues), dtype=np.int32)),
+                  self.catalogues + [name])
+
+    def remove(self, name: str):
+        index = self.catalogues.index(name)
+        sources = np.asarray(self.sources)
+        keep = sources != index
+        sources = sources[keep]
+        sources[sources > index] -= 1
+        self.save(np.asarray(self.freqs)[keep], sources, self.catalogues[:index] + self.catalogues[index + 1:])
+
+    # For every frequency, whether a line of the chosen catalogues (all of them if None) is strictly closer than
+    # 'tolerance', and the catalogue of the nearest such line (-1 where there is none).  One pass of binary searches
+    # over the index, after at most one pass to pick out the chosen catalogues.
+    def match(self, freqs: np.ndarray, tolerance: float, catalogues: list = None):
+        lines, sources = self.freqs, self.sources
+        if catalogues is not None and set(catalogues) != set(self.catalogues):
+            chosen = np.isin(sources, [self.catalogues.index(name) for name in catalogues])
+            lines, sources = lines[chosen], sources[chosen]
+        freqs = np.asarray(freqs, dtype=np.float64)
+        low = np.searchsorted(lines, freqs - tolerance, side="right")
+        high = np.searchsorted(lines, freqs + tolerance, side="left")
+        matched = high > low
+
+        # The nearest line is on one side or the other of where the frequency would be inserted
+        position = np.searchsorted(lines, freqs)
+        below = np.clip(np.clip(position - 1, low, high - 1), 0, max(len(lines) - 1, 0))
+        above = np.clip(np.clip(position, low, high - 1), 0, max(len(lines) - 1, 0))
+        source = np.full(freqs.size, -1, dtype=np.int64)
+        if len(lines) > 0:
+            nearest = np.where(np.abs(freqs - lines[below]) <= np.abs(freqs - lines[above]), below, above)
+            source[matched] = sources[nearest[matched]]
+        return matched, source
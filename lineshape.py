@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy.optimize
+
+# Line shape fitting for picked peaks.  Every isolated peak gets a window of the same number of spectrum points,
+# so all of them are stacked into 2-D arrays and fitted together by one vectorized Levenberg-Marquardt loop.
+# Peaks whose windows overlap are blended, and each such group is fitted as a sum of profiles on its own.
+
+LORENTZIAN = "Lorentzian"
+GAUSSIAN = "Gaussian"
+PROFILES = [LORENTZIAN, GAUSSIAN]
+
+# Parameters of every profile are centre, full width at half maximum, amplitude and a constant baseline
+PARAMETERS = 4
+RESULT_COLUMNS = ["Centre (MHz)", "Width (MHz)", "Amplitude", "Centre Error (MHz)", "Width Error (MHz)",
+                  "Amplitude Error"]
+
+CHUNK = 5000  # Isolated peaks fitted by one worker at a time
+PARALLEL_PEAKS = 20000  # Below this many peaks the fit stays in this process
+MAX_GROUP = 6  # Longer chains of blended peaks are cut into groups of at most this many
+
+LN2 = np.log(2)
+
+
+# Profile of unit height and its derivative, as functions of u = 2 (x - centre) / width
+def _shape(profile: str, u: np.ndarray):
+    if profile == LORENTZIAN:
+        shape = 1 / (1 + u ** 2)
+        return shape, -2 * u * shape ** 2
+    shape = np.exp(-LN2 * u ** 2)
+    return shape, -2 * LN2 * u * shape
+
+
+# Values of the profiles with rows of parameters p at rows of points x, and the Jacobian (n, points, PARAMETERS)
+def _model(profile: str, x: np.ndarray, p: np.ndarray):
+    centre, width, amplitude, baseline = (p[:, i, None] for i in range(PARAMETERS))
+    u = 2 * (x - centre) / width
+    shape, slope = _shape(profile, u)
+    jacobian = np.stack((amplitude * slope * -2 / width, amplitude * slope * -u / width, shape,
+                         np.ones_like(shape)), axis=-1)
+    return amplitude * shape + baseline, jacobian
+
+
+# Starting parameters for rows of windows that each hold one peak
+def initial_guess(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    top = np.argmax(y, axis=1)
+    rows = np.arange(len(y))
+    baseline = np.min(y, axis=1)
+    amplitude = y[rows, top] - baseline
+    step = np.abs(x[:, -1] - x[:, 0]) / max(x.shape[1] - 1, 1)
+    above = (y - baseline[:, None] >= amplitude[:, None] / 2).sum(axis=1)
+    return np.column_stack((x[rows, top], np.maximum(above, 1) * step, amplitude, baseline))
+
+
+# Vectorized Levenberg-Marquardt: fits one profile to every row of (x, y) at once.  Each row keeps its own damping,
+# and rows drop out of the loop once they have converged, so the remaining iterations only work on the rest.
+# Returns the parameters and their standard errors (from the covariance scaled by the residual variance).
+def batched_lm(profile: str, x: np.ndarray, y: np.ndarray, p0: np.ndarray = None, iterations: int = 100,
+               accuracy: float = 1e-8):
+    p = initial_guess(x, y) if p0 is None else np.array(p0, dtype=np.float64)
+    damping = np.full(len(p), 1e-3)
+    eye = np.eye(PARAMETERS)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        fitted, jacobian = _model(profile, x, p)
+        cost = ((y - fitted) ** 2).sum(axis=1)
+        active = np.arange(len(p))
+        for _ in range(iterations):
+            if active.size == 0:
+                break
+            rows_jacobian = jacobian[active]
+            transposed = rows_jacobian.transpose(0, 2, 1)
+            jtj = np.matmul(transposed, rows_jacobian)
+            gradient = np.matmul(transposed, (y[active] - fitted[active])[..., None])
+            scaled = jtj + damping[active, None, None] * jtj * eye + 1e-300 * eye
+            trial = p[active] + np.linalg.solve(scaled, gradient)[..., 0]
+            trial[:, 1] = np.abs(trial[:, 1])
+
+            trial_fitted, trial_jacobian = _model(profile, x[active], trial)
+            trial_cost = ((y[active] - trial_fitted) ** 2).sum(axis=1)
+            better = trial_cost < cost[active]
+            small = cost[active] - trial_cost <= accuracy * cost[active]
+            improved = active[better]
+            p[improved] = trial[better]
+            fitted[improved] = trial_fitted[better]
+            jacobian[improved] = trial_jacobian[better]
+            cost[improved] = trial_cost[better]
+            damping[active] = np.where(better, damping[active] / 10, damping[active] * 10)
+            done = (better & small) | (damping[active] > 1e12)
+            active = active[~done]
+
+        transposed = jacobian.transpose(0, 2, 1)
+        variance = cost / max(x.shape[1] - PARAMETERS, 1)
+        covariance = np.linalg.pinv(np.matmul(transposed, jacobian)) * variance[:, None, None]
+    errors = np.sqrt(np.abs(np.diagonal(covariance, axis1=1, axis2=2)))
+    return p, errors
+
+
+# Fits a group of blended peaks as a sum of profiles with one shared baseline.  'centres' are the picked
+# frequencies of the peaks in the group.  Returns rows of (centre, width, amplitude) and their errors.
+def fit_group(profile: str, x: np.ndarray, y: np.ndarray, centres: np.ndarray):
+    count = len(centres)
+    baseline = y.min()
+    nearest = np.clip(np.searchsorted(x, centres), 0, len(x) - 1)
+    spacing = np.min(np.diff(centres)) if count > 1 else np.ptp(x)
+    start = np.column_stack((centres, np.full(count, spacing / 2), y[nearest] - baseline)).ravel()
+
+    def residual(q):
+        lines = q[:-1].reshape(count, 3)
+        return _model(profile, x[None], np.column_stack((lines, np.zeros(count))))[0].sum(axis=0) + q[-1] - y
+
+    def jacobian(q):
+        lines = q[:-1].reshape(count, 3)
+        derivatives = _model(profile, x[None], np.column_stack((lines, np.zeros(count))))[1]
+        return np.column_stack((derivatives[..., :3].transpose(1, 0, 2).reshape(len(x), -1), np.ones(len(x))))
+
+    try:
+        result = scipy.optimize.least_squares(residual, np.append(start, baseline), jac=jacobian, method="lm",
+                                                max_nfev=200 * count)
+        q = result.x
+        jtj = result.jac.T @ result.jac
+        covariance = np.linalg.pinv(jtj) * (result.fun ** 2).sum() / max(len(x) - len(q), 1)
+        errors = np.sqrt(np.abs(np.diag(covariance)))[:-1].reshape(count, 3)
+    except (ValueError, np.linalg.LinAlgError):
+        q = np.append(start, baseline)
+        errors = np.full((count, 3), np.nan)
+    lines = q[:-1].reshape(count, 3)
+    lines[:, 1] = np.abs(lines[:, 1])
+    return lines, errors
+
+
+# Worker: fits the rows of isolated peak windows, returning rows of RESULT_COLUMNS
+def _fit_isolated(profile: str, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    p, errors = batched_lm(profile, x, y)
+    return np.column_stack((p[:, :3], errors[:, :3]))
+
+
+# Worker: fits a list of blended groups, each given as (x, y, centres)
+def _fit_groups(profile: str, groups: list) -> list:
+    results = []
+    for x, y, centres in groups:
+        lines, errors = fit_group(profile, x, y, centres)
+        results.append(np.column_stack((lines, errors)))
+    return results
+
+
+# Fits a profile to every peak of a spectrum.
+# spectrum: rows of frequency/intensity in increasing frequency; centres: picked peak frequencies
+# points: spectrum points on each side of a peak used for its fit.  Peaks closer than 'points' samples to each other
+# are blended and fitted together.  Returns one row of RESULT_COLUMNS per peak, in the order of 'centres'.
+def fit_peaks(spectrum: np.ndarray, centres: np.ndarray, profile: str = LORENTZIAN, points: int = 7,
+              processes: int = None) -> np.ndarray:
+    x = np.ascontiguousarray(spectrum[:, 0], dtype=np.float64)
+    y = np.ascontiguousarray(spectrum[:, 1], dtype=np.float64)
+    centres = np.asarray(centres, dtype=np.float64)
+    results = np.full((len(centres), len(RESULT_COLUMNS)), np.nan)
+    if len(centres) == 0 or len(x) < 2 * points + 1:
+        return results
+
+    order = np.argsort(centres, kind="stable")
+    index = np.clip(np.searchsorted(x, centres[order]), points, len(x) - points - 1)
+
+    # Peaks whose windows overlap belong to the same group
+    chain = np.zeros(len(index), dtype=np.int64)
+    chain[1:] = np.cumsum(np.diff(index) > points)
+    position = np.arange(len(index)) - np.flatnonzero(np.diff(chain, prepend=-1))[chain]
+    group = np.cumsum(np.diff(chain, prepend=-1) + ((position % MAX_GROUP == 0) & (position > 0)) > 0) - 1
+    sizes = np.bincount(group)
+    isolated = sizes[group] == 1
+
+    # Windows of isolated peaks are rows of a sliding-window view; blended groups span from their first peak's
+    # window to their last's
+    windows = index[isolated][:, None] - points
+    rows_x = np.lib.stride_tricks.sliding_window_view(x, 2 * points + 1)[windows[:, 0]]
+    rows_y = np.lib.stride_tricks.sliding_window_view(y, 2 * points + 1)[windows[:, 0]]
+    starts = np.flatnonzero(np.diff(group, prepend=-1))
+    blended = [(x[index[s] - points:index[s + n - 1] + points + 1], y[index[s] - points:index[s + n - 1] + points + 1],
+                centres[order[s:s + n]]) for s, n in zip(starts, sizes) if n > 1]
+
+    if processes == 1 or len(centres) < PARALLEL_PEAKS:
+        single = _fit_isolated(profile, rows_x, rows_y)
+        group_results = _fit_groups(profile, blended)
+    else:
+        workers = processes or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunks = [executor.submit(_fit_isolated, profile, rows_x[s:s + CHUNK], rows_y[s:s + CHUNK])
+                      for s in range(0, len(rows_x), CHUNK)]
+            group_chunks = [executor.submit(_fit_groups, profile, blended[s:s + CHUNK // 10])
+                            for s in range(0, len(blended), CHUNK // 10)]
+            single = np.concatenate([chunk.result() for chunk in chunks] + [np.zeros((0, len(RESULT_COLUMNS)))])
+            group_results = [fit for chunk in group_chunks for fit in chunk.result()]
+
+    results[order[isolated]] = single
+    if group_results:
+        results[order[~isolated]] = np.concatenate(group_results)
+    return results
@@ -1,4 +1,5 @@
 import sys
+import multiprocessing
 from ctypes import windll
 
 import pandas as pd
@@ -7,6 +8,8 @@ import gui
 import utils
 
 if __name__ == "__main__":
+    # Peak picking runs in worker processes, which frozen (PyInstaller) builds need to be told about
+    multiprocessing.freeze_support()
     # Tkinter has an annoying habit of looking blurry on high resolution monitors
     # This should solve the problem on windows
     pd.options.mode.chained_assignment = None
@@ -11,8 +11,33 @@ straight from UVA's Autofit v.15c
 """
 import numpy
 import math
+import os
+import traceback
 import scipy
+import scipy.fft
 import scipy.interpolate
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+# Segmented resampling: the spectrum is splined in windows of SEGMENT_WINDOW original points, each padded with
+# SEGMENT_OVERLAP points on both sides.  The influence of a data point on an interpolating cubic spline decays by
+# roughly a factor of 3.7 per knot, so with 64 points of padding the segmented output agrees with the global
+# spline to within about 1e-12 of the largest intensity, including at the segment seams.
+SEGMENT_WINDOW = 20000
+SEGMENT_OVERLAP = 64
+
+# Interpolation used by refine_peaks
+PARABOLIC = "parabolic"
+GAUSSIAN = "gaussian"
+SPLINE = "spline"
+
+# Points per block used by local_noise.  Wide enough that a few strong lines barely move a block's median and MAD,
+# narrow enough to follow a sloping noise floor.
+NOISE_WINDOW = 2000
+MAD_SCALE = 1.4826  # MAD -> standard deviation of Gaussian noise
+
+# Most bins deltanus will use for its stick spectrum; the FFT of that many takes about a gigabyte
+MAX_DELTANU_BINS = 2 ** 24
 
 
 def cubic_spline(spectrum, new_resolution):  # Cubic spline of spectrum to
@@ -36,68 +61,391 @@ def cubic_spline(spectrum, new_resolution):  # Cubic spline of spectrum to
     return output_spectrum
 
 
-def peakpicker(spectrum, thresh_l,
-               thresh_h):  # Code taken from Cristobal's peak-picking script; assumes spectrum is in increasing frequency order
-    peaks = []
-    for i in range(1, len(spectrum) - 1):
-        if spectrum[i, 1] > thresh_l and spectrum[i, 1] < thresh_h and spectrum[i, 1] > spectrum[(i - 1), 1] and \
-                spectrum[i, 1] > spectrum[(i + 1), 1]:
-            peaks.append(spectrum[i])
+def local_maxima(y, plateaus=False, edges=False):  # Indices of the local maxima of y, found with masks over
+    # shifted views rather than a Python loop.  With plateaus=True a flat top (equal neighbouring values that rise
+    # on one side and fall on the other) counts as one maximum at its middle point; with edges=True the first and
+    # last points may be maxima if their single neighbour is lower.
+    y = numpy.asarray(y)
+    if y.size < 2:
+        return numpy.zeros(0, dtype=numpy.intp)
+
+    if not plateaus:
+        mask = numpy.zeros(y.size, dtype=bool)
+        mask[1:-1] = (y[1:-1] > y[:-2]) & (y[1:-1] > y[2:])
+        if edges:
+            mask[0] = y[0] > y[1]
+            mask[-1] = y[-1] > y[-2]
+        return numpy.flatnonzero(mask)
+
+    # Positions where the value changes; run k of equal values spans change[k - 1] + 1 ... change[k]
+    change = numpy.flatnonzero(y[1:] != y[:-1])
+    if change.size == 0:
+        return numpy.zeros(0, dtype=numpy.intp)
+    rising = y[change + 1] > y[change]
+    tops = numpy.flatnonzero(rising[:-1] & ~rising[1:])
+    peaks = (change[tops] + 1 + change[tops + 1]) // 2
+    if edges:
+        if not rising[0]:
+            peaks = numpy.concatenate(([change[0] // 2], peaks))
+        if rising[-1]:
+            peaks = numpy.concatenate((peaks, [(change[-1] + y.size) // 2]))
+    return peaks
+
+
+def peakpicker(spectrum, thresh_l, thresh_h, plateaus=False,
+               edges=False):  # Code taken from Cristobal's peak-picking script; assumes spectrum is in increasing frequency order
+    # The per-point loop has been replaced by local_maxima; with the default arguments the output is identical.
+    intensities = spectrum[:, 1]
+    index = local_maxima(intensities, plateaus=plateaus, edges=edges)
+    index = index[(intensities[index] > thresh_l) & (intensities[index] < thresh_h)]
+
+    peakpicks = numpy.array(spectrum[index, :2], dtype=float).reshape(-1, 2)
+    freq_low = spectrum[0, 0]
+    freq_high = spectrum[-1, 0]
+    return peakpicks, freq_low, freq_high
+
+
+def local_noise(y, window=NOISE_WINDOW):  # Baseline (median) and noise (scaled MAD) of y around every point.
+    # Both are computed on consecutive blocks of 'window' points, taken as rows of a strided view, and linearly
+    # interpolated between the block centres, so the cost stays linear in len(y) whatever the window size.
+    y = numpy.asarray(y, dtype=float)
+    if y.size == 0:
+        return numpy.zeros(0), numpy.zeros(0)
+    window = max(min(int(window), y.size), 1)
+    starts = numpy.arange(0, y.size - window + 1, window)
+    if starts[-1] + window < y.size:  # The last block is aligned with the end instead of being cut short
+        starts = numpy.append(starts, y.size - window)
+    blocks = numpy.lib.stride_tricks.sliding_window_view(y, window)[starts]
+
+    median = numpy.median(blocks, axis=1)
+    mad = numpy.median(numpy.abs(blocks - median[:, None]), axis=1) * MAD_SCALE
+    centres = starts + (window - 1) / 2
+    points = numpy.arange(y.size)
+    return numpy.interp(points, centres, median), numpy.interp(points, centres, mad)
+
+
+def noise_peakpicker(spectrum, thresh_l, thresh_h, k=3.0,
+                     window=NOISE_WINDOW):  # peakpicker with a threshold that follows the noise: maxima must also
+    # rise more than k times the local noise above the local baseline.  Rows are frequency, intensity and SNR.
+    intensities = spectrum[:, 1]
+    index = local_maxima(intensities)
+    baseline, noise = local_noise(intensities, window)
+    snr = numpy.divide(intensities[index] - baseline[index], noise[index], out=numpy.zeros(index.size),
+                       where=noise[index] > 0)
+    keep = (intensities[index] > thresh_l) & (intensities[index] < thresh_h) & (snr > k)
 
-    peakpicks = numpy.zeros((len(peaks), 2))
-    for i, row in enumerate(peaks):
-        peakpicks[i, 0] = row[0]
-        peakpicks[i, 1] = row[1]
+    peakpicks = numpy.column_stack((spectrum[index[keep], 0], intensities[index[keep]], snr[keep])).astype(float)
     freq_low = spectrum[0, 0]
     freq_high = spectrum[-1, 0]
     return peakpicks, freq_low, freq_high
 
 
-def intensity_filter(full_list, peaklist, inten_low,
-                     filter_level):  # Intensity filter to give more efficient triples searches for isotopologues.
+def _vertex(x, y):  # Vertex of the parabola through the rows of three points (x[:, 0..2], y[:, 0..2])
+    slope = (y[:, 1] - y[:, 0]) / (x[:, 1] - x[:, 0])
+    curve = ((y[:, 2] - y[:, 1]) / (x[:, 2] - x[:, 1]) - slope) / (x[:, 2] - x[:, 0])
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        centre = (x[:, 0] + x[:, 1]) / 2 - slope / (2 * curve)
+    centre = numpy.where(curve < 0, centre, x[:, 1])  # Flat or upward neighbourhoods keep the sampled maximum
+    height = y[:, 0] + slope * (centre - x[:, 0]) + curve * (centre - x[:, 0]) * (centre - x[:, 1])
+    return centre, height
 
-    filtered_peaklist = []
-    filtered_full_list = []
-    comparison_level = filter_level * float(inten_low)
 
-    for peak in peaklist:
-        if peak[1] >= comparison_level:  # Only keep experimental peaks more intense than the lower cutoff.
-            filtered_peaklist.append(peak)
+def _spline_vertex(x, y, centre):  # Maximum of the natural cubic spline through each row of points (x, y), searched
+    # on the two intervals either side of column 'centre'.  All rows are solved together.
+    rows = numpy.arange(len(x))
+    h = numpy.diff(x, axis=1)
+    slope = numpy.diff(y, axis=1) / h
 
-    for entry in full_list:
-        for peak in filtered_peaklist:
-            temp_freq_diff = abs(float(entry[1]) - float(peak[0]))
-            if temp_freq_diff <= 0.5:  # Looking for a strong NS peak within 0.5 MHz of its predicted value.  Too coarse, too tight, OK?
-                filtered_full_list.append(entry)
-                break  # Only need to find one; no need to continue searching through the full experimental peak list after a hit has been found.
+    # Second derivatives at the inner knots (zero at the outer ones) from the usual tridiagonal system
+    inner = x.shape[1] - 2
+    system = numpy.zeros((len(x), inner, inner))
+    k = numpy.arange(inner)
+    system[:, k, k] = 2 * (h[:, :-1] + h[:, 1:])
+    system[:, k[1:], k[:-1]] = h[:, 1:-1]
+    system[:, k[:-1], k[1:]] = h[:, 1:-1]
+    second = numpy.zeros(x.shape)
+    second[:, 1:-1] = numpy.linalg.solve(system, 6 * numpy.diff(slope, axis=1)[..., None])[..., 0]
 
+    best_x = x[rows, centre].astype(float)
+    best_y = y[rows, centre].astype(float)
+    for j in (centre - 1, centre):  # Interval [x_j, x_j+1]; S'(u) = a u^2 + b u + c with u = x - x_j
+        hj = h[rows, j]
+        m0 = second[rows, j]
+        m1 = second[rows, j + 1]
+        a = (m1 - m0) / (2 * hj)
+        b = m0
+        c = slope[rows, j] - (m1 - m0) * hj / 6 - m0 * hj / 2
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            disc = numpy.sqrt(b * b - 4 * a * c)
+            quadratic = numpy.abs(a) * hj > 1e-12 * numpy.abs(b) + 1e-300
+            roots = (numpy.where(quadratic, (-b + disc) / (2 * a), -c / b),
+                     numpy.where(quadratic, (-b - disc) / (2 * a), numpy.nan))
+        for u in roots:
+            valid = (u >= 0) & (u <= hj)
+            u = numpy.where(valid, u, 0)
+            value = (m0 * (hj - u) ** 3 / (6 * hj) + m1 * u ** 3 / (6 * hj)
+                     + (y[rows, j] / hj - m0 * hj / 6) * (hj - u) + (y[rows, j + 1] / hj - m1 * hj / 6) * u)
+            better = valid & (value > best_y)
+            best_x = numpy.where(better, x[rows, j] + u, best_x)
+            best_y = numpy.where(better, value, best_y)
+    return best_x, best_y
+
+
+def refine_peaks(spectrum, index, method=PARABOLIC, points=7):  # Sub-sample centres and heights for the local
+    # maxima at rows 'index' (not the first or last row), using only a few neighbouring points of each maximum.
+    # PARABOLIC fits the three points around the maximum, GAUSSIAN does the same on the log of the intensities
+    # (exact for a Gaussian line shape), and SPLINE interpolates 'points' neighbours with a natural cubic spline.
+    x = spectrum[:, 0]
+    y = spectrum[:, 1]
+    index = numpy.asarray(index)
+    near = index[:, None] + numpy.arange(-1, 2)
+
+    if method == PARABOLIC:
+        return _vertex(x[near], y[near])
+    if method == GAUSSIAN:
+        centre, height = _vertex(x[near], y[near])
+        positive = numpy.all(y[near] > 0, axis=1)  # Logs need positive intensities; others stay parabolic
+        log_centre, log_height = _vertex(x[near[positive]], numpy.log(y[near[positive]]))
+        centre[positive] = log_centre
+        height[positive] = numpy.exp(log_height)
+        return centre, height
+    if method == SPLINE:
+        points = max(points, 5)
+        if len(x) < points:
+            return _vertex(x[near], y[near])
+        first = numpy.clip(index - points // 2, 0, len(x) - points)  # Windows are shifted inwards at the ends
+        window = first[:, None] + numpy.arange(points)
+        return _spline_vertex(x[window], y[window], index - first)
+    raise ValueError("Unknown refinement method: " + str(method))
+
+
+def refined_peakpicker(spectrum, thresh_l, thresh_h, method=PARABOLIC,
+                       points=7):  # Alternative to cubic_spline + peakpicker: maxima are found on the original grid
+    # and only they are refined, so the cost scales with the number of peaks instead of the band width.
+    index = local_maxima(spectrum[:, 1])
+    centre, height = refine_peaks(spectrum, index, method, points)
+    keep = (height > thresh_l) & (height < thresh_h)
+
+    peakpicks = numpy.column_stack((centre[keep], height[keep])).astype(float)
+    freq_low = spectrum[0, 0]
+    freq_high = spectrum[-1, 0]
+    return peakpicks, freq_low, freq_high
+
+
+def _pool_map(func, tasks, processes=None):  # Ordered map over a process pool that keeps at most two tasks per
+    # worker in flight, so finished segments never pile up faster than they are consumed.
+    if processes == 1:
+        for task in tasks:
+            yield func(*task)
+        return
+    workers = processes or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        limit = 2 * workers
+        pending = []
+        for task in tasks:
+            pending.append(executor.submit(func, *task))
+            if len(pending) >= limit:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+def _segment_tasks(spectrum, new_resolution, window, overlap, pick_args=None):  # Splits the spectrum into the
+    # arguments for _spline_segment.  Grid points are numbered as in numpy.arange(x[0], x[-1], new_resolution).
+    x = spectrum[:, 0]
+    y = spectrum[:, 1]
+    step = (x[0] + new_resolution) - x[0]  # Spacing numpy.arange actually uses
+    total = len(numpy.arange(x[0], x[-1], new_resolution))
+
+    starts = numpy.arange(0, len(spectrum), window)
+    bounds = numpy.ceil((x[starts] - x[0]) / step).astype(numpy.int64)
+    bounds = numpy.clip(numpy.append(bounds, total), 0, total)
+    bounds[0] = 0
+    for j, start in enumerate(starts):
+        if bounds[j] >= bounds[j + 1]:
+            continue
+        lo = max(start - overlap, 0)
+        hi = min(start + window + overlap, len(spectrum))
+        yield x[lo:hi], y[lo:hi], x[0], step, bounds[j], bounds[j + 1], total, pick_args
+
+
+def _spline_segment(x, y, x0, step, k_lo, k_hi, total, pick_args):  # Worker: splines one padded window and
+    # evaluates it on grid points k_lo ... k_hi - 1.  When pick_args is given, one extra grid point is evaluated on
+    # each side so maxima at the seams see both neighbours, and only the picked peaks are returned.
+    tck = scipy.interpolate.splrep(x, y, s=0)
+    if pick_args is None:
+        xnew = x0 + numpy.arange(k_lo, k_hi) * step
+        return numpy.column_stack((xnew, scipy.interpolate.splev(xnew, tck, der=0)))
+
+    halo_lo = max(k_lo - 1, 0)
+    halo_hi = min(k_hi + 1, total)
+    xnew = x0 + numpy.arange(halo_lo, halo_hi) * step
+    ynew = scipy.interpolate.splev(xnew, tck, der=0)
+    index = local_maxima(ynew)
+    index = index[(index + halo_lo >= k_lo) & (index + halo_lo < k_hi)]
+    index = index[(ynew[index] > pick_args[0]) & (ynew[index] < pick_args[1])]
+    return numpy.column_stack((xnew[index], ynew[index]))
+
+
+def spline_segments(spectrum, new_resolution, window=SEGMENT_WINDOW, overlap=SEGMENT_OVERLAP,
+                    processes=None):  # Same output as cubic_spline, but yielded in consecutive pieces that are
+    # computed in a process pool.  Peak memory is bounded by the window size instead of the band width.
+    tasks = _segment_tasks(spectrum, new_resolution, window, overlap)
+    yield from _pool_map(_spline_segment, tasks, processes)
+
+
+def segmented_peakpicker(spectrum, new_resolution, thresh_l, thresh_h, window=SEGMENT_WINDOW,
+                         overlap=SEGMENT_OVERLAP, processes=None):  # cubic_spline followed by peakpicker, with
+    # each segment peak picked as soon as it is splined so the full resampled spectrum is never held in memory.
+    tasks = _segment_tasks(spectrum, new_resolution, window, overlap, pick_args=(thresh_l, thresh_h))
+    pieces = list(_pool_map(_spline_segment, tasks, processes))
+
+    x = spectrum[:, 0]
+    step = (x[0] + new_resolution) - x[0]
+    total = len(numpy.arange(x[0], x[-1], new_resolution))
+    peakpicks = numpy.concatenate(pieces) if pieces else numpy.zeros((0, 2))
+    freq_low = x[0]
+    freq_high = x[0] + (total - 1) * step
+    return peakpicks, freq_low, freq_high
+
+
+def spline_peakpicker(spectrum, new_resolution, thresh_l, thresh_h):  # cubic_spline followed by peakpicker
+    return peakpicker(cubic_spline(spectrum, new_resolution), thresh_l, thresh_h)
+
+
+def shared_peakpick(shm_name, shape, row, picker, args):  # Worker for picking many columns at once.  The
+    # frequency axis (row 0) and every intensity column are laid out as rows of one float64 block in shared
+    # memory; the worker attaches to it and runs picker(spectrum, *args) on a read-only (n, 2) strided view whose
+    # columns are row 0 and its own row, so no values are copied.
+    block = shared_memory.SharedMemory(name=shm_name)
+    try:
+        columns = numpy.ndarray(shape, dtype=numpy.float64, buffer=block.buf)
+        spectrum = numpy.lib.stride_tricks.as_strided(columns[0], shape=(shape[1], 2),
+                                                      strides=(columns.strides[1], row * columns.strides[0]),
+                                                      writeable=False)
+        del columns  # Every view has to be released before the block can be closed
+        try:
+            return numpy.array(picker(spectrum, *args)[0])  # Copied, as the block is gone once this returns
+        except BaseException as error:
+            traceback.clear_frames(error.__traceback__)  # The picker's frames may still hold views of the block
+            raise
+        finally:
+            del spectrum
+    finally:
+        block.close()
+
+
+def within_tolerance(freqs, lines, tolerance):  # Mask of the freqs that have at least one of 'lines' strictly
+    # closer than 'tolerance'.  The lines are sorted once and each frequency only checks, with two binary searches,
+    # whether any line falls in its window, so the cost is O((n + m) log m) instead of n * m comparisons.
+    freqs = numpy.asarray(freqs, dtype=float)
+    lines = numpy.sort(numpy.asarray(lines, dtype=float))
+    low = numpy.searchsorted(lines, freqs - tolerance, side="right")
+    high = numpy.searchsorted(lines, freqs + tolerance, side="left")
+    return high > low
+
+
+class InsufficientTransitionsError(Exception):
+    """Too few predicted transitions have an observed peak close enough to them"""
+    pass
+
+
+def intensity_filter(full_list, peaklist, inten_low, filter_level,
+                     window=0.5):  # Intensity filter to give more efficient triples searches for isotopologues.
+    # Keeps the entries of full_list (frequency in column 1) that have an experimental peak at least
+    # filter_level * inten_low strong within 'window' MHz.  The peaks are sorted once and every entry is checked with
+    # two binary searches, so the cost is O((n + m) log m) rather than n * m.
     if filter_level == 0:
         filtered_full_list = full_list
+    else:
+        peaklist = numpy.asarray(peaklist, dtype=float).reshape(-1, 2)
+        comparison_level = filter_level * float(inten_low)
+        # Only keep experimental peaks more intense than the lower cutoff.
+        peak_freqs = numpy.sort(peaklist[peaklist[:, 1] >= comparison_level, 0])
+
+        if isinstance(full_list, numpy.ndarray):
+            entry_freqs = full_list[:, 1].astype(float)
+        else:
+            entry_freqs = numpy.array([float(entry[1]) for entry in full_list])
+        lo = numpy.searchsorted(peak_freqs, entry_freqs - window, side="left")
+        hi = numpy.searchsorted(peak_freqs, entry_freqs + window, side="right")
+        hits = hi > lo  # A peak somewhere in [frequency - window, frequency + window]
+
+        if isinstance(full_list, numpy.ndarray):
+            filtered_full_list = full_list[hits]
+        else:
+            filtered_full_list = [entry for entry, hit in zip(full_list, hits) if hit]
 
     if len(filtered_full_list) < 3:
-        print(
-            "There aren't enough transitions of appropriate intensity close to predicted positions for an isotopologue search.  Check your NS constants, your scale factor, or your spectral data file.")
-        quit()
+        raise InsufficientTransitionsError(
+            "There aren't enough transitions of appropriate intensity close to predicted positions for an isotopologue "
+            "search.  Check your NS constants, your scale factor, or your spectral data file.")
 
     return filtered_full_list
 
 
-def deltanus(peaklist):  # Calculates frequency differences between all peak picked lines
-    totaltrans = numpy.size(peaklist[:, 0])  # total number of transitions in peak pick file
-    freqh1 = numpy.zeros((totaltrans, 1))
-    freql1 = numpy.zeros((totaltrans, 1))
-    for n in range(totaltrans):
-        freqh1[n] = peaklist[n, 0]  # 1st column of mr_peaky file
-        freql1[n] = peaklist[n, 0]  # 1st column of mr_peaky file
-    #    delta_nu_1=numpy.zeros((totaltrans,1))
-    print(totaltrans)
-    # set up two separate 1D arrays that are just the frequency column
-    #    print(freqh1,freql1)
-    for j in range(totaltrans):
-        for i in range(j, totaltrans):
-            delta_nu_1 = freqh1[i] - freql1[j]
-        print(freqh1, freql1, delta_nu_1)
-    return (freqh1, freql1, delta_nu_1)
+def difference_pairs(peaklist, delta, tolerance):  # Rows (low, high) of all pairs of lines whose frequencies
+    # differ by delta +/- tolerance, found with two binary searches per line instead of comparing every pair.
+    order = numpy.argsort(peaklist[:, 0], kind="stable")
+    freqs = peaklist[order, 0]
+    lo = numpy.searchsorted(freqs, freqs + delta - tolerance, side="left")
+    hi = numpy.searchsorted(freqs, freqs + delta + tolerance, side="right")
+    lo = numpy.maximum(lo, numpy.arange(freqs.size) + 1)  # Each pair once, never a line with itself
+    counts = numpy.maximum(hi - lo, 0)
+
+    low = numpy.repeat(numpy.arange(freqs.size), counts)
+    high = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts) + numpy.repeat(lo, counts)
+    return order[low], order[high]
+
+
+def deltanus(peaklist, tolerance=0.01, min_diff=0.0, max_diff=None, min_pairs=3,
+             count=50):  # Finds the frequency differences shared by unusually many pairs of lines.
+    # The lines are binned into a stick spectrum with bins 'tolerance' MHz wide; its autocorrelation, computed with
+    # an FFT, counts the pairs at every binned difference at once.  Each difference is compared with the counts
+    # around it, as a dense peak list has many pairs at any difference by chance.  Returns rows of
+    # (difference, number of pairs, significance), most significant first.
+    if not tolerance > 0:
+        raise ValueError("Tolerance must be positive")
+    freqs = numpy.sort(peaklist[:, 0])
+    if freqs.size < 2:
+        return numpy.zeros((0, 3))
+    length = int(numpy.rint((freqs[-1] - freqs[0]) / tolerance)) + 1
+    if length > MAX_DELTANU_BINS:
+        raise ValueError("Tolerance too small for the span of the peak list: " + str(length) + " bins, at most "
+                         + str(MAX_DELTANU_BINS))
+    bins = numpy.rint((freqs - freqs[0]) / tolerance).astype(numpy.int64)
+    sticks = numpy.bincount(bins, minlength=length).astype(float)
+    size = scipy.fft.next_fast_len(2 * length)
+    transform = scipy.fft.rfft(sticks, size)
+    pairs = numpy.rint(scipy.fft.irfft(transform * numpy.conj(transform), size)[:length])
+    pairs[0] = 0  # Lines paired with themselves
+
+    # A difference on the border of two bins is split between them, so neighbouring bins are counted together
+    padded = numpy.concatenate(([0], pairs, [0]))
+    near = padded[:-2] + padded[1:-1] + padded[2:]
+    # Pairs expected by chance: the average over a wider window
+    total = numpy.concatenate(([0], numpy.cumsum(pairs)))
+    lag = numpy.arange(length)
+    wide = 100
+    background = (total[numpy.minimum(lag + wide + 1, length)] - total[numpy.maximum(lag - wide, 0)]) \
+        / (numpy.minimum(lag + wide + 1, length) - numpy.maximum(lag - wide, 0)) * 3
+    significance = (near - background) / numpy.sqrt(background + 1)
+
+    candidates = local_maxima(significance, plateaus=True)
+    differences = candidates * tolerance
+    keep = (near[candidates] >= min_pairs) & (differences >= min_diff)
+    if max_diff is not None:
+        keep &= differences <= max_diff
+    candidates = candidates[keep]
+    candidates = candidates[numpy.argsort(-significance[candidates], kind="stable")][:count]
+
+    # Report the mean of the actual differences of the supporting pairs rather than the bin centre
+    results = numpy.zeros((candidates.size, 3))
+    for n, candidate in enumerate(candidates):
+        low, high = difference_pairs(peaklist, candidate * tolerance, 1.5 * tolerance)
+        diffs = peaklist[high, 0] - peaklist[low, 0]
+        results[n] = (diffs.mean() if diffs.size else candidate * tolerance, diffs.size, significance[candidate])
+    return results
 
 
 if __name__ == "main":
@@ -127,5 +475,6 @@ if __name__ == "main":
     print(peaklist, file=mr_peaky)
     mr_peaky.close()
 
-    (freqh1, freql1, delta_nu_1) = deltanus(peaklist)
-    # print(,file=output_file)
\ No newline at end of file
+    differences = deltanus(peaklist)
+    print(differences, file=output_file)
+    output_file.close()
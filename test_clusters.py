@@ -0,0 +1,42 @@
+import numpy as np
+
+import clusters
+
+
+# Lines of one species: random strengths with the species' intensity ratios between the columns, plus a little noise
+def species(rng, ratios: list, lines: int, noise: float = 0.01) -> np.ndarray:
+    strengths = rng.lognormal(0.0, 1.0, (lines, 1))
+    return strengths * np.array(ratios) * np.exp(rng.normal(0.0, noise, (lines, len(ratios))))
+
+
+# Two species whose ratios differ by little more than the tolerance stay apart, even with the gap between them
+# filled with noise lines
+def test_nearby_species_with_noise():
+    rng = np.random.default_rng(0)
+    first = species(rng, [1.0, 2.0, 0.5], 300)
+    second = species(rng, [1.0, 2.6, 0.5], 300)
+    noise = rng.lognormal(0.0, 1.0, (20000, 3))
+    labels = clusters.grid_clusters(clusters.log_ratios(np.vstack([first, second, noise]), 0), np.log10(1.1), 5)
+
+    assert np.unique(labels[:300]).size == 1 and np.unique(labels[300:600]).size == 1
+    assert labels[0] != labels[300] and labels[0] != clusters.UNCLUSTERED and labels[300] != clusters.UNCLUSTERED
+    # Every line of a cluster has all its ratios within the tolerance of the cluster's species
+    for label, ratios in ((labels[0], [2.0, 0.5]), (labels[300], [2.6, 0.5])):
+        members = clusters.log_ratios(np.vstack([first, second, noise]), 0)[labels == label]
+        assert np.all(np.abs(members - np.log10(ratios)) < 2 * np.log10(1.1))
+
+
+def test_clean_species_do_not_merge():
+    rng = np.random.default_rng(1)
+    lines = np.vstack([species(rng, [1.0, 2.0, 0.5, 1.0, 1.0], 200, 0.005),
+                       species(rng, [1.0, 2.5, 0.5, 1.0, 1.0], 200, 0.005)])
+    labels = clusters.grid_clusters(clusters.log_ratios(lines, 0), np.log10(1.1))
+    assert labels[:200].tolist() == [0] * 200 or labels[:200].tolist() == [1] * 200
+    assert sorted(set(labels.tolist())) == [0, 1] and labels[0] != labels[200]
+
+
+# Lines missing an intensity and clusters smaller than min_size are left out
+def test_unclustered_lines():
+    values = np.array([[1.0, 2.0], [2.0, 4.0], [1.0, np.nan], [1.0, 100.0]])
+    labels = clusters.grid_clusters(clusters.log_ratios(values, 0), np.log10(1.1), 2)
+    assert labels.tolist() == [0, 0, clusters.UNCLUSTERED, clusters.UNCLUSTERED]
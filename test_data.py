@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import data
+import graph as gph
+
+
+def spectrum(owner) -> data.Data:
+    frame = pd.DataFrame({"Frequency (MHz)": [1.0, 2.0, 3.0, 4.0], "A": [2.0, 4.0, 6.0, 8.0],
+                          "B": [1.0, 2.0, 4.0, 8.0], "C": [4.0, 4.0, 4.0, 4.0]})
+    return data.Data(frame, owner, "spectrum", "Frequency (MHz)")
+
+
+# Dropping an input of a ratio column keeps the ratio's values as a stored column
+def test_drop_input_stores_ratio(owner):
+    dataset = spectrum(owner)
+    data.calc_ratios(dataset, "B")
+    dataset.drop_column("A")
+
+    assert "A/B" not in dataset.derived
+    assert dataset.data_frame["A/B"].tolist() == [2.0, 2.0, 1.5, 1.0]
+    assert dataset.full_frame().columns.tolist() == ["Frequency (MHz)", "B", "C", "A/B", "C/B"]
+    assert data.PickledData(dataset).data_frame["C/B"].tolist() == [4.0, 2.0, 1.0, 0.5]
+
+
+# Columns derived from a derived column are stored when that one is dropped
+def test_drop_derived_input_stores_dependents(owner):
+    dataset = spectrum(owner)
+    data.calc_ratios(dataset, "B")
+    dataset.add_derived("A/B - C/B", ["A/B", "C/B"], np.subtract)
+    dataset.drop_column("A/B")
+
+    assert list(dataset.derived) == ["C/B"]
+    assert dataset.full_frame()["A/B - C/B"].tolist() == [-2.0, 0.0, 0.5, 0.5]
+
+
+# Splitting off an input leaves the ratio columns in the dataset as stored columns
+def test_split_input_stores_ratio(owner):
+    dataset = spectrum(owner)
+    data.calc_ratios(dataset, "B")
+    dataset.split_callback(["B"])
+
+    assert dataset.derived == {}
+    assert dataset.full_frame().columns.tolist() == ["Frequency (MHz)", "A", "C", "A/B", "C/B"]
+    assert dataset.owner.data_storage.added[0]["data"].columns.tolist() == ["Frequency (MHz)", "B"]
+
+
+# A column that is not numeric stops the whole modification before any column is replaced
+def test_modify_all_columns_is_atomic(owner):
+    dataset = spectrum(owner)
+    dataset.data_frame["Name"] = ["a", "b", "c", "d"]
+    with pytest.raises(data.NotNumericError):
+        dataset.modify_data(["A", "B", "Name", "C"], "*", [2.0])
+    assert dataset.data_frame["A"].tolist() == [2.0, 4.0, 6.0, 8.0]
+    assert dataset.data_frame["B"].tolist() == [1.0, 2.0, 4.0, 8.0]
+
+    dataset.modify_data(["A", "B"], "*", [2.0])
+    assert dataset.data_frame["A"].tolist() == [4.0, 8.0, 12.0, 16.0]
+
+
+# A column added after the plot was built is drawn as a line, and refreshing the plot moves its points
+def test_refresh_after_add_column(owner):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    dataset = spectrum(owner)
+    dataset.add_column("Extra", pd.Series([3.0, 1.0, 2.0, 5.0]))
+    assert dataset.graph.column_gtypes["Extra"] == gph.LINE
+
+    plot = Figure().add_subplot()
+    FigureCanvasAgg(plot.figure)
+    artists = {}
+    dataset.graph.plot(plot, artists)
+    assert "Extra" in artists
+
+    dataset.graph.set_scale(2.0, 4.0)
+    dataset.graph.refresh(plot, artists)
+    assert artists["Extra"].get_xdata().tolist() == [2.0, 3.0, 4.0]
+
+
+# Spectra of different steps are interpolated onto the finest step, with NaN outside the range of each
+def test_common_grid_window(owner):
+    coarse = data.Data(pd.DataFrame({"Frequency (MHz)": [0.0, 2.0, 4.0], "A": [0.0, 2.0, 4.0]}), owner, "coarse",
+                       "Frequency (MHz)")
+    fine = data.Data(pd.DataFrame({"Frequency (MHz)": [1.0, 1.5, 2.0, 2.5, 3.0], "A": [1.0, 1.0, 1.0, 1.0, 1.0]}),
+                     owner, "fine", "Frequency (MHz)")
+    grid = data.CommonGrid([coarse, fine])
+    assert grid.limits() == (0.0, 4.0)
+
+    window = grid.window(1.0, 2.0)
+    assert window.columns.tolist() == ["Frequency (MHz)", "A", "A (fine)"]
+    assert window["Frequency (MHz)"].tolist() == [1.0, 1.5, 2.0]
+    assert window["A"].tolist() == [1.0, 1.5, 2.0]
+    assert window["A (fine)"].tolist() == [1.0, 1.0, 1.0]
+
+    # A dataset holding the grid only builds its full frame when asked for it
+    merged = data.Data(None, owner, "merged", "Frequency (MHz)", gtypes=grid.gtypes, grid=grid)
+    assert merged.view(1.0, 2.0)["A"].tolist() == [1.0, 1.5, 2.0]
+    assert merged.grid is not None
+    assert len(merged.data_frame.index) == 9
+    assert merged.grid is None
+    assert np.isnan(merged.data_frame["A (fine)"].iloc[0])
+
+
+# Drawing a lazily resampled dataset, and redrawing it zoomed in, only evaluates the grid over the window
+def test_draw_keeps_grid_lazy(owner):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    coarse = data.Data(pd.DataFrame({"Frequency (MHz)": [0.0, 2.0, 4.0], "A": [0.0, 2.0, 4.0]}), owner, "coarse",
+                       "Frequency (MHz)")
+    fine = data.Data(pd.DataFrame({"Frequency (MHz)": [1.0, 1.5, 2.0, 2.5, 3.0], "A": [1.0, 1.0, 1.0, 1.0, 1.0]}),
+                     owner, "fine", "Frequency (MHz)")
+    grid = data.CommonGrid([coarse, fine])
+    merged = data.Data(None, owner, "merged", "Frequency (MHz)", gtypes=grid.gtypes, grid=grid)
+    assert merged.columns() == ["Frequency (MHz)", "A", "A (fine)"]
+
+    canvas = gph.GraphCanvas(owner)
+    canvas.set_canvas(FigureCanvasAgg(canvas.figure))
+    canvas.set_graph(merged.graph)
+    canvas.graph()
+    merged.graph.set_scale(1.0, 3.0)
+    canvas.graph()
+    canvas.draft()
+    assert merged.grid is not None
+    assert canvas.artists["A (fine)"].get_xdata().tolist() == [1.0, 1.5, 2.0, 2.5, 3.0]
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import filters
+
+
+COLUMNS = {"A": np.array([1.0, 4.0, 5.0, 6.0, np.nan]), "B": np.array([2.0, 2.0, 8.0, -1.0, 3.0])}
+
+
+def mask(text: str, column: str = None) -> list:
+    return filters.Filter(text, column).mask(COLUMNS, 5).tolist()
+
+
+# An expression starting with a comparison is about the chosen column, and comparisons are strict
+def test_implicit_column():
+    assert mask("< 5", "A") == [True, True, False, False, False]
+    assert mask("> 5", "A") == [False, False, False, True, False]
+    assert mask("between 4 and 5", "A") == [False, True, True, False, False]
+    assert filters.Filter("< 5", "A").columns == ["A"]
+
+
+# 'and' binds tighter than 'or', 'not' tighter than both, and arithmetic follows the usual precedence
+def test_precedence():
+    assert mask("{A} < 2 or {A} > 4 and {B} > 0") == [True, False, True, False, False]
+    assert mask("not {B} < 2 and {A} > 0") == [True, True, True, False, False]
+    assert mask("{A} + {B} * 2 == 8") == [False, True, False, False, False]
+    assert mask("({A} + {B}) * 2 == 10") == [False, False, False, True, False]
+    assert mask("-{B} > 0") == [False, False, False, True, False]
+
+
+def test_abs_and_near():
+    assert mask("abs({A} - {B}) > 2") == [False, False, True, True, False]
+    assert mask("{A} near [4.05, -1, 6.5] within 0.1") == [False, True, False, False, False]
+    assert mask("{B} near [-1] within 0.5") == [False, False, False, True, False]
+    assert filters.Filter("abs({A} - {B}) > 2").columns == ["A", "B"]
+
+
+# Every block of rows is evaluated on its own, and the blocks make up the whole mask
+def test_blocks():
+    rng = np.random.default_rng(0)
+    columns = {"A": rng.uniform(0.0, 1.0, 1000)}
+    row_filter = filters.compile_filter("{A} < 0.3 or {A} between 0.6 and 0.7")
+    expected = (columns["A"] < 0.3) | ((columns["A"] >= 0.6) & (columns["A"] <= 0.7))
+    assert np.array_equal(row_filter.mask(columns, 1000, block=64), expected)
+    assert filters.compile_filter("{A} < 0.3 or {A} between 0.6 and 0.7") is row_filter
+
+
+@pytest.mark.parametrize("text", ["", "{A}", "{A} <", "{A} < 5 and", "{A} < 5)", "{A} between 1 or 2",
+                                  "{A} near [1, {B}] within 2", "abs({A} < 5)", "{A} < 5 extra", "{A} ? 5",
+                                  "({A} < 5) + 1"])
+def test_errors(text):
+    with pytest.raises(filters.FilterError):
+        filters.Filter(text)
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import data
+import graph as gph
+
+
+# The nested loop data.remove_from used before peaky.within_tolerance; returns the labels of the rows to remove
+def loop_remove_from(on_nump, from_nump, threshold):
+    to_drop = np.zeros(on_nump.size, dtype=np.int64)
+    index = 0
+    on_index = 0
+    for value in on_nump:
+        for value1 in from_nump:
+            if value + threshold > value1 > value - threshold:
+                to_drop[index] = on_index
+                index += 1
+                break
+        on_index += 1
+    return to_drop[0:index]
+
+
+# The frames data.remove_from builds must be the ones it built from the labels of the loop: the kept rows, the
+# removed rows, and the original dataset with the removed values added back
+def test_remove_from_matches_loop(owner):
+    rng = np.random.default_rng(0)
+    frame = pd.DataFrame({"Frequency (MHz)": np.sort(rng.uniform(6000.0, 18000.0, 300)),
+                          "Intensity": rng.uniform(0.0, 1.0, 300)})
+    catalogue = pd.DataFrame({"Frequency (MHz)": rng.uniform(5000.0, 19000.0, 3000),
+                              "Intensity": rng.uniform(0.0, 1.0, 3000)})
+    on = data.Data(frame.copy(), owner, "peaks", "Frequency (MHz)")
+    values_from = data.Data(catalogue, owner, "catalogue", "Frequency (MHz)")
+    data.remove_from(on, values_from, 50, return_removed=True, add_back=True)
+
+    freqs = frame["Frequency (MHz)"]
+    lines = catalogue["Frequency (MHz)"]
+    to_drop = loop_remove_from(freqs.to_numpy(), lines[(lines < freqs.max()) & (lines > freqs.min())].to_numpy(), 0.05)
+    assert 0 < to_drop.size < freqs.size
+    new_on, removed = [added["data"] for added in owner.data_storage.added]
+    assert new_on.data_frame.equals(frame.drop(axis=0, labels=to_drop))
+    assert removed.data_frame.equals(frame.loc[to_drop])
+    to_back = frame.loc[to_drop].rename(columns={"Intensity": "Intensity (catalogue)"})
+    assert on.data_frame.equals(pd.merge(left=frame, right=to_back, on="Frequency (MHz)", how="outer"))
+
+
+# A peak list and a catalogue with a line exactly 0.5 MHz from 100, one 0.25 MHz from 200 and one far from any peak
+def datasets(owner) -> tuple:
+    on = data.Data(pd.DataFrame({"Frequency (MHz)": [100.0, 200.0, 300.0, 400.0], "Intensity": [1.0, 2.0, 3.0, 4.0]}),
+                   owner, "peaks", "Frequency (MHz)")
+    values_from = data.Data(pd.DataFrame({"Frequency (MHz)": [100.5, 199.75, 350.0], "Intensity": [1.0, 1.0, 1.0]}),
+                            owner, "catalogue", "Frequency (MHz)")
+    return on, values_from
+
+
+# Only rows closer than the threshold to a catalogue line are removed, and they are kept aside when asked for
+def test_remove_from_masks_rows(owner):
+    on, values_from = datasets(owner)
+    data.remove_from(on, values_from, 500, return_removed=True, add_back=False)
+
+    new_on, removed = [added["data"] for added in on.owner.data_storage.added]
+    assert new_on.name == "peaks - catalogue"
+    assert new_on.data_frame["Frequency (MHz)"].tolist() == [100.0, 300.0, 400.0]
+    assert removed.name == "peaks (removed)"
+    assert removed.data_frame["Frequency (MHz)"].tolist() == [200.0]
+    assert on.data_frame["Frequency (MHz)"].tolist() == [100.0, 200.0, 300.0, 400.0]
+
+
+def test_remove_from_without_removed(owner):
+    on, values_from = datasets(owner)
+    data.remove_from(on, values_from, 500, return_removed=False, add_back=False)
+
+    assert [added["data"].name for added in on.owner.data_storage.added] == ["peaks - catalogue"]
+
+
+# With add_back, the removed values come back to the original dataset as a line column of their own
+def test_remove_from_add_back(owner):
+    on, values_from = datasets(owner)
+    data.remove_from(on, values_from, 500, return_removed=False, add_back=True)
+
+    assert on.data_frame.columns.tolist() == ["Frequency (MHz)", "Intensity", "Intensity (catalogue)"]
+    assert on.data_frame["Intensity (catalogue)"].fillna(0.0).tolist() == [0.0, 2.0, 0.0, 0.0]
+    assert on.graph.column_gtypes["Intensity (catalogue)"] == gph.LINE
@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Union
+
+import numpy as np
+import pandas as pd
+
+import peaky
+
+# Triples search for asymmetric tops, in the style of Autofit: three predicted transitions are each assigned to
+# every candidate peak near them, rotational constants are fitted to each resulting triple, and each fit is scored
+# by how many of the other predicted lines it places on an observed peak.
+
+FREQ = "Frequency (MHz)"
+UPPER = ["J'", "Ka'", "Kc'"]
+LOWER = ["J''", "Ka''", "Kc''"]
+RESULT_COLUMNS = ["A (MHz)", "B (MHz)", "C (MHz)", "Matches", "RMS (MHz)",
+                  "Line 1 (MHz)", "Line 2 (MHz)", "Line 3 (MHz)"]
+
+BATCH = 2048  # Triples fitted at once inside a block; bounds the size of the stacked Hamiltonians
+
+_OPERATORS = {}
+_WORKER = {}
+
+
+# Ja^2, Jb^2 and Jc^2 in the symmetric top basis |J, K = -J..J> (a along z, b along x, c along y)
+def _operators(j: int) -> np.ndarray:
+    if j not in _OPERATORS:
+        k = np.arange(-j, j + 1, dtype=np.float64)
+        jj = j * (j + 1)
+        ladder = np.sqrt(np.maximum((jj - k[:-2] * (k[:-2] + 1)) * (jj - (k[:-2] + 1) * (k[:-2] + 2)), 0))
+        raised = np.zeros((k.size, k.size))
+        raised[np.arange(2, k.size), np.arange(k.size - 2)] = ladder  # <K + 2| J+^2 |K>
+        squares = raised + raised.T  # J+^2 + J-^2
+        rest = np.diag((jj - k ** 2) / 2)
+        _OPERATORS[j] = np.stack((np.diag(k ** 2), rest + squares / 4, rest - squares / 4))
+    return _OPERATORS[j]
+
+
+# Rigid rotor energies of level J for every row of constants (A, B, C), in order of tau = Ka - Kc from -J to J.
+# With derivatives, also returns dE/d(A, B, C) from the eigenvectors (Hellmann-Feynman).
+def rotor_levels(constants: np.ndarray, j: int, derivatives: bool = False):
+    operators = _operators(j)
+    hamiltonians = np.einsum("np,pkl->nkl", constants, operators)
+    if not derivatives:
+        return np.linalg.eigvalsh(hamiltonians), None
+    energies, vectors = np.linalg.eigh(hamiltonians)
+    projected = np.matmul(operators[None], vectors[:, None])  # (n, 3, K, level)
+    return energies, np.einsum("nki,npki->nip", vectors, projected)
+
+
+# Frequencies (n, lines) of transitions between levels 'upper' and 'lower' (rows of J, Ka, Kc) for every row of
+# constants, optionally with their derivatives (n, lines, 3)
+def transition_frequencies(constants: np.ndarray, upper: np.ndarray, lower: np.ndarray, derivatives: bool = False):
+    constants = np.atleast_2d(constants)
+    freqs = np.zeros((len(constants), len(upper)))
+    jacobian = np.zeros((len(constants), len(upper), 3)) if derivatives else None
+    for j in np.unique(np.concatenate((upper[:, 0], lower[:, 0]))):
+        energies, slopes = rotor_levels(constants, int(j), derivatives)
+        for levels, sign in ((upper, 1), (lower, -1)):
+            on_j = np.flatnonzero(levels[:, 0] == j)
+            if on_j.size == 0:
+                continue
+            tau = levels[on_j, 1] - levels[on_j, 2] + j
+            freqs[:, on_j] += sign * energies[:, tau]
+            if derivatives:
+                jacobian[:, on_j] += sign * slopes[:, tau]
+    return freqs, jacobian
+
+
+# Newton fit of (A, B, C) to each row of three observed frequencies, starting from the predicted constants.
+# Returns the constants and which rows converged to a physical (A >= B >= C > 0) solution.
+def fit_triples(constants: np.ndarray, observed: np.ndarray, upper: np.ndarray, lower: np.ndarray,
+                iterations: int = 12, accuracy: float = 1e-6):
+    fitted = np.tile(np.asarray(constants, dtype=np.float64), (len(observed), 1))
+    with np.errstate(invalid="ignore", over="ignore"):
+        for _ in range(iterations):
+            freqs, jacobian = transition_frequencies(fitted, upper, lower, derivatives=True)
+            residual = observed - freqs
+            if np.all(np.abs(residual) < accuracy):
+                break
+            fitted += np.matmul(np.linalg.pinv(jacobian), residual[..., None])[..., 0]
+            # Label order is only valid for A >= B >= C; keep diverging rows finite so they simply fail below
+            fitted = np.where(np.isfinite(fitted), fitted, constants)
+        freqs = transition_frequencies(fitted, upper, lower)[0]
+    converged = np.all(np.abs(observed - freqs) < 1000 * accuracy, axis=1)
+    converged &= (fitted[:, 0] >= fitted[:, 1]) & (fitted[:, 1] >= fitted[:, 2]) & (fitted[:, 2] > 0)
+    return fitted, converged
+
+
+# Number of predicted lines that land within 'tolerance' of an observed peak for each row of constants, and the
+# RMS deviation of those matches.  'peaks' must be sorted.
+def score(constants: np.ndarray, upper: np.ndarray, lower: np.ndarray, peaks: np.ndarray, tolerance: float):
+    freqs = transition_frequencies(constants, upper, lower)[0]
+    position = np.searchsorted(peaks, freqs)
+    left = peaks[np.clip(position - 1, 0, peaks.size - 1)]
+    right = peaks[np.clip(position, 0, peaks.size - 1)]
+    deviation = np.where(np.abs(freqs - left) < np.abs(freqs - right), freqs - left, freqs - right)
+    matched = np.abs(deviation) <= tolerance
+    matches = matched.sum(axis=1)
+    rms = np.sqrt(np.where(matched, deviation ** 2, 0).sum(axis=1) / np.maximum(matches, 1))
+    return matches, rms
+
+
+# Best 'keep' rows of results (columns as RESULT_COLUMNS): most matches first, then lowest RMS
+def _rank(results: np.ndarray, keep: int) -> np.ndarray:
+    order = np.lexsort((results[:, 4], -results[:, 3]))
+    return results[order[:keep]]
+
+
+# Gives every worker process the arrays shared by all blocks once, instead of with every block
+def _init_worker(constants, upper, lower, score_upper, score_lower, peaks, tolerance, keep):
+    _WORKER.update(constants=constants, upper=upper, lower=lower, score_upper=score_upper, score_lower=score_lower,
+                   peaks=peaks, tolerance=tolerance, keep=keep)
+
+
+# Worker: fits and scores every triple with 'first' as the first line and any of 'seconds'/'thirds' as the others.
+# A peak assigned to two of the transitions gives degenerate constants, so such triples are left out.
+def _search_block(first: float, seconds: np.ndarray, thirds: np.ndarray) -> np.ndarray:
+    shared = _WORKER
+    second, third = np.meshgrid(seconds, thirds, indexing="ij")
+    second, third = second.ravel(), third.ravel()
+    distinct = (second != third) & (second != first) & (third != first)
+    observed = np.column_stack((np.full(distinct.sum(), first), second[distinct], third[distinct]))
+
+    results = [np.zeros((0, len(RESULT_COLUMNS)))]
+    for start in range(0, len(observed), BATCH):
+        batch = observed[start:start + BATCH]
+        fitted, converged = fit_triples(shared["constants"], batch, shared["upper"], shared["lower"])
+        if not np.any(converged):
+            continue
+        fitted, batch = fitted[converged], batch[converged]
+        matches, rms = score(fitted, shared["score_upper"], shared["score_lower"], shared["peaks"],
+                             shared["tolerance"])
+        results.append(np.column_stack((fitted, matches, rms, batch)))
+    return _rank(np.concatenate(results), shared["keep"])
+
+
+# Peaks (rows of frequency/intensity) within 'window' MHz of 'freq', strongest 'count' first
+def candidates(peaks: np.ndarray, freq: float, window: float, count: int, inten_min: float = 0.0) -> np.ndarray:
+    near = peaks[(np.abs(peaks[:, 0] - freq) <= window) & (peaks[:, 1] >= inten_min)]
+    return near[np.argsort(-near[:, 1], kind="stable")[:count], 0]
+
+
+# Runs a triples search.
+# prediction: table from utils.read_cat; transitions: the three rows of it to assign; constants: predicted A, B, C
+# peaks: rows of observed frequency/intensity; window: search range (MHz) around each predicted line
+# tolerance: how close (MHz) a predicted line must be to a peak to count as a match
+# max_candidates/inten_min: intensity pruning of the peaks tried for each line
+# score_lines: strongest predicted lines used for scoring; filter_level > 0 additionally keeps only those with a
+# strong enough peak nearby (peaky.intensity_filter)
+# progress(done, total) is called as blocks finish; setting the 'cancel' event stops the search early.
+# Returns the ranked fits and the number of blocks done out of the total.
+def triples_search(prediction: pd.DataFrame, transitions: list, constants: Union[list, tuple], peaks: np.ndarray,
+                   window: float = 100.0, tolerance: float = 0.1, max_candidates: int = 30, inten_min: float = 0.0,
+                   score_lines: int = 60, filter_level: float = 0, keep: int = 100, processes: int = None,
+                   progress: Callable[[int, int], None] = None, cancel=None):
+    prediction = prediction.dropna(subset=UPPER + LOWER)
+    peaks = np.asarray(peaks, dtype=np.float64).reshape(-1, 2)
+    constants = np.asarray(constants, dtype=np.float64)
+
+    chosen = prediction.loc[list(transitions)]
+    upper = chosen[UPPER].to_numpy(dtype=np.int64)
+    lower = chosen[LOWER].to_numpy(dtype=np.int64)
+    lists = [candidates(peaks, freq, window, max_candidates, inten_min) for freq in chosen[FREQ]]
+
+    scoring = prediction.sort_values(by="Log Intensity", ascending=False).drop_duplicates(subset=UPPER + LOWER)
+    scoring = scoring.head(score_lines)
+    if filter_level > 0:  # Only score with lines that have a strong enough peak close to them
+        entries = np.column_stack((np.arange(len(scoring)), scoring[FREQ].to_numpy(dtype=np.float64)))
+        entries = peaky.intensity_filter(entries, peaks, inten_min, filter_level, window)
+        scoring = scoring.iloc[entries[:, 0].astype(np.int64)]
+    shared = (constants, upper, lower, scoring[UPPER].to_numpy(dtype=np.int64),
+              scoring[LOWER].to_numpy(dtype=np.int64), np.sort(peaks[:, 0]), tolerance, keep)
+
+    total = len(lists[0]) if len(lists[1]) and len(lists[2]) else 0
+    results = [np.zeros((0, len(RESULT_COLUMNS)))]
+    done = 0
+    if processes == 1:
+        _init_worker(*shared)
+        for first in lists[0][:total]:
+            if cancel is not None and cancel.is_set():
+                break
+            results.append(_search_block(first, lists[1], lists[2]))
+            done += 1
+            if progress is not None:
+                progress(done, total)
+    elif total > 0:
+        workers = min(processes or os.cpu_count() or 1, total)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=shared) as executor:
+            futures = [executor.submit(_search_block, first, lists[1], lists[2]) for first in lists[0]]
+            for future in as_completed(futures):
+                if cancel is not None and cancel.is_set():
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    break
+                results.append(future.result())
+                done += 1
+                if progress is not None:
+                    progress(done, total)
+
+    ranked = _rank(np.concatenate(results), keep)
+    return pd.DataFrame(ranked, columns=RESULT_COLUMNS), done, total
@@ -53,6 +53,18 @@ def add_file_type():
     pass
 
 
+# Reads an SPCAT .cat prediction, which is fixed width: frequency, error, log10 intensity, degrees of freedom, lower
+# state energy, upper state degeneracy, tag, quantum number format, then up to six 2-character quantum numbers for
+# the upper and for the lower state.  Only the first three quantum numbers of each state (N/J, Ka, Kc) are kept.
+def read_cat(path: AnyStr) -> pd.DataFrame:
+    widths = [13, 8, 8, 2, 10, 3, 7, 4] + [2] * 12
+    names = ["Frequency (MHz)", "Error", "Log Intensity", "DR", "Lower Energy", "GUP", "Tag", "QNFMT",
+             "J'", "Ka'", "Kc'", "Q4'", "Q5'", "Q6'", "J''", "Ka''", "Kc''", "Q4''", "Q5''", "Q6''"]
+    catalogue = pd.read_fwf(path, widths=widths, names=names, header=None)
+    catalogue = catalogue[["Frequency (MHz)", "Error", "Log Intensity", "J'", "Ka'", "Kc'", "J''", "Ka''", "Kc''"]]
+    return catalogue.apply(pd.to_numeric, errors="coerce")
+
+
 class File:
     def __init__(self, file: AnyStr):
         self.path = file
@@ -177,6 +189,13 @@ class FileManager:
         dat = data.Data(data_frame=df, owner=self.owner, name=name, freq_ax=freq_ax)
         self.owner.data_storage.add_data(dat)
 
+    # Full prediction table (quantum numbers included) of a .cat file that has been added, for the triples search
+    def load_prediction(self, name: AnyStr) -> pd.DataFrame:
+        file = self.files[name]
+        if file.type != 'cat':
+            raise InvalidTypeException
+        return read_cat(file.path)
+
     def new_association(self, file_type, func):
         self.custom_type.append(file_type)
         self.custom_funcs[file_type] = func